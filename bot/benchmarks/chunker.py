@@ -0,0 +1,125 @@
+"""
+Markdown chunking, the old concatenating chunk_with_size against MarkdownChunker,
+one shot and streamed the way GptReplyStream flushes a reply
+
+    python benchmarks/chunker.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.helpers.string import MarkdownChunker, chunk_with_size
+
+KIB = 1024
+MIB = 1024 * KIB
+
+
+def old_chunk_with_size(content: str, chunk_size: int):
+    """
+    chunk_with_size before MarkdownChunker, kept verbatim
+    """
+
+    formatted = [""]
+
+    if content is None:
+        return formatted
+
+    accum = 0
+    code_block = False
+    code_block_syntax = ""
+    for line in content.splitlines(keepends=True):
+        # preserve code block
+        if "```" in line:
+            code_block = not code_block
+            code_block_syntax = line
+        # append chunk
+        formatted[-1] += line
+        accum += len(line)
+        # close this chunk
+        if accum >= chunk_size:
+            if code_block:
+                formatted[-1] += "```"
+
+            # begins new chunk
+            formatted.append("")
+
+            if code_block:
+                formatted[-1] += f"{code_block_syntax}\n"
+            accum = 0
+
+    if formatted[-1].isspace() or formatted[-1] == "":
+        formatted.pop()
+
+    return formatted
+
+
+def make_markdown(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "`code`", "**bold**", "x"]
+    lines = []
+    total = 0
+    while total < size:
+        if rng.random() < 0.05:
+            block = ["```python\n"]
+            for _ in range(rng.randint(1, 20)):
+                block.append(f"print({rng.randint(0, 999)})\n")
+            block.append("```\n")
+        else:
+            block = [" ".join(rng.choices(words, k=rng.randint(1, 30))) + "\n"]
+        lines += block
+        total += sum(map(len, block))
+    return "".join(lines)[:size]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def one_shot(label: str, text: str, chunk_size: int):
+    old, old_chunks = timed(old_chunk_with_size, text, chunk_size)
+    new, new_chunks = timed(chunk_with_size, text, chunk_size)
+    print(
+        f"{label}: old {old:7.1f} ms, {len(old_chunks)} chunks "
+        f"(max {max(map(len, old_chunks))}), new {new:7.1f} ms, "
+        f"{len(new_chunks)} chunks (max {max(map(len, new_chunks))})"
+    )
+
+
+def streamed(text: str, chunk_size: int, flush: int):
+    def rechunk():
+        # what every flush did, chunk the whole reply so far
+        for end in range(flush, len(text) + flush, flush):
+            old_chunk_with_size(text[:end], chunk_size)
+
+    def incremental():
+        chunker = MarkdownChunker(chunk_size)
+        chunks = []
+        for start in range(0, len(text), flush):
+            chunks += chunker.feed(text[start : start + flush])
+            chunker.peek()
+        return chunks + chunker.close()
+
+    old, _ = timed(rechunk)
+    new, _ = timed(incremental)
+    print(
+        f"{len(text) // KIB} KiB streamed in {flush} B flushes: "
+        f"old re-chunking {old:7.1f} ms, new feed + peek {new:7.1f} ms"
+    )
+
+
+def main():
+    one_shot("8 MiB, chunk_size=1 MiB", make_markdown(8 * MIB), MIB)
+    one_shot("2 MiB, chunk_size=1 MiB", make_markdown(2 * MIB), MIB)
+    one_shot("8 MiB, chunk_size=3800", make_markdown(8 * MIB), 3800)
+    one_shot("4 MiB single line, chunk_size=3800", "x " * (2 * MIB), 3800)
+    streamed(make_markdown(256 * KIB), 3800, 256)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Peak memory of one gpti generation, b64_json against streaming by url
+
+A local stand-in for the images API serves a 1024x1024 png, every mode runs in
+its own warmed process so peak RSS (VmHWM after clear_refs) is its own, linux
+only. The transcode workers are not counted
+
+    python benchmarks/gpti_output.py
+"""
+
+import asyncio
+import base64
+import gc
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from io import BytesIO
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+PORT = 8767
+API = f"http://127.0.0.1:{PORT}/v1"
+
+
+def make_png():
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (1024, 1024), os.urandom(1024 * 1024 * 3))
+    encoded = BytesIO()
+    image.save(encoded, "PNG")
+    return encoded.getvalue()
+
+
+def serve():
+    from aiohttp import web
+
+    data = make_png()
+
+    async def generate(request: web.Request):
+        body = await request.json()
+        if body["response_format"] == "b64_json":
+            item = {"b64_json": base64.b64encode(data).decode()}
+        else:
+            item = {"url": f"http://127.0.0.1:{PORT}/image.png"}
+        item["revised_prompt"] = body["prompt"]
+        return web.json_response({"created": 0, "data": [item] * body.get("n", 1)})
+
+    async def image(_: web.Request):
+        return web.Response(body=data, content_type="image/png")
+
+    app = web.Application()
+    app.add_routes(
+        [web.post("/v1/images/generations", generate), web.get("/image.png", image)]
+    )
+    web.run_app(app, host="127.0.0.1", port=PORT, print=None)
+
+
+def status_kib(field: str):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1])
+
+
+def measure(mode: str, output: str, n: int):
+    os.chdir(root)
+    os.environ.update(OPENAI_KEY="bench", OPENAI_API=API)
+
+    from common.cog import DroppyCog
+    from common.config import load_config
+
+    DroppyCog.config = load_config()
+    DroppyCog.config.gpti.response_format = mode
+    DroppyCog.config.gpti.output = output
+
+    from common.endpoint import DroppyEndpointPool
+    from common.media import DroppyMediaPipeline
+
+    DroppyCog.endpoints = DroppyEndpointPool.from_env(16, 2, 0)
+    DroppyCog.media = DroppyMediaPipeline(2)
+    DroppyCog.media.start()
+
+    from modules.gpti.gpti import GPTIHandler
+    from modules.gpti.models.input import GptiInputModel
+
+    class Author:
+        id = 1
+
+    async def generate(cog: GPTIHandler):
+        input_model = GptiInputModel(model="dall-e-2", prompt="bench", size="1024x1024")
+        images = await cog.request_images(input_model, Author, n)
+        files = [await cog.read_output(image) for image in images]
+        del images
+        # stand-in for discord streaming the multipart upload
+        for file in files:
+            while file.read(1 << 16):
+                pass
+            file.close()
+
+    async def main():
+        cog = GPTIHandler()
+        # warm up sessions, imports and the pool
+        await generate(cog)
+        gc.collect()
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        base = status_kib("VmRSS")
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        await generate(cog)
+        elapsed = (time.perf_counter() - start) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+
+        rss = (status_kib("VmHWM") - base) / 1024
+        print(
+            f"{mode:9} {output:5} n={n}: peak RSS +{rss:5.1f} MiB, "
+            f"py peak {peak / 2**20:5.1f} MiB, {elapsed:5.0f} ms"
+        )
+        await cog.cog_unload()
+        DroppyCog.media.shutdown()
+
+    asyncio.run(main())
+
+
+def main():
+    server = subprocess.Popen([sys.executable, __file__, "--serve"])
+    try:
+        time.sleep(2)
+        for output in ("png", "webp"):
+            for n in (1, 4):
+                for mode in ("b64_json", "url"):
+                    result = subprocess.run(
+                        [sys.executable, __file__, "--measure", mode, output, str(n)],
+                        check=True,
+                        capture_output=True,
+                        text=True,
+                    )
+                    # config loading chatters on stdout, the figures come last
+                    print(result.stdout.splitlines()[-1])
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve()
+    elif sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
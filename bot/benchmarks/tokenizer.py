@@ -0,0 +1,81 @@
+"""
+Token counting over a 100k token conversation, per configured encoding
+
+Uses the real BPE tables when they can be loaded from the tiktoken cache or
+downloaded, the character estimate otherwise, the output says which
+
+    python benchmarks/tokenizer.py [encoding ...]
+"""
+
+import os
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(root, "rules/gpt/tiktoken"))
+
+import common.logger as logger
+
+from modules.gpt.tokenizer import GptTokenCounter
+
+
+# no bot to log through, a failed load is reported on stderr
+logger.error = lambda msg, mention=True: print(msg, file=sys.stderr)
+
+
+TURN = (
+    "The quick brown fox jumps over the lazy dog, then naps in the sun. "
+    "敏捷的棕色狐狸跳过了懒狗, 然后在阳光下打盹。 "
+)
+
+
+def conversation(tokens: int, counter: GptTokenCounter):
+    """
+    Alternate user and assistant turns until about tokens long
+    """
+
+    messages = []
+    total = 0
+    while total < tokens:
+        role = "user" if len(messages) % 2 == 0 else "assistant"
+        # vary turns so the memo cannot collapse them
+        message = {"role": role, "content": f"#{len(messages)} " + TURN * 12}
+        total += counter.count_message(message)
+        messages.append(message)
+    counter.counted.clear()
+    return messages
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    for name in sys.argv[1:] or ["cl100k_base", "o200k_base"]:
+        counter = GptTokenCounter(name)
+        loaded, load_ms = timed(counter.load)
+        mode = "bpe" if loaded else "estimate"
+        messages = conversation(100_000, counter)
+
+        count = lambda: sum([counter.count_message(m) for m in messages])
+        tokens, cold = timed(count)
+        _, memoized = timed(count)
+        # what a new turn costs, every earlier turn is memoized
+        messages.append({"role": "user", "content": "#new " + TURN})
+        _, turn = timed(count)
+
+        text = "".join([m["content"] for m in messages])
+        _, truncate = timed(lambda: counter.truncate_text(text, 8_000))
+
+        print(
+            f"{name} ({mode}, load {load_ms:.0f} ms): {len(messages)} messages, "
+            f"{tokens:,} tokens | cold {cold:.1f} ms, memoized {memoized:.2f} ms, "
+            f"new turn {turn:.2f} ms, truncate to 8k {truncate:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Trio cache startup cost by cache size, the old per-zip directory walk against
+opening the artifact index
+
+    python benchmarks/trio_store.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.trio.resource.store import TrioArtifactStore
+
+
+def walk(path: str, timestamps: list[str]):
+    """
+    What invalidate_cache did, every file matched against every artifact
+    """
+
+    for root, _, files in os.walk(path):
+        for f in files:
+            for timestamp in timestamps:
+                if timestamp in f:
+                    os.path.getctime(os.path.join(root, f))
+
+
+def main():
+    for n in (100, 1000, 5000):
+        path = tempfile.mkdtemp()
+        store = TrioArtifactStore(path, 1 << 40, 7)
+        timestamps = [f"{i:08d}" for i in range(n)]
+        for timestamp in timestamps:
+            blob = store.write(os.urandom(64), "jpeg")
+            store.put(timestamp, [("image_1_1.jpeg", blob)])
+        store.close()
+
+        start = time.perf_counter()
+        walk(path, timestamps)
+        walked = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        store = TrioArtifactStore(path, 1 << 40, 7)
+        opened = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        store.sweep()
+        swept = (time.perf_counter() - start) * 1000
+
+        print(
+            f"{n:5} artifacts: walk {walked:9.1f} ms, "
+            f"open {opened:.2f} ms, sweep {swept:.2f} ms"
+        )
+        store.close()
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
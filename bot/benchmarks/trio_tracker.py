@@ -0,0 +1,117 @@
+"""
+Upstream requests of the shared trio job tracker, batched tag queries against
+one poll per token, for concurrent commands against a local stand-in of the
+orchestration api
+
+    python benchmarks/trio_tracker.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CIVITAI_API_TOKEN", "bench")
+
+import modules.trio.poller as poller
+
+from common.models.trio import TrioPollModel
+from modules.trio.tracker import TrioJobTracker
+
+PORT = 8769
+COMMANDS = 20
+JOBS_PER_COMMAND = 4
+
+
+class Orchestration:
+    """
+    Jobs that finish at fixed offsets from the start of a run
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.done_at: dict[str, float] = {}
+        self.requests = 0
+
+    def status(self, job_id: str):
+        elapsed = time.time() - self.started
+        done = elapsed >= self.done_at[job_id]
+        return {
+            "jobId": job_id,
+            "scheduled": not done,
+            "result": {"available": done},
+            "lastEvent": {"type": "Claimed"} if elapsed > 0.2 else None,
+        }
+
+    async def query(self, request: web.Request):
+        self.requests += 1
+        await request.json()
+        jobs = [self.status(job_id) for job_id in self.done_at]
+        return web.json_response({"jobs": jobs, "cursor": None})
+
+    async def get(self, request: web.Request):
+        self.requests += 1
+        token = request.query["token"]
+        jobs = [
+            self.status(job_id) for job_id in self.done_at if job_id.startswith(token)
+        ]
+        return web.json_response({"jobs": jobs})
+
+
+async def run(batch: bool):
+    orchestration = Orchestration()
+    app = web.Application()
+    app.add_routes(
+        [
+            web.post("/v1/consumer/jobs/query", orchestration.query),
+            web.get("/v1/consumer/jobs", orchestration.get),
+        ]
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    config = TrioPollModel(
+        min_interval=0.1,
+        max_interval=0.4,
+        backoff=1.5,
+        connections=4,
+        downloads=2,
+        request_timeout=5,
+        batch=batch,
+    )
+    job_poller = poller.TrioJobPoller(config)
+    tracker = TrioJobTracker(job_poller, config)
+    try:
+        futures = []
+        for command in range(COMMANDS):
+            token = f"token{command}"
+            job_ids = [f"{token}-{i}" for i in range(JOBS_PER_COMMAND)]
+            for i, job_id in enumerate(job_ids):
+                orchestration.done_at[job_id] = 1.0 + 0.05 * command + 0.1 * i
+            futures += tracker.track(token, tracker.tag(), job_ids)
+        jobs = await asyncio.gather(*futures)
+        elapsed = time.time() - orchestration.started
+    finally:
+        await tracker.close()
+        await job_poller.close()
+        await runner.cleanup()
+
+    mode = "batch" if batch else "per token"
+    print(
+        f"{mode:9}: {len(jobs)} jobs in {tracker.ticks} ticks, "
+        f"{orchestration.requests} upstream requests, {elapsed:.2f} s"
+    )
+
+
+def main():
+    poller.ORCHESTRATION_API = f"http://127.0.0.1:{PORT}"
+    for batch in (True, False):
+        asyncio.run(run(batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,10 @@ import discord
 import os
 
 from .config import DroppyBotConfig, load_json, save_json
+from .endpoint import DroppyEndpointPool
 from .exception import failsafe_ainvoke, DroppyBotError
 from .logger import log
+from .media import DroppyMediaPipeline
 from .translator import DroppyTranslator
 from discord.ext import commands
 from functools import wraps
@@ -26,7 +28,9 @@ class DroppyCog(commands.Cog):
     ctx_locales = {}
     cwd: str
     enabled_modules = {}
+    endpoints: DroppyEndpointPool = None
     help_info = {}
+    media: DroppyMediaPipeline = None
     on_maintenance = False
     sneaky_mode = False
     translator: DroppyTranslator = None
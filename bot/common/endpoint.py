@@ -0,0 +1,374 @@
+import asyncio
+import common.metrics as metrics
+import openai
+import os
+import time
+
+from .scheduler import DroppyScheduler, PositionCallback, TokenBucket
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+# failures that did not reach the model, safe to try elsewhere
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+# held back after a 429 that did not say for how long
+RETRY_AFTER = 1.0
+
+
+class DroppyHedgeLost(Exception):
+    """
+    Both the primary and the secondary raced against it failed for one call
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(error)
+        self.error = error
+
+
+class DroppyEndpoint:
+    """
+    An openAI compatible client with sliding window health stats
+
+    Latencies are kept per kind of call, a stream opening and a full image
+    generation take nothing alike
+    """
+
+    def __init__(self, name: str, client: openai.AsyncOpenAI, window: int):
+        self.name = name
+        self.client = client
+        self.window = window
+        self.latencies: dict[str, deque[float]] = {}
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.hedged = 0
+        self.retried = 0
+        self.request_bucket = TokenBucket()
+        self.token_bucket = TokenBucket()
+        self.throttled_until = 0.0
+
+    def latencies_of(self, kind: str):
+        latencies = self.latencies.get(kind, None)
+        if latencies is None:
+            latencies = self.latencies[kind] = deque(maxlen=self.window)
+        return latencies
+
+    def percentile(self, p: float, kind: str = "chat"):
+        latencies = self.latencies.get(kind, None)
+        if not latencies:
+            return 0.0
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    @property
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def score(self, kind: str = "chat"):
+        """
+        Lower is healthier, untried endpoints score best so they get sampled
+        """
+
+        if not self.outcomes:
+            return 0.0
+        if not self.latencies.get(kind, None):
+            # untried for this kind but answering others, sample it too
+            return 0.0 if any(self.latencies.values()) else float("inf")
+        penalty = (1.0 + 4.0 * self.error_rate) * (1 + self.inflight)
+        return self.percentile(0.5, kind) * penalty
+
+    def wait_time(self, tokens: int):
+        return max(
+            self.request_bucket.wait_time(1),
+            self.token_bucket.wait_time(tokens),
+            self.throttled_until - time.monotonic(),
+            0.0,
+        )
+
+    def reserve(self, tokens: int):
+        self.request_bucket.take(1)
+        self.token_bucket.take(tokens)
+
+    def update_limits(self, headers):
+        """
+        Learn rate limits from provider response headers
+        """
+
+        for bucket, kind in (
+            (self.request_bucket, "requests"),
+            (self.token_bucket, "tokens"),
+        ):
+            bucket.update(
+                headers.get(f"x-ratelimit-limit-{kind}"),
+                headers.get(f"x-ratelimit-remaining-{kind}"),
+                headers.get(f"x-ratelimit-reset-{kind}"),
+            )
+
+    def throttle(self, headers):
+        """
+        Hold the endpoint back after a 429 for as long as the provider asks
+        """
+
+        retry_after = RETRY_AFTER
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except ValueError:
+            pass
+        self.throttled_until = max(
+            self.throttled_until, time.monotonic() + retry_after
+        )
+
+    def record(self, latency: float, ok: bool, kind: str = "chat"):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies_of(kind).append(latency)
+        else:
+            self.errors += 1
+
+    def __str__(self):
+        latencies = "".join(
+            [
+                f"- {kind} p50/p95: {self.percentile(0.5, kind) * 1000:.0f}"
+                f"/{self.percentile(0.95, kind) * 1000:.0f}ms\n"
+                for kind in self.latencies
+            ]
+        )
+        return (
+            f"- requests: {self.requests:,} ({self.inflight} in flight)\n"
+            f"- errors: {self.errors:,} ({self.error_rate:.1%} recent)\n"
+            f"{latencies}"
+            f"- hedged: {self.hedged:,}\n"
+            f"- retried: {self.retried:,}\n"
+            f"- rpm: {self.request_bucket}\n"
+            f"- tpm: {self.token_bucket}"
+        )
+
+
+class DroppyEndpointPool:
+    """
+    Route openAI requests to the healthiest endpoint
+
+    Requests are queued until an endpoint's rate limits allow them,
+    retries retryable failures on the next endpoint,
+    optionally hedges to it when the first exceeds its p95 latency
+
+    Rate limited requests go back in the queue, up to max_requeues times
+    """
+
+    def __init__(
+        self,
+        endpoints: list[DroppyEndpoint],
+        hedge_min_samples: int,
+        max_requeues: int,
+    ):
+        self.endpoints = endpoints
+        self.hedge_min_samples = hedge_min_samples
+        self.max_requeues = max_requeues
+        self.scheduler = DroppyScheduler(self)
+        self.requeued = 0
+
+    @staticmethod
+    def from_env(window: int, hedge_min_samples: int, max_requeues: int):
+        endpoints = [
+            DroppyEndpoint(
+                "primary",
+                openai.AsyncOpenAI(
+                    api_key=os.environ["OPENAI_KEY"], base_url=os.environ["OPENAI_API"]
+                ),
+                window,
+            ),
+        ]
+        # the alternative endpoint is optional
+        if os.environ.get("OPENAI_ALT_KEY"):
+            endpoints.append(
+                DroppyEndpoint(
+                    "alt",
+                    openai.AsyncOpenAI(
+                        api_key=os.environ["OPENAI_ALT_KEY"],
+                        base_url=os.environ["OPENAI_ALT_API"],
+                    ),
+                    window,
+                )
+            )
+        return DroppyEndpointPool(endpoints, hedge_min_samples, max_requeues)
+
+    def ranked(self, kind: str = "chat"):
+        return sorted(self.endpoints, key=lambda e: e.score(kind))
+
+    def reserve(self, tokens: int, kind: str = "chat"):
+        """
+        Reserve the healthiest endpoint with rate limit room
+
+        Return the endpoint, or None and how long until one frees up
+        """
+
+        waits = []
+        for endpoint in self.ranked(kind):
+            wait = endpoint.wait_time(tokens)
+            if not wait:
+                endpoint.reserve(tokens)
+                return endpoint, 0.0
+            waits.append(wait)
+        return None, min(waits)
+
+    def spare(self, endpoint: Optional[DroppyEndpoint], tokens: int):
+        """
+        Take from an extra endpoint only if it has room right now
+        """
+
+        if not endpoint or endpoint.wait_time(tokens):
+            return False
+        endpoint.reserve(tokens)
+        return True
+
+    async def attempt(
+        self,
+        endpoint: DroppyEndpoint,
+        call: Callable[[openai.AsyncOpenAI], Awaitable[T]],
+        kind: str,
+    ) -> T:
+        start = time.perf_counter()
+        endpoint.inflight += 1
+        try:
+            # streams return once headers arrive, so this is time to first byte
+            with metrics.timer("endpoint", endpoint.name):
+                response = await call(endpoint.client.with_raw_response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            endpoint.record(time.perf_counter() - start, False, kind)
+            if isinstance(e, openai.APIStatusError):
+                endpoint.update_limits(e.response.headers)
+            if isinstance(e, openai.RateLimitError):
+                endpoint.throttle(e.response.headers)
+            raise
+        finally:
+            endpoint.inflight -= 1
+
+        endpoint.record(time.perf_counter() - start, True, kind)
+        endpoint.update_limits(response.headers)
+        return response.parse()
+
+    async def hedged(
+        self,
+        primary: DroppyEndpoint,
+        secondary: DroppyEndpoint,
+        call: Callable[[openai.AsyncOpenAI], Awaitable[T]],
+        tokens: int,
+        kind: str,
+    ) -> T:
+        """
+        Race the secondary endpoint once primary exceeds its p95 latency
+        for this kind of call
+
+        Raise DroppyHedgeLost if both raced and failed, a primary failure
+        before the race is raised as is
+        """
+
+        first = asyncio.create_task(self.attempt(primary, call, kind))
+        timeout = primary.percentile(0.95, kind)
+        done, _ = await asyncio.wait([first], timeout=timeout)
+        if done or not self.spare(secondary, tokens):
+            return await first
+
+        secondary.hedged += 1
+        second = asyncio.create_task(self.attempt(secondary, call, kind))
+        done, _ = await asyncio.wait(
+            [first, second], return_when=asyncio.FIRST_COMPLETED
+        )
+        if not [t for t in done if not t.exception()]:
+            # the other one may still come through
+            done, _ = await asyncio.wait([first, second])
+
+        winner = None
+        for task in (first, second):
+            if not task.done():
+                task.cancel()
+            elif not task.exception():
+                if winner is None:
+                    winner = task.result()
+                elif hasattr(task.result(), "close"):
+                    # both streams opened, release the loser's connection
+                    await task.result().close()
+
+        if winner is None:
+            raise DroppyHedgeLost(first.exception() or second.exception())
+        return winner
+
+    async def dispatch(
+        self,
+        primary: DroppyEndpoint,
+        call: Callable[[openai.AsyncOpenAI], Awaitable[T]],
+        tokens: int,
+        idempotent: bool,
+        hedge: bool,
+        kind: str,
+    ) -> T:
+        others = [e for e in self.ranked(kind) if e is not primary]
+        secondary = others[0] if others else None
+
+        can_hedge = (
+            hedge
+            and secondary is not None
+            and len(primary.latencies_of(kind)) >= self.hedge_min_samples
+        )
+
+        try:
+            if can_hedge:
+                return await self.hedged(primary, secondary, call, tokens, kind)
+            return await self.attempt(primary, call, kind)
+        except DroppyHedgeLost as e:
+            # hedging already gave the secondary its shot
+            raise e.error from None
+        except RETRYABLE_ERRORS:
+            if not idempotent or not secondary:
+                raise
+            if not self.spare(secondary, tokens):
+                raise
+            secondary.retried += 1
+            return await self.attempt(secondary, call, kind)
+
+    async def invoke(
+        self,
+        call: Callable[[openai.AsyncOpenAI], Awaitable[T]],
+        *,
+        user_id: int = 0,
+        tokens: int = 0,
+        on_position: Optional[PositionCallback] = None,
+        idempotent: bool = True,
+        hedge: bool = False,
+        kind: str = "chat",
+    ) -> T:
+        """
+        Invoke a call with an endpoint client once scheduled
+
+        Calls receive the raw response client, headers are consumed here.
+        Kind names the latency window the call is measured and hedged by
+        """
+
+        requeues = 0
+        while True:
+            primary = await self.scheduler.acquire(user_id, tokens, on_position, kind)
+            try:
+                return await self.dispatch(
+                    primary, call, tokens, idempotent, hedge, kind
+                )
+            except openai.RateLimitError:
+                # a 429 is rejected before the model runs, bursts queue instead
+                if requeues >= self.max_requeues:
+                    raise
+                requeues += 1
+                self.requeued += 1
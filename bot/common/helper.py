@@ -1,5 +1,4 @@
-import time
-
+from .helpers.cache import *
 from .helpers.string import *
 from .helpers.timestamp import *
 from .helpers.iterable import *
@@ -18,22 +17,6 @@ def first_iequal(iterable: Iterable[T], key: str, rhs: str):
     return first_if(iterable, lambda i: iequal(extract_attr(i, key), rhs))
 
 
-latency_sessions = {}
-
-
-def latency_start(session_id: int):
-    start = time.perf_counter()
-    latency_sessions[session_id] = start
-    return start
-
-
-def latency_end(session_id: int):
-    elapsed = time.perf_counter() - latency_sessions[session_id]
-    elapsed = int(round(elapsed * 1000))
-    del latency_sessions[session_id]
-    return elapsed
-
-
 def sanitize(command):
     """
     Remove leading/trailing spaces from all parameters
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Least recently used cache with optional time to live
+
+    Capacity counts entries, or total weight if a weigher is given
+
+    on_evict is called for entries dropped by capacity or expiry, not by pop
+
+    Tracks hit/miss counters for telemetry
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        ttl: Optional[float] = None,
+        *,
+        weigher: Optional[Callable[[V], int]] = None,
+        on_evict: Optional[Callable[[K, V], None]] = None,
+    ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.weigher = weigher or (lambda _: 1)
+        self.on_evict = on_evict
+        self.entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: K):
+        return self.peek(key) is not None
+
+    def __str__(self):
+        return f"{self.hits}/{self.hits + self.misses} hit ({self.hit_rate:.0%}), {len(self)} cached"
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def expired(self, stamp: float):
+        return self.ttl is not None and time.monotonic() - stamp > self.ttl
+
+    def peek(self, key: K) -> Optional[V]:
+        """
+        Lookup without touching recency or counters
+        """
+
+        entry = self.entries.get(key, None)
+        if entry is None or self.expired(entry[0]):
+            return None
+        return entry[1]
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self.entries.get(key, None)
+        if entry is None or self.expired(entry[0]):
+            if entry is not None:
+                self.evict(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: K, value: V):
+        self.pop(key)
+        self.entries[key] = (time.monotonic(), value)
+        self.weight += self.weigher(value)
+        while self.weight > self.capacity and len(self.entries) > 1:
+            self.evict(next(iter(self.entries)))
+
+    def pop(self, key: K) -> Optional[V]:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.weight -= self.weigher(entry[1])
+        return entry[1]
+
+    def evict(self, key: K):
+        evicted = self.pop(key)
+        if evicted is not None and self.on_evict:
+            self.on_evict(key, evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.weight = 0
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Collapse concurrent calls sharing a key into one in-flight call
+    """
+
+    def __init__(self):
+        self.flights: dict[K, asyncio.Future] = {}
+        self.shared = 0
+
+    def __len__(self):
+        return len(self.flights)
+
+    async def do(self, key: K, factory: Callable[[], Awaitable[V]]):
+        """
+        Await the in-flight call for key, or become it
+
+        Return the result and whether it was shared from another caller
+        """
+
+        flight = self.flights.get(key, None)
+        if flight:
+            self.shared += 1
+            return await asyncio.shield(flight), True
+
+        flight = asyncio.get_running_loop().create_future()
+        self.flights[key] = flight
+        try:
+            result = await factory()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                # followers were not cancelled themselves, fail them instead
+                e = RuntimeError("In-flight call was cancelled")
+            flight.set_exception(e)
+            # followers may not exist, mark the exception as retrieved
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result, False
+        finally:
+            del self.flights[key]
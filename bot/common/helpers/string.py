@@ -37,43 +37,233 @@ def as_embed(
     return embed
 
 
-def chunk_with_size(content: str, chunk_size: int):
+class MarkdownChunker:
     """
-    Chunk a string to avoid length limitation
+    Incrementally split markdown into chunks of at most chunk_size
+
+    Open code fences are closed at chunk ends and reopened with their info
+    string, lines longer than a chunk are split at whitespace when possible
     """
 
-    formatted = [""]
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.parts: list[str] = []
+        self.size = 0
+        # size of the reopened fence that starts the chunk
+        self.base = 0
+        self.pending: list[str] = []
+        self.pending_size = 0
+        # the rest of a line that was hard split, never a fence
+        self.continued = False
+        self.fence_open: Optional[str] = None
+        self.fence_close: Optional[str] = None
+
+    def fence_reserve(self):
+        return len(self.fence_close) + 1 if self.fence_close else 0
+
+    def seal(self, parts: list[str]):
+        chunk = "".join(parts)
+        if not self.fence_close:
+            return chunk
+        if chunk.endswith("\n"):
+            return f"{chunk}{self.fence_close}"
+        return f"{chunk}\n{self.fence_close}"
+
+    def start(self):
+        self.parts = []
+        self.size = 0
+        if self.fence_open:
+            self.append(f"{self.fence_open}\n")
+        self.base = self.size
+
+    def append(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def rollover(self, chunks: list[str]):
+        if self.size > self.base and "".join(self.parts).strip():
+            chunks.append(self.seal(self.parts))
+        self.start()
+
+    def fence(self, line: str):
+        """
+        Return the fence marker and indent if line opens or closes a fence
+        """
+
+        stripped = line.strip()
+        marker = stripped[:3]
+        if marker not in ("```", "~~~"):
+            return None
+        marker = stripped[: len(stripped) - len(stripped.lstrip(marker[0]))]
+        indent = line[: len(line) - len(line.lstrip())]
+        if not self.fence_close:
+            return marker, indent
+        closing = self.fence_close.strip()
+        if stripped != marker or marker[0] != closing[0]:
+            return None
+        return (marker, indent) if len(marker) >= len(closing) else None
+
+    def fence_header(self, line: str, fence: tuple[str, str]):
+        """
+        The opening fence line capped so that, reopened, it leaves room for its
+        close and some content, None if not even the bare marker fits
+        """
+
+        bare = len(fence[1]) + len(fence[0])
+        # header and close take a newline each, content at least one character
+        room = self.chunk_size - bare - 2
+        if room <= bare:
+            return None
+        # the info string may take up to half of what the close leaves
+        return line.rstrip("\r\n")[: max(room // 2, bare)]
+
+    def cut(self, line: str, start: int, room: int):
+        """
+        Where to cut a line to fit room, preferring the last whitespace in the back half
+        """
+
+        end = start + room
+        cut = max(line.rfind(" ", start, end), line.rfind("\t", start, end)) + 1
+        return cut if cut - start > room // 2 else end
+
+    def push(self, line: str, chunks: list[str], continued: bool = False):
+        fence = None if continued else self.fence(line)
+        opening = fence is not None and not self.fence_close
+        if opening:
+            header = self.fence_header(line, fence)
+            if header is None:
+                # no room to fence at this size, plain text
+                fence = None
+                opening = False
+            else:
+                # drop what of the info string does not fit, keep the line ending
+                body = line.rstrip("\r\n")
+                line = f"{header}{line[len(body):]}"
+        # a closing fence needs no closing of its own
+        reserve = 0 if fence and not opening else self.fence_reserve()
+        if opening:
+            reserve = len(fence[1]) + len(fence[0]) + 1
+
+        # sealing a fenced chunk puts the close after the line's own newline
+        size = len(line) - 1 if reserve and line.endswith("\n") else len(line)
+        if self.size > self.base and self.size + size + reserve > self.chunk_size:
+            self.rollover(chunks)
+
+        start = 0
+        while self.size + size - start + reserve > self.chunk_size:
+            # an overlong line, fill what is left of this chunk and roll over
+            room = max(self.chunk_size - self.size - reserve, 1)
+            end = self.cut(line, start, room)
+            self.append(line[start:end])
+            self.rollover(chunks)
+            start = end
+            fence = None
+
+        if fence and not opening and self.base and self.size == self.base:
+            # nothing since the reopened fence, drop it along with its close
+            self.fence_open = None
+            self.fence_close = None
+            self.start()
+            return
+
+        self.append(line[start:] if start else line)
+        if fence and opening:
+            self.fence_open = header
+            self.fence_close = f"{fence[1]}{fence[0]}"
+            if self.size == len(line):
+                # a chunk holding only the opening fence is empty
+                self.base = self.size
+        elif fence:
+            self.fence_open = None
+            self.fence_close = None
+
+    def flush_pending(self, chunks: list[str]):
+        self.push("".join(self.pending), chunks, self.continued)
+        self.pending = []
+        self.pending_size = 0
+        self.continued = False
+
+    def feed(self, text: str):
+        """
+        Feed more text, return the chunks completed by it
+        """
+
+        chunks = []
+        if text and self.pending and self.pending[-1].endswith("\r"):
+            # a held line break, unless this delta completes it as \r\n
+            if not text.startswith("\n"):
+                self.flush_pending(chunks)
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            self.pending.append(line)
+            self.pending_size += len(line)
+            if line.endswith("\r") and i == len(lines) - 1:
+                # a \r\n may be split across deltas, hold it for the next one
+                continue
+            if line.endswith(("\n", "\r")):
+                self.flush_pending(chunks)
+            elif self.pending_size > self.chunk_size:
+                # no newline in sight, commit the head of the partial line
+                partial = "".join(self.pending)
+                end = self.cut(partial, 0, self.chunk_size)
+                head, tail = partial[:end], partial[end:]
+                self.push(head, chunks, True)
+                self.pending = [tail]
+                self.pending_size = len(tail)
+                self.continued = True
+        return chunks
+
+    def peek(self):
+        """
+        Render the chunk in progress, including the partial line
+        """
+
+        if self.size <= self.base and not self.pending:
+            return ""
+        # the partial line may not fit yet, show what will
+        room = max(self.chunk_size - self.size - self.fence_reserve(), 0)
+        return self.seal(self.parts + ["".join(self.pending)[:room]])
+
+    def close(self):
+        """
+        Flush everything left, return the remaining chunks
+        """
+
+        chunks = []
+        if self.pending:
+            self.flush_pending(chunks)
+        self.rollover(chunks)
+        self.fence_open = None
+        self.fence_close = None
+        self.base = self.size = 0
+        self.parts = []
+        return chunks
+
+
+def iter_chunks(content: Optional[str], chunk_size: int):
+    """
+    Lazily chunk a string, see MarkdownChunker
+    """
 
     if content is None:
-        return formatted
+        return
 
-    accum = 0
-    code_block = False
-    code_block_syntax = ""
+    chunker = MarkdownChunker(chunk_size)
+    chunks = []
     for line in content.splitlines(keepends=True):
-        # preserve code block
-        if "```" in line:
-            code_block = not code_block
-            code_block_syntax = line
-        # append chunk
-        formatted[-1] += line
-        accum += len(line)
-        # close this chunk
-        if accum >= chunk_size:
-            if code_block:
-                formatted[-1] += "```"
-
-            # begins new chunk
-            formatted.append("")
-
-            if code_block:
-                formatted[-1] += f"{code_block_syntax}\n"
-            accum = 0
-
-    if formatted[-1].isspace() or formatted[-1] == "":
-        formatted.pop()
-
-    return formatted
+        chunker.push(line, chunks)
+        if chunks:
+            yield from chunks
+            chunks.clear()
+    yield from chunker.close()
+
+
+def chunk_with_size(content: str, chunk_size: int):
+    """
+    Chunk a string to avoid length limitation
+    """
+
+    return list(iter_chunks(content, chunk_size))
 
 
 def codeblock(content: str, syntax: str = ""):
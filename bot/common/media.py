@@ -0,0 +1,431 @@
+import asyncio
+import common.metrics as metrics
+import multiprocessing
+import zlib
+
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Callable, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+# leading bytes of the container formats we produce or receive
+SIGNATURES = {
+    "PNG": (b"\x89PNG\r\n\x1a\n",),
+    "JPEG": (b"\xff\xd8\xff",),
+    "GIF": (b"GIF87a", b"GIF89a"),
+}
+
+
+def sniff_format(head: bytes):
+    """
+    Container format from the first 12 bytes, without decoding anything
+    """
+
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for format, signatures in SIGNATURES.items():
+        if head.startswith(signatures):
+            return format
+    return None
+
+
+# segments that only carry metadata, everything else is kept byte for byte
+# APP1 exif/xmp, APP3-13 (APP13 is photoshop iptc), APP15 and COM, while APP0
+# jfif, APP2 icc profile and APP14 adobe color transform affect decoding
+JPEG_METADATA = {0xE1, *range(0xE3, 0xEE), 0xEF, 0xFE}
+PNG_METADATA = {b"tEXt", b"iTXt", b"zTXt", b"eXIf", b"tIME"}
+WEBP_METADATA = {b"EXIF", b"XMP "}
+# VP8X flags announcing exif and xmp chunks
+WEBP_METADATA_FLAGS = 0x08 | 0x04
+
+
+# exif tags that carry generation parameters as text
+EXIF_TEXT_TAGS = {0x010E: "ImageDescription", 0x9286: "UserComment"}
+EXIF_IFD_POINTER = 0x8769
+# byte sizes of the tiff field types we read, byte, ascii and undefined
+EXIF_TEXT_TYPES = {1: 1, 2: 1, 7: 1}
+
+
+def jpeg_segments(data: memoryview):
+    """
+    Yield marker, start and end of each segment before the image data
+
+    The last one is start of scan, spanning the rest of the buffer
+    """
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("jpeg marker expected")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9):
+            # entropy coded data follows, never walked
+            yield marker, pos, len(data)
+            return
+        length = int.from_bytes(data[pos + 2 : pos + 4], "big")
+        end = pos + 2 + length
+        if length < 2 or end > len(data):
+            raise ValueError("truncated jpeg segment")
+        yield marker, pos, end
+        pos = end
+    raise ValueError("jpeg without image data")
+
+
+def png_chunks(data: memoryview):
+    """
+    Yield type, start and end of each chunk up to and including IEND
+    """
+
+    pos = 8
+    while pos + 12 <= len(data):
+        length = int.from_bytes(data[pos : pos + 4], "big")
+        kind = bytes(data[pos + 4 : pos + 8])
+        end = pos + 12 + length
+        if end > len(data):
+            raise ValueError("truncated png chunk")
+        yield kind, pos, end
+        if kind == b"IEND":
+            return
+        pos = end
+    raise ValueError("png without end chunk")
+
+
+def webp_chunks(data: memoryview):
+    """
+    Yield fourcc, start and end of each riff chunk
+    """
+
+    pos = 12
+    while pos + 8 <= len(data):
+        kind = bytes(data[pos : pos + 4])
+        length = int.from_bytes(data[pos + 4 : pos + 8], "little")
+        # chunks are padded to even sizes
+        end = pos + 8 + length + (length & 1)
+        if end > len(data):
+            raise ValueError("truncated webp chunk")
+        yield kind, pos, end
+        pos = end
+
+
+def strip_jpeg(data: memoryview):
+    parts = [data[:2]]
+    for marker, start, end in jpeg_segments(data):
+        if marker not in JPEG_METADATA:
+            parts.append(data[start:end])
+    return b"".join(parts)
+
+
+def strip_png(data: memoryview):
+    parts = [data[:8]]
+    for kind, start, end in png_chunks(data):
+        if kind not in PNG_METADATA:
+            parts.append(data[start:end])
+    return b"".join(parts)
+
+
+def strip_webp(data: memoryview):
+    parts = []
+    for kind, start, end in webp_chunks(data):
+        if kind == b"VP8X":
+            header = bytearray(data[start:end])
+            header[8] &= ~WEBP_METADATA_FLAGS & 0xFF
+            parts.append(header)
+        elif kind not in WEBP_METADATA:
+            parts.append(data[start:end])
+
+    size = 4 + sum([len(part) for part in parts])
+    return b"".join([b"RIFF", size.to_bytes(4, "little"), b"WEBP", *parts])
+
+
+def decode_user_comment(value: bytes):
+    # the first 8 bytes name the character code
+    charset, text = value[:8], value[8:]
+    # writers disagree on byte order, ascii text leaves its zeros on one side
+    even, odd = text[0::2].count(0), text[1::2].count(0)
+    if charset != b"UNICODE\0" or max(even, odd) * 4 < len(text) or even == odd:
+        return text.decode("utf-8", "ignore").rstrip("\0")
+    encoding = "utf-16-be" if even > odd else "utf-16-le"
+    return text.decode(encoding, "ignore").rstrip("\0")
+
+
+def read_exif_text(exif: bytes):
+    """
+    Textual tags of a tiff structured exif blob, from IFD0 and the exif IFD
+    """
+
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    if exif[:2] not in (b"MM", b"II"):
+        return {}
+    order = "big" if exif[:2] == b"MM" else "little"
+
+    def read(offset: int, size: int):
+        if offset + size > len(exif):
+            raise ValueError("truncated exif")
+        return int.from_bytes(exif[offset : offset + size], order)
+
+    text = {}
+    ifds = [read(4, 4)]
+    visited = set()
+    while ifds:
+        ifd = ifds.pop()
+        if ifd in visited or ifd < 8:
+            continue
+        visited.add(ifd)
+        for entry in range(ifd + 2, ifd + 2 + read(ifd, 2) * 12, 12):
+            tag, kind, count = read(entry, 2), read(entry + 2, 2), read(entry + 4, 4)
+            if tag == EXIF_IFD_POINTER:
+                ifds.append(read(entry + 8, 4))
+            elif tag in EXIF_TEXT_TAGS and kind in EXIF_TEXT_TYPES:
+                size = count * EXIF_TEXT_TYPES[kind]
+                # values that fit are stored inline instead of at an offset
+                offset = entry + 8 if size <= 4 else read(entry + 8, 4)
+                value = exif[offset : offset + size]
+                if tag == 0x9286:
+                    text[EXIF_TEXT_TAGS[tag]] = decode_user_comment(value)
+                else:
+                    text[EXIF_TEXT_TAGS[tag]] = value.rstrip(b"\0").decode(
+                        "utf-8", "ignore"
+                    )
+    return text
+
+
+def read_png_text(kind: bytes, chunk: bytes):
+    keyword, _, value = chunk.partition(b"\0")
+    if kind == b"zTXt":
+        value = zlib.decompress(value[1:])
+    elif kind == b"iTXt":
+        compressed = value[0]
+        # language and translated keyword precede the text
+        value = value[2:].split(b"\0", 2)[-1]
+        if compressed:
+            value = zlib.decompress(value)
+        return keyword.decode("latin-1"), value.decode("utf-8", "ignore")
+    return keyword.decode("latin-1"), value.decode("latin-1")
+
+
+def scan_text_metadata(data: bytes):
+    """
+    Text metadata of a jpeg, png or webp, walking container segments only
+
+    Exif text tags and png text chunks by name, pixels are never decoded
+    """
+
+    text = {}
+    with memoryview(data) as view:
+        try:
+            match sniff_format(data[:12]):
+                case "JPEG":
+                    for marker, start, end in jpeg_segments(view):
+                        if marker not in (0xE1, 0xFE):
+                            continue
+                        segment = bytes(view[start + 4 : end])
+                        if segment.startswith(b"Exif\0\0"):
+                            text.update(read_exif_text(segment))
+                        elif marker == 0xFE:
+                            text["Comment"] = segment.decode("utf-8", "ignore")
+                case "PNG":
+                    for kind, start, end in png_chunks(view):
+                        if kind in (b"tEXt", b"zTXt", b"iTXt"):
+                            chunk = bytes(view[start + 8 : end - 4])
+                            key, value = read_png_text(kind, chunk)
+                            text[key] = value
+                        elif kind == b"eXIf":
+                            chunk = bytes(view[start + 8 : end - 4])
+                            text.update(read_exif_text(chunk))
+                case "WEBP":
+                    for kind, start, end in webp_chunks(view):
+                        if kind == b"EXIF":
+                            text.update(read_exif_text(bytes(view[start + 8 : end])))
+        except (ValueError, IndexError, zlib.error):
+            # whatever was read before the damage is still good
+            pass
+    return text
+
+
+CONTAINER_STRIPPERS = {"JPEG": strip_jpeg, "PNG": strip_png, "WEBP": strip_webp}
+
+
+def strip_container(data: bytes):
+    """
+    Drop metadata segments without decoding pixels, None if the container
+    is not one we can rewrite
+    """
+
+    stripper = CONTAINER_STRIPPERS.get(sniff_format(data[:12]), None)
+    if not stripper:
+        return None
+    with memoryview(data) as view:
+        try:
+            return stripper(view)
+        except ValueError:
+            return None
+
+
+# workers run in child processes, keep these at module level so they pickle
+
+
+def open_image(data: bytes):
+    # lazy, only the header is parsed until pixels are touched
+    return Image.open(BytesIO(data))
+
+
+def encode_image(image: Image.Image, format: str, **params):
+    if format.upper() in ("JPEG", "JPG") and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    encoded = BytesIO()
+    # info is never passed on, so metadata is dropped on save
+    image.save(encoded, format, **params)
+    return encoded.getvalue()
+
+
+def is_format(format: Optional[str], target: str):
+    target = target.upper()
+    return (format or "").upper() in (target, "JPEG" if target == "JPG" else target)
+
+
+def transcode_image(data: bytes, format: str, params: dict):
+    image = open_image(data)
+    if is_format(image.format, format):
+        return data
+    return encode_image(image, format, **params)
+
+
+def strip_image(data: bytes, format: Optional[str], params: dict):
+    image = open_image(data)
+    return encode_image(image, format or image.format, **params)
+
+
+def decode_image(data: bytes, mode: Optional[str]):
+    image = open_image(data)
+    if mode and image.mode != mode:
+        return image.convert(mode)
+    image.load()
+    return image
+
+
+def thumbnail_image(data: bytes, size: int, format: str, params: dict):
+    image = open_image(data)
+    # jpeg decodes straight at a reduced scale
+    image.draft("RGB", (size, size))
+    image.thumbnail((size, size))
+    return encode_image(image, format, **params)
+
+
+class DroppyMediaPipeline:
+    """
+    Image CPU work off the event loop, in a shared process pool
+
+    Every operation is timed as media/<op>
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.inflight = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def queued(self):
+        """
+        Operations waiting for a free worker
+        """
+
+        return max(self.inflight - self.workers, 0)
+
+    def __str__(self):
+        return (
+            f"- workers: {self.workers}\n"
+            f"- in flight: {self.inflight:,} ({self.queued:,} queued)\n"
+            f"- completed: {self.completed:,}\n"
+            f"- failed: {self.failed:,}"
+        )
+
+    def start(self):
+        """
+        Start the workers, call at startup before the event loop or any thread runs
+
+        Forked pools launch every worker on the first submit, so they are
+        never forked from the running, threaded bot process
+        """
+
+        if self.executor:
+            return
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        self.executor.submit(int).result()
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, op: str, fn: Callable[..., T], *args) -> T:
+        """
+        Run a module level function in the pool, started by start beforehand
+        """
+
+        if not self.executor:
+            # starting here would fork the running, threaded bot process
+            raise RuntimeError("media pipeline used before start")
+
+        self.inflight += 1
+        try:
+            with metrics.timer("media", op):
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, fn, *args
+                )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.inflight -= 1
+
+        self.completed += 1
+        return result
+
+    async def decode(self, data: bytes, mode: Optional[str] = None):
+        """
+        Decode pixels, converted to mode if given, return the loaded image
+        """
+
+        return await self.run("decode", decode_image, data, mode)
+
+    async def transcode(self, data: bytes, format: str, **params):
+        """
+        Re-encode into format, untouched if it already is
+        """
+
+        return await self.run("transcode", transcode_image, data, format, params)
+
+    async def strip_metadata(self, data: bytes, format: Optional[str] = None, **params):
+        """
+        Drop exif, xmp and text chunks
+
+        Containers already in format are rewritten segment by segment in place,
+        anything else has its pixels re-encoded in the pool
+        """
+
+        if format is None or is_format(sniff_format(data[:12]), format):
+            with metrics.timer("media", "strip_container"):
+                stripped = strip_container(data)
+            if stripped is not None:
+                return stripped
+
+        return await self.run("strip", strip_image, data, format, params)
+
+    async def thumbnail(self, data: bytes, size: int, format: str = "WEBP", **params):
+        """
+        Downscale to fit a size square, aspect kept
+        """
+
+        return await self.run("thumbnail", thumbnail_image, data, size, format, params)
@@ -0,0 +1,134 @@
+import math
+import time
+
+from contextlib import contextmanager
+from typing import Optional
+
+
+# bucket bounds grow by this ratio, about 2% relative error on any latency
+BUCKET_RATIO = 1.04
+SLOT_SECONDS = 60
+SLOTS = 60
+# sliding windows reported, in slots
+WINDOWS = {"1m": 1, "15m": 15, "1h": 60}
+
+
+class DroppyHistogram:
+    """
+    Log bucketed latency histogram over a sliding window of time slots
+    """
+
+    def __init__(self):
+        self.slots: dict[int, dict[int, int]] = {}
+        self.count = 0
+
+    def record(self, ms: float):
+        slot = int(time.time() // SLOT_SECONDS)
+        buckets = self.slots.get(slot, None)
+        if buckets is None:
+            buckets = self.slots[slot] = {}
+            # forget what slid out of the longest window
+            for stale in [s for s in self.slots if s <= slot - SLOTS]:
+                del self.slots[stale]
+
+        bucket = int(math.log(max(ms, 1.0), BUCKET_RATIO))
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+        self.count += 1
+
+    def merged(self, slots: int):
+        now = int(time.time() // SLOT_SECONDS)
+        merged: dict[int, int] = {}
+        for slot, buckets in self.slots.items():
+            if slot <= now - slots:
+                continue
+            for bucket, count in buckets.items():
+                merged[bucket] = merged.get(bucket, 0) + count
+        return merged
+
+    def percentiles(self, slots: int, ps: tuple[float, ...] = (0.5, 0.95, 0.99)):
+        """
+        Return sample count and latency percentiles in ms over the last slots
+        """
+
+        merged = sorted(self.merged(slots).items())
+        total = sum([count for _, count in merged])
+        if not total:
+            return 0, [0.0 for _ in ps]
+
+        values = []
+        accum = 0
+        ranks = iter([max(1, math.ceil(p * total)) for p in ps])
+        rank = next(ranks)
+        for bucket, count in merged:
+            accum += count
+            while rank is not None and accum >= rank:
+                # geometric middle of the bucket
+                values.append(BUCKET_RATIO ** (bucket + 0.5))
+                rank = next(ranks, None)
+        return total, values
+
+    def __str__(self):
+        lines = []
+        for window, slots in WINDOWS.items():
+            count, (p50, p95, p99) = self.percentiles(slots)
+            if count:
+                lines.append(
+                    f"- {window}: {p50:,.0f} / {p95:,.0f} / {p99:,.0f}ms ({count:,})"
+                )
+        return "\n".join(lines) or "- idle"
+
+
+class DroppyTimer:
+    def __init__(self, labels: tuple[str, ...]):
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.stop: Optional[float] = None
+
+    @property
+    def elapsed(self):
+        """
+        Milliseconds since start, frozen once finished
+        """
+
+        end = self.stop if self.stop is not None else time.perf_counter()
+        return int(round((end - self.start) * 1000))
+
+    def mark(self, stage: str):
+        """
+        Record elapsed time so far as a stage, such as time to first byte
+        """
+
+        elapsed = self.elapsed
+        record(elapsed, *self.labels, stage)
+        return elapsed
+
+    def finish(self, stage: str):
+        self.stop = time.perf_counter()
+        return self.mark(stage)
+
+
+histograms: dict[tuple[str, ...], DroppyHistogram] = {}
+
+
+def record(ms: float, *labels: str):
+    histogram = histograms.get(labels, None)
+    if not histogram:
+        histogram = histograms[labels] = DroppyHistogram()
+    histogram.record(ms)
+
+
+@contextmanager
+def timer(*labels: str):
+    """
+    Time a block as labels/total, or labels/error if it raises
+
+    Cancelled blocks are not recorded
+    """
+
+    timing = DroppyTimer(labels)
+    try:
+        yield timing
+    except Exception:
+        timing.finish("error")
+        raise
+    timing.finish("total")
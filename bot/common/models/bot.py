@@ -19,10 +19,29 @@ class LocalizationModel(BaseModel):
     fallback_error: sanitized_str
 
 
+class EndpointModel(BaseModel):
+    window: PositiveInt
+    hedge_min_samples: PositiveInt
+    max_requeues: Annotated[PositiveInt, Field(le=16)]
+
+
+class MediaModel(BaseModel):
+    workers: Annotated[PositiveInt, Field(le=16)]
+
+
+class ViewsModel(BaseModel):
+    path: sanitized_str
+    capacity: PositiveInt
+    retention: PositiveInt
+
+
 class BotConfigModel(BaseModel):
     version: sanitized_str
     command_prefix: sanitized_str
     log: LogModel
     presence: PresenceModel
     localization: LocalizationModel
+    endpoint: EndpointModel
+    media: MediaModel
+    views: ViewsModel
     usage_path: sanitized_str
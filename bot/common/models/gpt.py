@@ -2,25 +2,88 @@ from .shared import *
 from typing import List, Dict
 
 
+class ImageModel(BaseModel):
+    max_tiles: Annotated[PositiveInt, Field(le=32)]
+    quality: Annotated[PositiveInt, Field(le=100)]
+    cache_bytes: PositiveInt
+    savings_capacity: PositiveInt
+
+
+class AttachmentModel(BaseModel):
+    concurrency: Annotated[PositiveInt, Field(le=16)]
+    max_file_bytes: PositiveInt
+    max_file_tokens: PositiveInt
+    cache_bytes: PositiveInt
+    image: ImageModel
+
+
+class MessageCacheModel(BaseModel):
+    capacity: PositiveInt
+    ttl: PositiveInt
+
+
+class BatchModel(BaseModel):
+    path: sanitized_str
+    poll_interval: Annotated[PositiveFloat, Field(ge=10.0)]
+    max_jobs: Annotated[PositiveInt, Field(le=50000)]
+    completion_window: sanitized_str
+    discount: Annotated[PositiveFloat, Field(le=1.0)]
+    max_deliveries: Annotated[PositiveInt, Field(le=16)]
+
+
+class CompactionModel(BaseModel):
+    enabled: bool
+    budget: PositiveInt
+    keep_recent: Annotated[PositiveInt, Field(le=32)]
+    model: sanitized_str
+
+
 class ContextualModel(BaseModel):
     max_ctx_per_user: Annotated[PositiveInt, Field(le=128)]
     max_ctx_percentage: Annotated[PositiveFloat, Field(le=1.0)]
+    compaction: CompactionModel
+    message_cache: MessageCacheModel
 
 
 class SpecItemModel(BaseModel):
+    encoding: sanitized_str
     max_token: PositiveInt
     name: sanitized_str
 
 
+class ResponseCacheModel(BaseModel):
+    enabled: bool
+    capacity: PositiveInt
+    ttl: PositiveInt
+
+
+class SnapshotModel(BaseModel):
+    path: sanitized_str
+    max_bytes: PositiveInt
+    retention: Annotated[PositiveInt, Field(le=365)]
+
+
+class StreamingModel(BaseModel):
+    enabled: bool
+    edit_interval: Annotated[PositiveFloat, Field(ge=1.0)]
+    chunk_size: Annotated[PositiveInt, Field(le=4096)]
+
+
 class GptModel(BaseModel):
     advanced: sanitized_str
     default: sanitized_str
     specs: List[SpecItemModel]
     vision_fidelity: sanitized_str
+    encoding_cache: sanitized_str
 
 
 class GptConfigModel(BaseModel):
+    attachment: AttachmentModel
+    batch: BatchModel
     contextual: ContextualModel
     user_init_path: sanitized_str
+    snapshot: SnapshotModel
     model: GptModel
+    response_cache: ResponseCacheModel
+    streaming: StreamingModel
     thinking_indicator: sanitized_str
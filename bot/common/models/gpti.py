@@ -29,13 +29,27 @@ class GptiDefaults(BaseModel):
     quality: sanitized_str
 
 
+class GptiExportModel(BaseModel):
+    cache_bytes: PositiveInt
+
+
+class GptiCacheModel(BaseModel):
+    enabled: bool
+    path: sanitized_str
+    max_bytes: PositiveInt
+
+
 class GptiConfigModel(BaseModel):
     dimensions: GptiDimensions
     models: GptiModels
     output: sanitized_str
+    response_format: Annotated[sanitized_str, Field(pattern=r"^(url|b64_json)$")]
     qualities: GptiQualities
     styles: GptiStyles
     defaults: GptiDefaults
     variation_max: Annotated[PositiveInt, Field(le=15)]
+    concurrency: Annotated[PositiveInt, Field(le=10)]
+    export: GptiExportModel
+    cache: GptiCacheModel
     painting_completed: sanitized_str
     painting_indicator: sanitized_str
@@ -12,6 +12,18 @@ class TrioCacheModel(BaseModel):
     output: sanitized_str
     storage: sanitized_str
     retention: Annotated[PositiveInt, Field(le=180)]
+    max_bytes: PositiveInt
+    sweep_interval: Annotated[PositiveInt, Field(le=86400)]
+
+
+class TrioPollModel(BaseModel):
+    min_interval: PositiveFloat
+    max_interval: Annotated[PositiveFloat, Field(le=60.0)]
+    backoff: Annotated[float, Field(ge=1.0, le=4.0)]
+    connections: Annotated[PositiveInt, Field(le=64)]
+    downloads: Annotated[PositiveInt, Field(le=16)]
+    request_timeout: PositiveFloat
+    batch: bool
 
 
 class TrioConfigModel(BaseModel):
@@ -32,6 +44,7 @@ class TrioConfigModel(BaseModel):
 
     concurrent_job_max: Annotated[PositiveInt, Field(le=8)]
     concurrent_timeout: Annotated[PositiveInt, Field(le=600)]
+    poll: TrioPollModel
 
     guidance: Annotated[PositiveFloat, Field(le=30.0)]
     sampler: sanitized_str
@@ -0,0 +1,205 @@
+import asyncio
+import re
+import time
+
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+
+PositionCallback = Callable[[int], Awaitable]
+
+
+def parse_reset(reset: Optional[str]):
+    """
+    Parse a rate limit reset duration such as 6m0s, 1.5s or 20ms into seconds
+    """
+
+    if not reset:
+        return 0.0
+
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    matches = re.findall(r"([\d.]+)(ms|h|m|s)", reset)
+    return sum([float(value) * units[unit] for value, unit in matches])
+
+
+class TokenBucket:
+    """
+    Per minute rate limit bucket, learned from provider headers
+
+    Unlimited until the provider reports a limit
+    """
+
+    def __init__(self):
+        self.capacity: Optional[float] = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.stamp = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, amount: float):
+        """
+        Seconds until amount can be taken
+        """
+
+        if self.capacity is None:
+            return 0.0
+
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity is None:
+            return
+        self.refill()
+        self.level -= amount
+
+    def update(
+        self, limit: Optional[str], remaining: Optional[str], reset: Optional[str]
+    ):
+        if not limit or remaining is None:
+            return
+
+        self.capacity = float(limit)
+        self.rate = self.capacity / 60.0
+        self.level = float(remaining)
+        self.stamp = time.monotonic()
+        if self.level <= 0:
+            # drained, the bucket climbs back to zero when the window resets
+            self.level = -parse_reset(reset) * self.rate
+
+    def __str__(self):
+        if self.capacity is None:
+            return "unknown"
+        self.refill()
+        return f"{max(self.level, 0):,.0f} / {self.capacity:,.0f}"
+
+
+class DroppyTicket:
+    def __init__(
+        self,
+        user_id: int,
+        tokens: int,
+        on_position: Optional[PositionCallback],
+        kind: str,
+    ):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.kind = kind
+        self.on_position = on_position
+        self.position = 0
+        self.granted = asyncio.get_running_loop().create_future()
+        self.notified: Optional[asyncio.Task] = None
+
+    def notify(self, position: int):
+        if not self.on_position or position == self.position:
+            return
+        # one edit at a time, a skipped position is picked up on the next notify
+        if not self.notified or self.notified.done():
+            self.position = position
+            self.notified = asyncio.create_task(self.on_position(position))
+
+
+class DroppyScheduler:
+    """
+    Admit requests to endpoints as their rate limit buckets allow
+
+    Waiting requests are served round robin across users
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.queues: OrderedDict[int, deque[DroppyTicket]] = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.throttled = 0
+
+    def __len__(self):
+        return sum([len(q) for q in self.queues.values()])
+
+    def ordered(self):
+        """
+        Waiting tickets in the order they will be admitted
+        """
+
+        queues = [list(q) for q in self.queues.values()]
+        rounds = max([len(q) for q in queues], default=0)
+        return [q[i] for i in range(rounds) for q in queues if i < len(q)]
+
+    def notify_positions(self):
+        for position, ticket in enumerate(self.ordered()):
+            ticket.notify(position + 1)
+
+    async def acquire(
+        self,
+        user_id: int,
+        tokens: int,
+        on_position: Optional[PositionCallback] = None,
+        kind: str = "chat",
+    ):
+        """
+        Wait for a turn, return the endpoint reserved for it
+        """
+
+        ticket = DroppyTicket(user_id, tokens, on_position, kind)
+        self.queues.setdefault(user_id, deque()).append(ticket)
+        self.wakeup.set()
+        if not self.dispatcher or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+
+        try:
+            endpoint = await ticket.granted
+        except asyncio.CancelledError:
+            queue = self.queues.get(user_id, None)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self.queues[user_id]
+            if ticket.notified:
+                ticket.notified.cancel()
+            raise
+
+        # never let a stale queue position overwrite the reply
+        if ticket.notified:
+            await asyncio.gather(ticket.notified, return_exceptions=True)
+        return endpoint
+
+    async def dispatch(self):
+        while self.queues:
+            self.wakeup.clear()
+
+            user_id, queue = next(iter(self.queues.items()))
+            ticket = queue[0]
+            if ticket.granted.done():
+                # cancelled while waiting
+                queue.popleft()
+                if not queue:
+                    del self.queues[user_id]
+                continue
+
+            endpoint, wait = self.pool.reserve(ticket.tokens, ticket.kind)
+            if not endpoint:
+                self.throttled += 1
+                self.notify_positions()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # rotate the user to the back for fairness
+            queue.popleft()
+            del self.queues[user_id]
+            if queue:
+                self.queues[user_id] = queue
+
+            self.admitted += 1
+            ticket.granted.set_result(endpoint)
+            self.notify_positions()
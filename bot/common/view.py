@@ -1,27 +1,227 @@
 import common.helper as helper
 import discord
+import json
 import os
+import sqlite3
+import sys
+import time
+import uuid
 
 from .cog import DroppyCog
 from .config import DroppyBotConfig
 from .exception import failsafe_ainvoke, DroppyBotError
 from .logger import log
 from .translator import DroppyTranslator
+from collections import OrderedDict
 from discord.ext import commands
 from functools import wraps
 from typing import Optional, Union, get_args
 
 
 class DroppyView(discord.ui.View):
-    def __init__(self, cog: DroppyCog, *args, **kwards):
+    """
+    View whose item custom ids carry a token, kind:token:item
+
+    Live views are bounded by the registry, evicted ones are revived from
+    their dumped state on their next interaction
+    """
+
+    kinds: dict[str, type["DroppyView"]] = {}
+    registry: Optional["DroppyViewRegistry"] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        DroppyView.kinds[cls.__name__] = cls
+
+    def __init__(self, cog: DroppyCog, *args, token: Optional[str] = None, **kwards):
         timeout = kwards.pop("timeout", None)
         super().__init__(timeout=timeout, *args, **kwards)
         self.cog = cog
+        self.token = token or uuid.uuid4().hex[:16]
+
+        for callback in self.__view_children_items__:
+            item = getattr(self, callback.__name__)
+            item.custom_id = f"{type(self).__name__}:{self.token}:{callback.__name__}"
+
+        if self.registry:
+            self.registry.register(self)
+
+    async def interaction_check(self, ctx: discord.Interaction):
+        if self.registry:
+            self.registry.touch(self)
+        return True
+
+    def dump_state(self) -> dict:
+        """
+        Minimal state to revive this view with, json serializable
+        """
+
+        return {}
+
+    @classmethod
+    def revive(cls, cog: DroppyCog, state: dict, token: str):
+        """
+        Rebuild an evicted view, None if it cannot be
+        """
+
+        return cls(cog, token=token)
+
+    def is_pinned(self):
+        """
+        Pinned views hold state that cannot be dumped and are never evicted
+        """
+
+        return False
 
     def get_field(self, embeds: list[discord.Embed], name: str):
         return helper.first_iequal(sum([e.fields for e in embeds], []), "name", name)
 
 
+class DroppyViewRegistry:
+    """
+    Bounded set of live views, least recently interacted evicted first
+
+    Evicted views are stopped and their state persisted by token
+    """
+
+    def __init__(self, path: str, capacity: int, retention: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.capacity = capacity
+        self.retention = retention * 86400
+        self.live: OrderedDict[str, DroppyView] = OrderedDict()
+        self.evicted = 0
+        self.revived = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS views ("
+            "token TEXT PRIMARY KEY, "
+            "kind TEXT NOT NULL, "
+            "cog TEXT NOT NULL, "
+            "state TEXT NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS views_accessed ON views (accessed)")
+        self.db.execute(
+            "DELETE FROM views WHERE accessed < ?", (time.time() - self.retention,)
+        )
+        self.db.commit()
+
+    @property
+    def memory(self):
+        """
+        Approximate bytes held by live views and their items, cogs excluded
+        """
+
+        total = 0
+        for view in self.live.values():
+            for owner in [view, *view.children]:
+                total += sys.getsizeof(owner) + sys.getsizeof(vars(owner))
+                total += sum([sys.getsizeof(v) for v in vars(owner).values()])
+        return total
+
+    def __str__(self):
+        pinned = len([v for v in self.live.values() if v.is_pinned()])
+        persisted = self.db.execute("SELECT COUNT(*) FROM views").fetchone()[0]
+        kinds = {}
+        for view in self.live.values():
+            kinds[type(view).__name__] = kinds.get(type(view).__name__, 0) + 1
+        by_kind = ", ".join([f"{n} {kind}" for kind, n in kinds.items()])
+        return (
+            f"- live: {len(self.live):,}/{self.capacity:,} ({pinned:,} pinned)\n"
+            f"- by kind: {by_kind or 'none'}\n"
+            f"- memory: ~{self.memory / 1024:,.1f} KiB\n"
+            f"- evicted: {self.evicted:,}, revived: {self.revived:,}\n"
+            f"- persisted: {persisted:,}"
+        )
+
+    def close(self):
+        for view in list(self.live.values()):
+            if not view.is_pinned():
+                self.persist(view)
+        self.db.commit()
+        self.db.close()
+
+    def register(self, view: DroppyView):
+        self.live[view.token] = view
+        self.live.move_to_end(view.token)
+        self.evict()
+
+    def touch(self, view: DroppyView):
+        if view.token in self.live:
+            self.live.move_to_end(view.token)
+
+    def persist(self, view: DroppyView):
+        self.db.execute(
+            "INSERT OR REPLACE INTO views VALUES (?, ?, ?, ?, ?)",
+            (
+                view.token,
+                type(view).__name__,
+                view.cog.qualified_name,
+                json.dumps(view.dump_state(), ensure_ascii=False),
+                time.time(),
+            ),
+        )
+
+    def evict(self):
+        """
+        Stop and persist least recently used views past capacity, skipping pinned
+        """
+
+        overflow = len(self.live) - self.capacity
+        if overflow <= 0:
+            return
+
+        # the newest may still be constructing
+        for token, view in list(self.live.items())[:-1]:
+            if overflow <= 0:
+                break
+            if view.is_pinned():
+                continue
+            self.persist(view)
+            view.stop()
+            del self.live[token]
+            self.evicted += 1
+            overflow -= 1
+        self.db.commit()
+
+    async def revive(self, ctx: discord.Interaction):
+        """
+        Rebuild the view of a component interaction nothing is listening to
+        """
+
+        if ctx.type != discord.InteractionType.component or not ctx.message:
+            return
+
+        parts = (ctx.data or {}).get("custom_id", "").split(":")
+        if len(parts) != 3 or parts[1] in self.live:
+            return
+
+        kind, token, name = parts
+        row = self.db.execute(
+            "SELECT cog, state FROM views WHERE token = ? AND kind = ?", (token, kind)
+        ).fetchone()
+        cls = DroppyView.kinds.get(kind, None)
+        cog = DroppyCog.bot.get_cog(row[0]) if row else None
+        if not cls or not cog:
+            return
+
+        view = cls.revive(cog, json.loads(row[1]), token)
+        if not view:
+            return
+
+        self.revived += 1
+        self.db.execute("DELETE FROM views WHERE token = ?", (token,))
+        self.db.commit()
+
+        DroppyCog.bot.add_view(view, message_id=ctx.message.id)
+        item = getattr(view, name, None)
+        if isinstance(item, discord.ui.Item):
+            # the store discarded this interaction before it was revived
+            view._dispatch_item(item, ctx)
+
+
 class DroppyModal(discord.ui.Modal):
     def __init__(self, view: DroppyView, title: str):
         super().__init__(title=title, timeout=None)
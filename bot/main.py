@@ -16,7 +16,10 @@ except ModuleNotFoundError:
 
 from common.cog import DroppyCog
 from common.config import load_config
+from common.endpoint import DroppyEndpointPool
+from common.media import DroppyMediaPipeline
 from common.translator import DroppyTranslator
+from common.view import DroppyView, DroppyViewRegistry
 from discord.ext import commands
 from typing import Optional
 
@@ -27,14 +30,28 @@ DroppyCog.enabled_modules = {
     "allocation": True,
     "gpt": True,
     "gpti": True,
+    "metrics": True,
     "trio": False,
 }
+DroppyCog.endpoints = DroppyEndpointPool.from_env(
+    DroppyCog.config.bot.endpoint.window,
+    DroppyCog.config.bot.endpoint.hedge_min_samples,
+    DroppyCog.config.bot.endpoint.max_requeues,
+)
+DroppyCog.media = DroppyMediaPipeline(DroppyCog.config.bot.media.workers)
+# workers fork here, while the process is still single threaded
+DroppyCog.media.start()
 DroppyCog.on_maintenance = False
 DroppyCog.sneaky_mode = False
 localization_storage = os.path.join(
     DroppyCog.cwd, DroppyCog.config.bot.localization.storage
 )
 DroppyCog.translator = DroppyTranslator(localization_storage)
+DroppyView.registry = DroppyViewRegistry(
+    os.path.join(DroppyCog.cwd, DroppyCog.config.bot.views.path),
+    DroppyCog.config.bot.views.capacity,
+    DroppyCog.config.bot.views.retention,
+)
 
 
 class DroppyBot(commands.Bot):
@@ -67,6 +84,12 @@ class DroppyBot(commands.Bot):
         await self.tree.set_translator(DroppyCog.translator)
         await self.tree.sync()
 
+    async def close(self):
+        await super().close()
+        # live views can be revived after a restart
+        DroppyView.registry.close()
+        DroppyCog.media.shutdown()
+
 
 DroppyCog.bot = DroppyBot(
     DroppyCog.config.bot.command_prefix,
@@ -146,6 +169,11 @@ async def on_command_error(ctx: commands.Context, e: commands.CommandError):
         await commands.Bot.on_command_error(DroppyCog.bot, ctx, e)
 
 
+@DroppyCog.bot.listen("on_interaction")
+async def revive_view(ctx: discord.Interaction):
+    await DroppyView.registry.revive(ctx)
+
+
 # initializer
 @DroppyCog.bot.event
 async def on_ready():
@@ -174,4 +202,5 @@ async def on_ready():
 
 
 # online!
-DroppyCog.bot.run(os.environ["BOT_TOKEN"])
+if __name__ == "__main__":
+    DroppyCog.bot.run(os.environ["BOT_TOKEN"])
@@ -0,0 +1,258 @@
+import json
+import openai
+import os
+import sqlite3
+import time
+import zlib
+
+from .models.batch import GptBatchJobModel
+from common.models.gpt import BatchModel
+from typing import Optional
+
+
+# batch states that will not produce any more output
+BATCH_TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+
+class GptBatchQueue:
+    """
+    Durable queue of offline gpt jobs, submitted through the provider batch API
+
+    Jobs go queued -> submitted -> completed/failed, then are deleted on delivery
+    or once delivery failed max_deliveries times
+    """
+
+    def __init__(self, path: str, config: BatchModel):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.config = config
+        # batches live on the account they were submitted to, never rotate this
+        self.client = openai.AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_BATCH_KEY", os.environ["OPENAI_KEY"]),
+            base_url=os.environ.get("OPENAI_BATCH_API", os.environ["OPENAI_API"]),
+        )
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "user_id INTEGER NOT NULL, "
+            "channel_id INTEGER NOT NULL, "
+            "message_id INTEGER NOT NULL, "
+            "model TEXT NOT NULL, "
+            "messages BLOB NOT NULL, "
+            "state TEXT NOT NULL, "
+            "batch_id TEXT, "
+            "content TEXT, "
+            "finish_reason TEXT, "
+            "prompt_tokens INTEGER NOT NULL DEFAULT 0, "
+            "completion_tokens INTEGER NOT NULL DEFAULT 0, "
+            "created REAL NOT NULL, "
+            "deliveries INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(jobs)")]
+        if "deliveries" not in columns:
+            self.db.execute(
+                "ALTER TABLE jobs ADD COLUMN deliveries INTEGER NOT NULL DEFAULT 0"
+            )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.db.commit()
+
+    def __str__(self):
+        counts = dict(
+            self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        )
+        waiting = ", ".join([f"{n} {state}" for state, n in counts.items()])
+        return (
+            f"{waiting or 'idle'} | {self.submitted} submitted, "
+            f"{self.completed} completed, {self.failed} failed, "
+            f"{self.dropped} undeliverable"
+        )
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def as_job(row: sqlite3.Row):
+        job = dict(row)
+        job["messages"] = json.loads(zlib.decompress(job["messages"]))
+        return GptBatchJobModel(**job)
+
+    def enqueue(
+        self,
+        user_id: int,
+        channel_id: int,
+        message_id: int,
+        model: str,
+        messages: list[dict],
+    ):
+        """
+        Persist a job, return its id
+        """
+
+        blob = zlib.compress(json.dumps(messages, ensure_ascii=False).encode())
+        cursor = self.db.execute(
+            "INSERT INTO jobs "
+            "(user_id, channel_id, message_id, model, messages, state, created) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+            (user_id, channel_id, message_id, model, blob, time.time()),
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def user_jobs(self, user_id: int):
+        rows = self.db.execute(
+            "SELECT * FROM jobs WHERE user_id = ? ORDER BY job_id", (user_id,)
+        )
+        return [self.as_job(row) for row in rows]
+
+    def finished(self):
+        rows = self.db.execute(
+            "SELECT * FROM jobs WHERE state IN ('completed', 'failed') ORDER BY job_id"
+        )
+        return [self.as_job(row) for row in rows]
+
+    def delivered(self, job_id: int):
+        self.db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        self.db.commit()
+
+    def undelivered(self, job_id: int):
+        """
+        Count a failed delivery, return whether the job is kept for another try
+
+        Jobs that used up max_deliveries are dropped
+        """
+
+        deliveries = self.db.execute(
+            "UPDATE jobs SET deliveries = deliveries + 1 WHERE job_id = ? "
+            "RETURNING deliveries",
+            (job_id,),
+        ).fetchone()
+        if deliveries and deliveries[0] < self.config.max_deliveries:
+            self.db.commit()
+            return True
+
+        self.delivered(job_id)
+        self.dropped += 1
+        return False
+
+    async def submit(self):
+        """
+        Submit queued jobs as one batch, return the batch id if any was submitted
+        """
+
+        rows = self.db.execute(
+            "SELECT * FROM jobs WHERE state = 'queued' ORDER BY job_id LIMIT ?",
+            (self.config.max_jobs,),
+        ).fetchall()
+        if not rows:
+            return None
+
+        jobs = [self.as_job(row) for row in rows]
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": str(job.job_id),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": job.model, "messages": job.messages},
+                },
+                ensure_ascii=False,
+            )
+            for job in jobs
+        ]
+
+        upload = await self.client.files.create(
+            file=("gptbatch.jsonl", "\n".join(lines).encode()), purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.config.completion_window,
+        )
+
+        self.db.executemany(
+            "UPDATE jobs SET state = 'submitted', batch_id = ? WHERE job_id = ?",
+            [(batch.id, job.job_id) for job in jobs],
+        )
+        self.db.commit()
+        self.submitted += len(jobs)
+        return batch.id
+
+    async def read_results(self, file_id: Optional[str]):
+        """
+        Parse a batch output or error file into job id -> result line
+        """
+
+        if not file_id:
+            return {}
+
+        content = await self.client.files.content(file_id)
+        results = {}
+        for line in content.text.splitlines():
+            if line.strip():
+                result = json.loads(line)
+                results[int(result["custom_id"])] = result
+        return results
+
+    async def poll(self):
+        """
+        Check on submitted batches, settle jobs of the ones that are done
+        """
+
+        batch_ids = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT DISTINCT batch_id FROM jobs WHERE state = 'submitted'"
+            )
+        ]
+        for batch_id in batch_ids:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status not in BATCH_TERMINAL:
+                continue
+
+            # expired batches may still carry partial output
+            results = await self.read_results(batch.error_file_id)
+            results.update(await self.read_results(batch.output_file_id))
+            self.settle(batch_id, results)
+
+    def settle(self, batch_id: str, results: dict[int, dict]):
+        job_ids = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT job_id FROM jobs WHERE batch_id = ? AND state = 'submitted'",
+                (batch_id,),
+            )
+        ]
+
+        for job_id in job_ids:
+            response = (results.get(job_id, None) or {}).get("response", None) or {}
+            if response.get("status_code", None) != 200:
+                self.db.execute(
+                    "UPDATE jobs SET state = 'failed' WHERE job_id = ?", (job_id,)
+                )
+                self.failed += 1
+                continue
+
+            body = response["body"]
+            usage = body.get("usage", None) or {}
+            choice = body["choices"][0]
+            self.db.execute(
+                "UPDATE jobs SET state = 'completed', content = ?, finish_reason = ?, "
+                "prompt_tokens = ?, completion_tokens = ? WHERE job_id = ?",
+                (
+                    choice["message"]["content"] or "",
+                    choice.get("finish_reason", None),
+                    usage.get("prompt_tokens", 0),
+                    usage.get("completion_tokens", 0),
+                    job_id,
+                ),
+            )
+            self.completed += 1
+
+        self.db.commit()
@@ -0,0 +1,142 @@
+import asyncio
+import common.logger as logger
+import discord
+
+from .snapshot import GptSnapshotStore
+from .tokenizer import GptTokenCounter
+from common.cog import DroppyCog
+from common.endpoint import DroppyEndpointPool
+from common.models.gpt import CompactionModel
+
+
+SUMMARY_NAME = "summary"
+SUMMARY_PROMPT = (
+    "Summarize the conversation below so it can replace it as context for "
+    "continuing the conversation. Keep facts, decisions, names, numbers, code "
+    "identifiers and open questions, drop pleasantries. Write in the language "
+    "the conversation is in."
+)
+
+
+class GptCompactor:
+    """
+    Fold older turns of long conversations into a rolling summary
+
+    Runs in background after a reply, the compacted conversation replaces
+    the reply's snapshot so following turns send a small, stable prefix
+    """
+
+    def __init__(
+        self,
+        endpoints: DroppyEndpointPool,
+        snapshots: GptSnapshotStore,
+        config: CompactionModel,
+    ):
+        self.endpoints = endpoints
+        self.snapshots = snapshots
+        self.config = config
+        self.tasks: set[asyncio.Task] = set()
+        self.compacted = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def __str__(self):
+        saved = f"{self.tokens_before:,}->{self.tokens_after:,}"
+        return f"{self.compacted} compacted, {saved}"
+
+    @staticmethod
+    def is_summary(message: dict):
+        return message["role"] == "system" and message.get("name") == SUMMARY_NAME
+
+    @staticmethod
+    def as_transcript(messages: list[dict]):
+        lines = []
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, list):
+                content = "\n".join(
+                    [p["text"] if p["type"] == "text" else "[image]" for p in content]
+                )
+            lines.append(f"{message['role']}: {content}")
+        return "\n\n".join(lines)
+
+    def schedule(
+        self,
+        reply_ids: list[int],
+        messages: list[dict],
+        prompt_tokens: int,
+        counter: GptTokenCounter,
+        user: discord.User,
+    ):
+        """
+        Compact in background if the conversation is over budget
+
+        The summarization is billed to the user whose reply triggered it
+        """
+
+        if not self.config.enabled or prompt_tokens < self.config.budget:
+            return
+
+        task = asyncio.create_task(self.compact(reply_ids, messages, counter, user))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def compact(
+        self,
+        reply_ids: list[int],
+        messages: list[dict],
+        counter: GptTokenCounter,
+        user: discord.User,
+    ):
+        # user init prompts stay verbatim, previous summary gets folded again
+        pinned = []
+        turns = []
+        for message in messages:
+            if message["role"] == "system" and not self.is_summary(message):
+                pinned.append(message)
+            else:
+                turns.append(message)
+
+        older = turns[: -self.config.keep_recent]
+        recent = turns[-self.config.keep_recent :]
+        if not older:
+            return
+
+        try:
+            summary = await self.endpoints.invoke(
+                lambda e: e.chat.completions.create(
+                    model=self.config.model,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": self.as_transcript(older)},
+                    ],
+                ),
+                tokens=sum([counter.count_message(m) for m in older]),
+            )
+        except Exception as e:
+            logger.error(f"gpt compaction failed: {e}", mention=False)
+            return
+
+        allocator = DroppyCog.bot.get_cog("DroppyAllocationManager")
+        if allocator and summary.usage:
+            allocator.commit(user, "gpt", summary.usage.total_tokens)
+
+        # an empty summary would drop the older turns for nothing
+        content = summary.choices[0].message.content
+        if not content or not content.strip():
+            logger.error("gpt compaction returned no summary", mention=False)
+            return
+
+        compacted = pinned + [
+            {
+                "role": "system",
+                "name": SUMMARY_NAME,
+                "content": content,
+            }
+        ]
+        compacted += recent
+
+        self.compacted += 1
+        self.tokens_before += sum([counter.count_message(m) for m in messages])
+        self.tokens_after += sum([counter.count_message(m) for m in compacted])
+        await asyncio.to_thread(self.snapshots.put, reply_ids, compacted)
@@ -1,32 +1,105 @@
+import aiohttp
 import asyncio
 import common.config as config
 import common.helper as helper
+import common.logger as logger
+import common.metrics as metrics
 import discord
 import discord.app_commands as app
-import openai
+import hashlib
+import json
 import os
 
+from .batch import GptBatchQueue
+from .compaction import GptCompactor
 from .help import generate_help_info
+from .models.batch import GptBatchJobModel
+from .models.completion import GptCompletionModel
+from .models.image import GptImageModel
+from .snapshot import GptSnapshotStore
+from .stream import GptReplyStream
+from .tokenizer import GptTokenCounter, REPLY_PRIMING
+from .vision import downscale_image
 from common.cog import DroppyCog
+from common.scheduler import PositionCallback
 from common.exception import DroppyBotError
-from discord.ext import commands
+from common.models.gpt import SpecItemModel
+from discord.ext import commands, tasks
 from typing import Optional, Union
 
 
 class GPTHandler(DroppyCog):
     def __init__(self):
-        self.endpoint = openai.AsyncOpenAI(
-            api_key=os.environ["OPENAI_KEY"], base_url=os.environ["OPENAI_API"]
+        self.user_init: dict[str, str] = self.load_user_init()
+
+        snapshot = self.config.gpt.snapshot
+        self.snapshots = GptSnapshotStore(
+            os.path.join(self.cwd, snapshot.path),
+            snapshot.max_bytes,
+            snapshot.retention,
         )
-        self.endpoint_alt = openai.AsyncOpenAI(
-            api_key=os.environ["OPENAI_ALT_KEY"], base_url=os.environ["OPENAI_ALT_API"]
+        self.compactor = GptCompactor(
+            self.endpoints, self.snapshots, self.config.gpt.contextual.compaction
         )
 
-        self.user_init: dict[str, str] = self.load_user_init()
-        self.user_ctx: dict[int, str] = {}
+        # loaded off the event loop in cog_load, tiktoken reads this at load time
+        os.environ.setdefault(
+            "TIKTOKEN_CACHE_DIR",
+            os.path.join(self.cwd, self.config.gpt.model.encoding_cache),
+        )
+        self.token_counters: dict[str, GptTokenCounter] = {
+            spec.encoding: GptTokenCounter(spec.encoding)
+            for spec in self.config.gpt.model.specs
+        }
+
+        attachment = self.config.gpt.attachment
+        self.attachment_slots = asyncio.Semaphore(attachment.concurrency)
+        self.attachment_cache: helper.LRUCache[int, str] = helper.LRUCache(
+            attachment.cache_bytes, weigher=len
+        )
+        self.image_cache: helper.LRUCache[int, GptImageModel] = helper.LRUCache(
+            attachment.image.cache_bytes, weigher=lambda image: len(image.url)
+        )
+        # keyed by a digest of the data url, snapshot replays never see attachment
+        # ids, and holding the url itself would outlive image_cache's byte budget
+        self.vision_savings: helper.LRUCache[bytes, int] = helper.LRUCache(
+            attachment.image.savings_capacity
+        )
+        self.vision_tokens_saved = 0
+        self.http_session: Optional[aiohttp.ClientSession] = None
+
+        response_cache = self.config.gpt.response_cache
+        self.response_cache: helper.LRUCache[str, GptCompletionModel] = (
+            helper.LRUCache(response_cache.capacity, response_cache.ttl)
+        )
+        self.completion_flights: helper.SingleFlight[str, GptCompletionModel] = (
+            helper.SingleFlight()
+        )
+        self.tokens_saved = 0
+
+        message_cache = self.config.gpt.contextual.message_cache
+        self.message_cache: helper.LRUCache[int, discord.Message] = helper.LRUCache(
+            message_cache.capacity, message_cache.ttl
+        )
+
+        batch = self.config.gpt.batch
+        self.batches = GptBatchQueue(os.path.join(self.cwd, batch.path), batch)
+        self.batch_poll.start()
 
         self.help_info["GPT"] = generate_help_info
 
+    async def cog_load(self):
+        await asyncio.gather(
+            *[asyncio.to_thread(c.load) for c in self.token_counters.values()]
+        )
+
+    async def cog_unload(self):
+        self.batch_poll.cancel()
+        self.batches.close()
+        self.snapshots.close()
+        if self.http_session:
+            await self.http_session.close()
+
     def load_user_init(self):
         user_init_path = os.path.join(self.cwd, self.config.gpt.user_init_path)
         return config.load_json(user_init_path)
@@ -53,12 +126,34 @@ class GPTHandler(DroppyCog):
             return None
 
         content = ctx.system_content
-        print(content)
         if "gpt" in content and "gpti" not in content:
             return True
 
         return None
 
+    def cache_message(self, message: Optional[discord.Message]):
+        if isinstance(message, discord.Message):
+            self.message_cache.put(message.id, message)
+
+    async def fetch_message(
+        self, channel: discord.abc.Messageable, reference: discord.MessageReference
+    ):
+        """
+        Resolve a message reference, consulting the message cache before discord API
+        """
+
+        message = self.message_cache.get(reference.message_id)
+        if message:
+            return message
+
+        # discord only resolves a single level of reference for fetched messages
+        message = reference.resolved
+        if not isinstance(message, discord.Message):
+            message = await channel.fetch_message(reference.message_id)
+
+        self.cache_message(message)
+        return message
+
     def gpt_system_content(self, content: str):
         return {"role": "system", "content": content}
 
@@ -68,28 +163,42 @@ class GPTHandler(DroppyCog):
     def gpt_bot_content(self, content: str):
         return {"role": "assistant", "content": content}
 
-    def truncate_contextual_input(self, messages: list[dict], token_limit: int):
-        accum = 0
-        truncated = []
-        for message in messages:
-            if message["role"] == "system":
-                truncated.append(message)
-                accum += len(message["content"])
+    def get_token_counter(self, gpt_model: SpecItemModel):
+        counter = self.token_counters.get(gpt_model.encoding, None)
+        if not counter:
+            # never load on the event loop, estimates until the load lands
+            counter = GptTokenCounter(gpt_model.encoding)
+            self.token_counters[gpt_model.encoding] = counter
+            asyncio.get_running_loop().run_in_executor(None, counter.load)
+        return counter
+
+    def truncate_contextual_input(
+        self, messages: list[dict], token_limit: int, counter: GptTokenCounter
+    ):
+        """
+        Fit messages into the token budget
+
+        System messages are always kept, then the newest turns backwards
+        until the budget is hit, so the oldest turns are dropped first
+        """
+
+        kept = {i for i, m in enumerate(messages) if m["role"] == "system"}
+        accum = REPLY_PRIMING + sum(counter.count_message(messages[i]) for i in kept)
 
-            if accum >= token_limit:
+        newest = len(messages) - 1
+        for i in reversed(range(len(messages))):
+            if i in kept:
+                continue
+
+            tokens = counter.count_message(messages[i])
+            # the newest message is always sent
+            if accum + tokens > token_limit and i != newest:
                 break
 
-            truncated.append(message)
-            content = message["content"]
-            if isinstance(content, list):
-                for payload in content:
-                    match payload["type"]:
-                        case "image_url":
-                            accum += 935
-                        case "text":
-                            accum += len(payload["text"])
-            else:
-                accum += len(message["content"])
+            kept.add(i)
+            accum += tokens
+
+        truncated = [m for i, m in enumerate(messages) if i in kept]
         return truncated, accum
 
     async def retrieve_conversation(self, ctx: discord.Message):
@@ -115,12 +224,20 @@ class GPTHandler(DroppyCog):
         answer = ref.resolved
         if not answer.author.bot:
             return []
+        self.cache_message(answer)
 
         retrieval = self.config.gpt.contextual.max_ctx_per_user
         while retrieval:
             if not answer:
                 break
 
+            # a persisted snapshot already holds everything up to this answer
+            snapshot = await asyncio.to_thread(self.snapshots.get, answer.id)
+            if snapshot:
+                messages.extend(reversed(snapshot))
+                valid_gpt = True
+                break
+
             # gpt response is an embed
             messages.append(self.gpt_bot_content(answer.embeds[0].description))
 
@@ -130,7 +247,7 @@ class GPTHandler(DroppyCog):
                 break
 
             if isinstance(question, discord.MessageReference):
-                question = await ctx.channel.fetch_message(question.message_id)
+                question = await self.fetch_message(ctx.channel, question)
                 if not question:
                     break
 
@@ -147,53 +264,122 @@ class GPTHandler(DroppyCog):
 
                 prompt = question.content
                 messages.append(self.gpt_user_content(prompt))
-            elif isinstance(question, discord.MessageInteraction):
-                if (
-                    "gpt" in question.name
-                    and question.name != "gptinit"
-                    and answer.id in self.user_ctx
-                ):
-                    valid_gpt = True
-                    prompt = self.user_ctx[answer.id]
-                    messages.append(self.gpt_user_content(prompt))
-                break
             else:
+                # slash command prompts are only recoverable from snapshots
                 break
 
             if not question.reference or not question.reference.message_id:
                 break
 
-            answer = await ctx.channel.fetch_message(question.reference.message_id)
+            answer = await self.fetch_message(ctx.channel, question.reference)
             retrieval -= 1
 
         messages.reverse()
         return messages if valid_gpt else []
 
+    def get_http_session(self):
+        if not self.http_session or self.http_session.closed:
+            self.http_session = aiohttp.ClientSession()
+        return self.http_session
+
+    async def read_text_attachment(self, attachment: discord.Attachment):
+        """
+        Download and decode a text file, capped in bytes and tokens
+
+        Decoded text is cached by attachment id
+        """
+
+        text = self.attachment_cache.get(attachment.id)
+        if text is not None:
+            return text
+
+        limits = self.config.gpt.attachment
+        oversized = attachment.size > limits.max_file_bytes
+        async with self.attachment_slots:
+            if not oversized:
+                data = await attachment.read()
+            else:
+                # only pull the head of an oversized file
+                data = bytearray()
+                async with self.get_http_session().get(attachment.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(1 << 16):
+                        data += chunk
+                        if len(data) >= limits.max_file_bytes:
+                            break
+                data = bytes(data[: limits.max_file_bytes])
+
+        counter = self.get_token_counter(
+            self.get_gpt_model(self.config.gpt.model.advanced)
+        )
+        text, truncated = await asyncio.to_thread(
+            counter.truncate_text,
+            data.decode("utf-8", errors="replace"),
+            limits.max_file_tokens,
+        )
+        if truncated or oversized:
+            text += "\n\n(truncated)"
+
+        text = f"file: {attachment.filename}\n\n{text}\n\nend of file"
+        self.attachment_cache.put(attachment.id, text)
+        return text
+
+    async def read_image_attachment(self, attachment: discord.Attachment):
+        """
+        Download an image, downscale it to the vision tile budget and inline it
+
+        Processed images are cached by attachment id
+        """
+
+        image = self.image_cache.get(attachment.id)
+        if image:
+            return image
+
+        limits = self.config.gpt.attachment.image
+        detail = self.config.gpt.model.vision_fidelity
+        async with self.attachment_slots:
+            data = await attachment.read()
+
+        url, original_tokens, tokens = await self.media.run(
+            "downscale", downscale_image, data, detail, limits.max_tiles, limits.quality
+        )
+        image = GptImageModel(
+            url=url, detail=detail, original_tokens=original_tokens, tokens=tokens
+        )
+        self.image_cache.put(attachment.id, image)
+        self.vision_savings.put(self.get_vision_key(url), image.tokens_saved)
+        return image
+
     async def process_file_upload(self, attached: discord.Message):
         """
-        Process text files and images
-        """
-
-        file_contents = []
-        for attachment in attached.attachments:
-            if attachment.content_type.startswith("image"):
-                file_contents.append(
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": attachment.proxy_url,
-                            "detail": self.config.gpt.model.vision_fidelity,
-                        },
-                    }
-                )
-            if attachment.content_type.startswith("text"):
-                file_contents.append(
-                    {
-                        "type": "text",
-                        "text": f"file: {attachment.filename}\n\n{(await attachment.read()).decode('utf-8')}\n\nend of file",
-                    }
-                )
-        return file_contents
+        Process text files and images, concurrently
+        """
+
+        async def process_attachment(attachment: discord.Attachment):
+            content_type = attachment.content_type or ""
+            if content_type.startswith("image"):
+                try:
+                    image = await self.read_image_attachment(attachment)
+                    url, detail = image.url, image.detail
+                except Exception:
+                    # undecodable here, let the provider fetch it as is
+                    url = attachment.proxy_url
+                    detail = self.config.gpt.model.vision_fidelity
+                return {
+                    "type": "image_url",
+                    "image_url": {"url": url, "detail": detail},
+                }
+            if content_type.startswith("text"):
+                return {
+                    "type": "text",
+                    "text": await self.read_text_attachment(attachment),
+                }
+            return None
+
+        file_contents = await asyncio.gather(
+            *[process_attachment(a) for a in attached.attachments]
+        )
+        return [f for f in file_contents if f]
 
     async def create_gpt_input_model(self, ctx: commands.Context, prompt: str):
         """
@@ -214,6 +400,127 @@ class GPTHandler(DroppyCog):
         messages.append(self.gpt_user_content(prompt))
         return messages
 
+    async def stream_completion(
+        self,
+        stream: GptReplyStream,
+        timer: metrics.DroppyTimer,
+        model: str,
+        messages: list,
+        **schedule,
+    ):
+        """
+        Consume a streamed chat completion into the reply stream
+
+        Return finish reason, usage and time to first token
+        """
+
+        # hedging only waits for the stream to open, not the whole generation
+        completion = await self.endpoints.invoke(
+            lambda e: e.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            hedge=True,
+            kind="stream",
+            **schedule,
+        )
+
+        finish_reason = None
+        usage = None
+        first_token = None
+        async for chunk in completion:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+            if choice.delta.content:
+                if first_token is None:
+                    first_token = timer.mark("ttfb")
+                await stream.feed(choice.delta.content)
+
+        return finish_reason, usage, first_token
+
+    async def request_completion(
+        self,
+        stream: GptReplyStream,
+        timer: metrics.DroppyTimer,
+        gpt_model: SpecItemModel,
+        messages: list,
+        prompt_tokens: int,
+        author: discord.User,
+        on_position: PositionCallback,
+    ):
+        """
+        Request a chat completion, rendering it into the reply stream
+
+        Waits in the shared request queue under the author's turn
+        """
+
+        schedule = {
+            "user_id": author.id,
+            "tokens": prompt_tokens,
+            "on_position": on_position,
+        }
+        if self.config.gpt.streaming.enabled:
+            finish_reason, usage, first_token = await self.stream_completion(
+                stream, timer, gpt_model.name, messages, **schedule
+            )
+        else:
+            completion = await self.endpoints.invoke(
+                lambda e: e.chat.completions.create(
+                    model=gpt_model.name, messages=messages
+                ),
+                **schedule,
+            )
+            finish_reason = completion.choices[0].finish_reason
+            usage = completion.usage
+            first_token = None
+            await stream.feed(completion.choices[0].message.content)
+
+        if usage:
+            prompt_tokens = usage.prompt_tokens
+            completion_tokens = usage.completion_tokens
+        else:
+            # provider did not report streamed usage, estimate it
+            counter = self.get_token_counter(gpt_model)
+            completion_tokens = counter.count_text(stream.content)
+
+        return GptCompletionModel(
+            content=stream.content,
+            finish_reason=finish_reason,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            first_token=first_token,
+        )
+
+    @staticmethod
+    def get_vision_key(url: str):
+        return hashlib.blake2b(url.encode(), digest_size=16).digest()
+
+    def get_completion_key(self, model: str, messages: list[dict]):
+        """
+        Hash a normalized conversation, None if it can't be reused
+        """
+
+        normalized = []
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, list):
+                # images are behind expiring urls, never reuse them
+                if [p for p in content if p["type"] != "text"]:
+                    return None
+                content = "".join([p["text"] for p in content])
+            normalized.append((message["role"], (content or "").strip()))
+
+        payload = json.dumps([model, normalized], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
     async def request_and_reply(
         self,
         ctx: discord.Message,
@@ -226,53 +533,112 @@ class GPTHandler(DroppyCog):
         """
         Make actual gpt request with openAI endpoint
 
-        Update user context cache
+        Identical concurrent requests share one upstream call,
+        completed responses are reused when response cache is enabled
+
+        Persist the answered conversation snapshot
         """
 
         locale = self.get_ctx_locale(ctx)
 
         gpt_model = self.get_gpt_model(model)
         max_token = gpt_model.max_token * self.config.gpt.contextual.max_ctx_percentage
-        messages, accum = self.truncate_contextual_input(messages, max_token)
+        counter = self.get_token_counter(gpt_model)
+        messages, accum = self.truncate_contextual_input(messages, max_token, counter)
+
+        streaming = self.config.gpt.streaming
+        stream = GptReplyStream(
+            ref,
+            ctx.author,
+            chunk_size=streaming.chunk_size,
+            interval=streaming.edit_interval,
+        )
+
+        key = self.get_completion_key(gpt_model.name, messages)
+        use_cache = key and self.config.gpt.response_cache.enabled
+
+        async def on_position(position: int):
+            indicator = self.translate(self.config.gpt.thinking_indicator, locale)
+            queued = self.translate("bot_queue_position", locale).format(position)
+            embed = helper.as_embed(
+                f"{indicator}\n{queued}", ctx.author, footer_append=None
+            )
+            await ref.edit(embed=embed)
 
-        helper.latency_start(ref.id)
         # request for chat completion
-        completion = await self.endpoint.chat.completions.create(
-            model=gpt_model.name, messages=messages
-        )
+        async def request():
+            return await self.request_completion(
+                stream, timer, gpt_model, messages, accum, ctx.author, on_position
+            )
+
+        with metrics.timer("gpt", gpt_model.name) as timer:
+            completion = self.response_cache.get(key) if use_cache else None
+            reused = completion is not None
+            if not reused:
+                if key:
+                    completion, reused = await self.completion_flights.do(key, request)
+                else:
+                    completion = await request()
+
+            if reused:
+                await stream.feed(completion.content)
+        total = timer.elapsed
 
-        # get perf latency
-        latency = f"⏱️ {helper.latency_end(ref.id)}ms"
+        first_token = completion.first_token if not reused else None
+        latency = f"⏱️ {first_token or total}ms / {total}ms"
 
         # content policy?
-        if completion.choices[0].finish_reason == "content_filter":
+        if completion.finish_reason == "content_filter":
             raise DroppyBotError(self.translate("gpt_content_blocked", locale))
 
-        # respond to user
-        raw_content = completion.choices[0].message.content
-        responses = helper.chunk_with_size(raw_content, 3800)
+        if use_cache and not reused:
+            self.response_cache.put(key, completion)
 
-        ref = await ref.edit(
-            embed=helper.as_embed(responses[0], ctx.author, footer_append=latency)
+        # respond to user
+        await stream.flush(latency, final=True)
+        for reply in stream.refs:
+            self.cache_message(reply)
+        ref = stream.last_ref
+
+        # persist what this reply answered, so replying to it skips the chain walk
+        reply_ids = [reply.id for reply in stream.refs]
+        conversation = messages + [self.gpt_bot_content(completion.content)]
+        await asyncio.to_thread(self.snapshots.put, reply_ids, conversation)
+        self.compactor.schedule(reply_ids, conversation, accum, counter, ctx.author)
+
+        vision_saved = sum(
+            [
+                self.vision_savings.peek(self.get_vision_key(part["image_url"]["url"]))
+                or 0
+                for message in messages
+                if isinstance(message["content"], list)
+                for part in message["content"]
+                if part["type"] == "image_url"
+            ]
         )
-        for i, res in enumerate(responses[1:]):
-            ref = await ref.reply(
-                embed=self.as_embed(res, ctx.author, f"{i + 2} / {len(responses)}"),
-                silent=True,
-            )
+        self.vision_tokens_saved += vision_saved
 
-        token = completion.usage.completion_tokens
-        tally = completion.usage.total_tokens
+        prompt_tokens = completion.prompt_tokens
+        token = completion.completion_tokens
+        tally = completion.total_tokens
+        if reused:
+            self.tokens_saved += tally
 
         if not private:
             prompt = messages[-1]["content"]
-            context = f"({completion.usage.prompt_tokens - len(prompt)})+{len(prompt)}"
+            context = f"({prompt_tokens - len(prompt)})+{len(prompt)}"
             telemetry = helper.jump_url(f"{context}+{token}={tally}", ref.jump_url)
+            reuse = f"♻️ {self.response_cache}, {self.tokens_saved:,} saved"
+            if reused:
+                reuse = f"**reused** {reuse}"
+            vision = f"👁️ {vision_saved:,} saved, {self.vision_tokens_saved:,} total"
             self.log(
                 ctx,
-                f"{gpt_model.name} {telemetry} {latency}\n{helper.codeblock(prompt)}",
+                f"{gpt_model.name} {telemetry} {latency} 📦 {self.message_cache} {reuse} {vision} 🗜️ {self.compactor}\n{helper.codeblock(prompt)}",
             )
-        return tally
+
+        # reused completions cost nothing
+        return 0 if reused else tally
 
     @helper.sanitize
     async def create_gpt_request(
@@ -284,9 +650,6 @@ class GPTHandler(DroppyCog):
 
         ref = await self.get_ctx_ref(ctx)
 
-        if ctx.interaction:
-            self.user_ctx[ref.id] = prompt
-
         messages = await self.create_gpt_input_model(ctx, prompt)
         return await self.request_and_reply(
             ctx.message, ref, messages, model, private=private
@@ -333,6 +696,155 @@ class GPTHandler(DroppyCog):
         model = self.config.gpt.model.advanced
         return await self.create_gpt_request(ctx, prompt, model, True)
 
+    @commands.command()
+    @DroppyCog.failsafe_ref()
+    @DroppyCog.allocated("gpt")
+    async def gptbatch(self, ctx: commands.Context, *, prompt: str):
+        """
+        Queue a prompt for offline batch processing at a discount, text command only
+        """
+
+        ref = await self.get_ctx_ref(ctx)
+        locale = self.get_ctx_locale(ctx)
+
+        model = self.config.gpt.model.advanced
+        messages = await self.create_gpt_input_model(ctx, prompt)
+        job_id = self.batches.enqueue(
+            ctx.author.id, ctx.channel.id, ctx.message.id, model, messages
+        )
+
+        queued = self.translate("gptbatch_queued", locale).format(job_id)
+        await ref.edit(embed=helper.as_embed(queued, ctx.author))
+        self.log(ctx.message, f"gpt-batch #{job_id} queued, {self.batches}")
+
+        # usage is committed on delivery
+        return 0
+
+    @commands.command()
+    @DroppyCog.failsafe_ref()
+    async def gptbatchls(self, ctx: commands.Context):
+        """
+        List your pending batch jobs, text command only
+        """
+
+        ref = await self.get_ctx_ref(ctx)
+        locale = self.get_ctx_locale(ctx)
+
+        jobs = self.batches.user_jobs(ctx.author.id)
+        if not jobs:
+            empty = self.translate("gptbatch_empty", locale)
+            await ref.edit(embed=helper.as_embed(empty, ctx.author))
+            return
+
+        lines = [
+            f"- #{job.job_id} `{job.state}` <t:{int(job.created)}:R>\n"
+            f"{job.messages[-1]['content'][:64]}"
+            for job in jobs
+        ]
+        embed = helper.as_embed("\n".join(lines), ctx.author)
+        embed.title = self.translate("gptbatch_list", locale)
+        await ref.edit(embed=embed)
+
+    async def deliver_batch_job(self, job: GptBatchJobModel):
+        """
+        Reply to the queued message with the batch result, DM if it's gone
+
+        Commit discounted usage, persist the snapshot so it can be continued
+        """
+
+        user = await self.bot.fetch_user(job.user_id)
+        locale = discord.Locale.american_english
+        try:
+            channel = self.bot.get_channel(job.channel_id)
+            if not channel:
+                channel = await self.bot.fetch_channel(job.channel_id)
+            question = await channel.fetch_message(job.message_id)
+            locale = self.get_ctx_locale(question)
+            send = question.reply
+        except discord.HTTPException:
+            question = None
+            send = user.send
+
+        if job.state != "completed":
+            failed = self.translate("gptbatch_failed", locale).format(job.job_id)
+            await send(embed=helper.as_embed(failed, user), silent=True)
+            return
+
+        content = job.content
+        if job.finish_reason == "content_filter":
+            content = self.translate("gpt_content_blocked", locale)
+
+        refs = []
+        chunks = helper.chunk_with_size(content, self.config.gpt.streaming.chunk_size)
+        for i, chunk in enumerate(chunks or [""]):
+            footer = f"📨 #{job.job_id}" if i == 0 else f"{i + 1} / {len(chunks)}"
+            embed = helper.as_embed(chunk, user, footer_append=footer)
+            refs.append(await send(embed=embed, silent=True))
+            send = refs[-1].reply
+
+        for reply in refs:
+            self.cache_message(reply)
+        reply_ids = [reply.id for reply in refs]
+        conversation = job.messages + [self.gpt_bot_content(job.content)]
+        await asyncio.to_thread(self.snapshots.put, reply_ids, conversation)
+
+        usage = job.total_tokens * self.config.gpt.batch.discount
+        allocator = self.bot.get_cog("DroppyAllocationManager")
+        if allocator and usage:
+            allocator.commit(user, "gpt", usage)
+
+        if question:
+            telemetry = helper.jump_url(
+                f"{job.prompt_tokens}+{job.completion_tokens}={job.total_tokens}",
+                refs[-1].jump_url,
+            )
+            self.log(
+                question,
+                f"gpt-batch #{job.job_id} {job.model} {telemetry} (x{self.config.gpt.batch.discount}) {self.batches}",
+            )
+
+    async def notify_undeliverable(self, job: GptBatchJobModel):
+        """
+        DM the user a job that was dropped undelivered, best effort
+        """
+
+        try:
+            user = await self.bot.fetch_user(job.user_id)
+            prompt = self.translate("gptbatch_undeliverable")
+            await user.send(
+                embed=helper.as_embed(prompt.format(job.job_id), user), silent=True
+            )
+        except discord.HTTPException as e:
+            logger.error(f"gpt batch #{job.job_id} notice failed: {e}", mention=False)
+
+    @tasks.loop(seconds=DroppyCog.config.gpt.batch.poll_interval)
+    async def batch_poll(self):
+        try:
+            await self.batches.submit()
+            await self.batches.poll()
+        except Exception as e:
+            # leave jobs where they are, next round picks them up again
+            logger.error(f"gpt batch polling failed: {e}", mention=False)
+
+        for job in self.batches.finished():
+            try:
+                await self.deliver_batch_job(job)
+            except Exception as e:
+                # kept for the next round until it runs out of deliveries
+                if self.batches.undelivered(job.job_id):
+                    logger.error(
+                        f"gpt batch #{job.job_id} delivery failed: {e}", mention=False
+                    )
+                    continue
+                logger.error(f"gpt batch #{job.job_id} dropped undelivered: {e}")
+                await self.notify_undeliverable(job)
+                continue
+            self.batches.delivered(job.job_id)
+
+    @batch_poll.before_loop
+    async def batch_poll_ready(self):
+        await self.bot.wait_until_ready()
+
     @commands.hybrid_command(description="gptinit_desc")
     @app.rename(prompt="gptinit_prompt")
     @app.describe(prompt="gptinit_prompt_desc")
@@ -375,18 +887,30 @@ class GPTHandler(DroppyCog):
         model = self.config.gpt.model.advanced
         return await self.request_and_reply(ctx, ref, messages, model)
 
+    @commands.Cog.listener("on_message_edit")
+    async def gpt_cache_edit(self, before: discord.Message, after: discord.Message):
+        if before.id in self.message_cache:
+            self.cache_message(after)
+
+    @commands.Cog.listener("on_message_delete")
+    async def gpt_cache_delete(self, ctx: discord.Message):
+        self.message_cache.pop(ctx.id)
+
     @commands.Cog.listener("on_message")
     async def gpt_reply(self, ctx: discord.Message):
+        self.cache_message(ctx)
+
         if not self.prepass_check_internal(ctx):
             return
 
         # check if user replied to a gpt response for a "contextual conversation"
         # as a first step to save resource on actual chain de-referencing
         ref = ctx.reference
-        if not ref or not ref.resolved:
+        if not ref or self.snapshots.is_answer(ref.message_id) is False:
             return
 
-        if not ref.resolved.author.bot:
+        # replies older than the answer index fall back to the resolved author
+        if not ref.resolved or not ref.resolved.author.bot:
             return
 
         messages = await self.retrieve_conversation(ctx)
@@ -0,0 +1,22 @@
+from common.models.shared import *
+
+
+class GptBatchJobModel(BaseModel):
+    job_id: NonNegativeInt
+    user_id: NonNegativeInt
+    channel_id: NonNegativeInt
+    message_id: NonNegativeInt
+    model: sanitized_str
+    messages: list[dict]
+    state: sanitized_str
+    batch_id: Optional[sanitized_str] = None
+    content: Optional[str] = None
+    finish_reason: Optional[sanitized_str] = None
+    prompt_tokens: NonNegativeInt = 0
+    completion_tokens: NonNegativeInt = 0
+    created: float
+    deliveries: NonNegativeInt = 0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
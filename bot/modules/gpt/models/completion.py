@@ -0,0 +1,13 @@
+from common.models.shared import *
+
+
+class GptCompletionModel(BaseModel):
+    content: str
+    finish_reason: Optional[sanitized_str] = None
+    prompt_tokens: NonNegativeInt
+    completion_tokens: NonNegativeInt
+    first_token: Optional[NonNegativeInt] = None
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
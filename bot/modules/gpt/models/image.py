@@ -0,0 +1,12 @@
+from common.models.shared import *
+
+
+class GptImageModel(BaseModel):
+    url: str
+    detail: sanitized_str
+    original_tokens: NonNegativeInt
+    tokens: NonNegativeInt
+
+    @property
+    def tokens_saved(self):
+        return self.original_tokens - self.tokens
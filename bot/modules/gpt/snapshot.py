@@ -0,0 +1,191 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from typing import Iterable, Optional
+
+
+# discord snowflakes carry their creation time in ms since this epoch
+DISCORD_EPOCH = 1420070400000
+# the in-memory answer index is pruned at most this often
+PRUNE_SECONDS = 3600
+
+
+def snowflake_at(timestamp: float):
+    """
+    Smallest snowflake created at or after timestamp
+    """
+
+    return max(int(timestamp * 1000) - DISCORD_EPOCH, 0) << 22
+
+
+class GptSnapshotStore:
+    """
+    Persisted conversation snapshots keyed by bot reply id
+
+    Each snapshot is the exact message list a reply answered, plus the answer,
+    bounded by its compressed size since inline images dwarf the text
+
+    Reply ids are also kept in an answer index, loaded into memory. Both drop
+    what is older than retention, the answer index by snowflake age
+
+    get and put block on sqlite, run them off the event loop
+    """
+
+    def __init__(self, path: str, max_bytes: int, retention: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.retention = retention * 86400
+        # reads only note their access, it is written with the next put
+        self.touched: dict[int, float] = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "reply_id INTEGER PRIMARY KEY, "
+            "messages BLOB NOT NULL, "
+            "accessed REAL NOT NULL, "
+            "size INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(snapshots)")]
+        if "size" not in columns:
+            self.db.execute(
+                "ALTER TABLE snapshots ADD COLUMN size INTEGER NOT NULL DEFAULT 0"
+            )
+            self.db.execute("UPDATE snapshots SET size = LENGTH(messages)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS snapshots_accessed ON snapshots (accessed)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (reply_id INTEGER PRIMARY KEY)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)"
+        )
+        # replies posted before the index existed were never recorded
+        self.db.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('indexed_since', ?)", (time.time(),)
+        )
+        self.indexed_since: float = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'indexed_since'"
+        ).fetchone()[0]
+
+        # outlives snapshot capacity eviction, so older conversations still resolve
+        self.answers: set[int] = set()
+        self.prune(time.time())
+        self.answers = {
+            row[0] for row in self.db.execute("SELECT reply_id FROM answers")
+        }
+        self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+    @property
+    def size(self):
+        with self.lock:
+            return (
+                self.db.execute("SELECT SUM(size) FROM snapshots").fetchone()[0] or 0
+            )
+
+    def close(self):
+        with self.lock:
+            self.flush_touched()
+            self.db.commit()
+            self.db.close()
+
+    def is_answer(self, reply_id: Optional[int]) -> Optional[bool]:
+        """
+        Whether a message is a gpt reply, without touching the database
+
+        None if the message predates what the index covers
+        """
+
+        if reply_id is None:
+            return False
+        if reply_id in self.answers:
+            return True
+        covered = max(self.indexed_since, time.time() - self.retention)
+        if reply_id >= snowflake_at(covered):
+            return False
+        return None
+
+    def prune(self, now: float):
+        """
+        Drop answers older than retention from the index and memory
+        """
+
+        cutoff = snowflake_at(now - self.retention)
+        self.db.execute("DELETE FROM answers WHERE reply_id < ?", (cutoff,))
+        self.answers = {a for a in self.answers if a >= cutoff}
+        self.pruned = now
+
+    def get(self, reply_id: int) -> Optional[list[dict]]:
+        """
+        The snapshot a reply answered, None if there is none, blocking
+        """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT messages FROM snapshots WHERE reply_id = ?", (reply_id,)
+            ).fetchone()
+            if not row:
+                return None
+            self.touched[reply_id] = time.time()
+        return json.loads(zlib.decompress(row[0]))
+
+    def flush_touched(self):
+        """
+        Write the accesses noted by get, under the lock
+        """
+
+        self.db.executemany(
+            "UPDATE snapshots SET accessed = ? WHERE reply_id = ?",
+            [(accessed, reply_id) for reply_id, accessed in self.touched.items()],
+        )
+        self.touched.clear()
+
+    def put(self, reply_ids: Iterable[int], messages: list[dict]):
+        """
+        Store a snapshot under every reply message it was rendered into, blocking
+        """
+
+        reply_ids = list(reply_ids)
+        blob = zlib.compress(json.dumps(messages, ensure_ascii=False).encode())
+        now = time.time()
+        with self.lock:
+            self.flush_touched()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)",
+                [(reply_id, blob, now, len(blob)) for reply_id in reply_ids],
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO answers VALUES (?)",
+                [(reply_id,) for reply_id in reply_ids],
+            )
+            self.answers.update(reply_ids)
+            self.evict(now)
+            self.db.commit()
+
+    def evict(self, now: float):
+        """
+        Drop snapshots past retention, then least recently used past max_bytes
+        """
+
+        self.db.execute(
+            "DELETE FROM snapshots WHERE accessed < ?", (now - self.retention,)
+        )
+        self.db.execute(
+            "DELETE FROM snapshots WHERE reply_id IN ("
+            "SELECT reply_id FROM (SELECT reply_id, SUM(size) OVER ("
+            "ORDER BY accessed DESC, reply_id DESC) AS total FROM snapshots) "
+            "WHERE total > ?)",
+            (self.max_bytes,),
+        )
+        if now - self.pruned > PRUNE_SECONDS:
+            self.prune(now)
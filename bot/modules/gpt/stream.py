@@ -0,0 +1,100 @@
+import common.helper as helper
+import common.metrics as metrics
+import discord
+import time
+
+from typing import Optional
+
+
+class GptReplyStream:
+    """
+    Progressively render a completion into reply embeds
+
+    Edits are coalesced to at most one per interval,
+    content past the chunk size rolls over into follow-up replies,
+    chunks are cut incrementally so each flush only renders the tail
+    """
+
+    def __init__(
+        self,
+        ref: discord.Message,
+        author: discord.User,
+        *,
+        chunk_size: int,
+        interval: float,
+    ):
+        self.refs: list[discord.Message] = [ref]
+        self.rendered: list[tuple[str, Optional[str]]] = []
+        self.author = author
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.deltas: list[str] = []
+        self.chunker = helper.MarkdownChunker(chunk_size)
+        self.chunks: list[str] = []
+        self.last_flush = 0.0
+
+    @property
+    def content(self):
+        return "".join(self.deltas)
+
+    @property
+    def last_ref(self):
+        return self.refs[-1]
+
+    async def feed(self, delta: Optional[str]):
+        """
+        Append a delta, flush if the coalescing interval has passed
+        """
+
+        if not delta:
+            return
+
+        self.deltas.append(delta)
+        self.chunks += self.chunker.feed(delta)
+        if time.perf_counter() - self.last_flush >= self.interval:
+            await self.flush()
+
+    async def flush(self, footer: Optional[str] = None, *, final: bool = False):
+        """
+        Render accumulated content, only editing the embeds that changed
+        """
+
+        self.last_flush = time.perf_counter()
+
+        if final:
+            self.chunks += self.chunker.close()
+            chunks = self.chunks or [""]
+        else:
+            # sealed chunks never change, only the tail is still growing
+            partial = self.chunker.peek()
+            chunks = self.chunks
+            if partial or not chunks:
+                chunks = chunks + [partial]
+
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                chunk_footer = footer
+            elif final:
+                chunk_footer = f"{i + 1} / {len(chunks)}"
+            else:
+                chunk_footer = f"{i + 1}"
+
+            if i < len(self.rendered) and self.rendered[i] == (chunk, chunk_footer):
+                continue
+
+            embed = helper.as_embed(chunk, self.author, footer_append=chunk_footer)
+            if i < len(self.refs):
+                with metrics.timer("discord", "edit"):
+                    self.refs[i] = await self.refs[i].edit(embed=embed)
+            else:
+                with metrics.timer("discord", "reply"):
+                    reply = await self.last_ref.reply(embed=embed, silent=True)
+                self.refs.append(reply)
+
+            if i < len(self.rendered):
+                self.rendered[i] = (chunk, chunk_footer)
+            else:
+                self.rendered.append((chunk, chunk_footer))
+
+        # edits may take a while, measure the interval from their completion
+        self.last_flush = time.perf_counter()
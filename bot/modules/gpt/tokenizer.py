@@ -0,0 +1,109 @@
+import common.helper as helper
+import common.logger as logger
+import hashlib
+import math
+import tiktoken
+
+from typing import Optional, Union
+
+
+# https://platform.openai.com/docs/guides/vision/calculating-costs
+IMAGE_TOKENS = {"low": 85, "high": 765, "auto": 765}
+
+# every message is wrapped as <|start|>{role}\n{content}<|end|>\n
+MESSAGE_OVERHEAD = 3
+# every reply is primed with <|start|>assistant<|message|>
+REPLY_PRIMING = 3
+# fallback estimate when the BPE tables cannot be loaded, english averages about
+# 4 characters a token while cjk and other wide scripts are about one each
+ASCII_PER_TOKEN = 4
+
+
+class GptTokenCounter:
+    """
+    Local BPE token counter for a gpt model encoding
+
+    Counts are memoized by content digest, so replayed turns are counted once
+
+    Until load succeeds, counts are estimated from characters
+    """
+
+    def __init__(self, encoding: str, capacity: int = 8192):
+        self.name = encoding
+        self.encoding: Optional[tiktoken.Encoding] = None
+        self.counted: helper.LRUCache[bytes, int] = helper.LRUCache(capacity)
+
+    def load(self):
+        """
+        Load the BPE tables, downloading them into the tiktoken cache on first
+        use, blocking
+
+        Return whether the encoding is available
+        """
+
+        try:
+            self.encoding = tiktoken.get_encoding(self.name)
+        except Exception as e:
+            logger.error(
+                f"gpt encoding {self.name} unavailable, estimating tokens: {e}",
+                mention=False,
+            )
+            return False
+        self.counted.clear()
+        return True
+
+    @staticmethod
+    def estimate_text(text: str):
+        wide = sum([1 for c in text if not c.isascii()])
+        return wide + math.ceil((len(text) - wide) / ASCII_PER_TOKEN)
+
+    def count_text(self, text: str):
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        tokens = self.counted.get(digest)
+        if tokens is None:
+            if self.encoding:
+                tokens = len(self.encoding.encode(text, disallowed_special=()))
+            else:
+                tokens = self.estimate_text(text)
+            self.counted.put(digest, tokens)
+        return tokens
+
+    def truncate_text(self, text: str, limit: int):
+        """
+        Cut text down to at most limit tokens
+        """
+
+        if not self.encoding:
+            if self.estimate_text(text) <= limit:
+                return text, False
+            # longest prefix within the estimate
+            low, high = 0, len(text)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.estimate_text(text[:middle]) <= limit:
+                    low = middle
+                else:
+                    high = middle - 1
+            return text[:low], True
+
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= limit:
+            return text, False
+        return self.encoding.decode(tokens[:limit]), True
+
+    def count_content(self, content: Union[str, list]):
+        if not isinstance(content, list):
+            return self.count_text(content or "")
+
+        tokens = 0
+        for payload in content:
+            match payload["type"]:
+                case "image_url":
+                    detail = payload["image_url"].get("detail", "auto")
+                    tokens += IMAGE_TOKENS.get(detail, IMAGE_TOKENS["auto"])
+                case "text":
+                    tokens += self.count_text(payload["text"])
+        return tokens
+
+    def count_message(self, message: dict):
+        return MESSAGE_OVERHEAD + self.count_content(message["content"])
@@ -0,0 +1,89 @@
+import base64
+import math
+
+from .tokenizer import IMAGE_TOKENS
+from PIL import Image, ImageOps
+from io import BytesIO
+
+
+# https://platform.openai.com/docs/guides/vision/calculating-costs
+TILE_SIZE = 512
+TILE_TOKENS = 170
+MAX_SIDE = 2048
+SHORT_SIDE = 768
+
+
+def fit_vision(width: int, height: int, detail: str):
+    """
+    Dimension the provider scales an image to before tiling
+    """
+
+    if detail == "low":
+        scale = min(1.0, TILE_SIZE / max(width, height))
+    else:
+        scale = min(1.0, MAX_SIDE / max(width, height))
+        scale *= min(1.0, SHORT_SIDE / (min(width, height) * scale))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def vision_tiles(width: int, height: int):
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def vision_tokens(width: int, height: int, detail: str):
+    """
+    Tokens an image of this size costs at this fidelity
+    """
+
+    if detail == "low":
+        return IMAGE_TOKENS["low"]
+    width, height = fit_vision(width, height, detail)
+    return IMAGE_TOKENS["low"] + TILE_TOKENS * vision_tiles(width, height)
+
+
+def fit_tiles(width: int, height: int, detail: str, max_tiles: int):
+    """
+    Shrink to the provider's vision size, then further until within max_tiles
+    """
+
+    width, height = fit_vision(width, height, detail)
+    if detail == "low" or vision_tiles(width, height) <= max_tiles:
+        return width, height
+
+    # the largest scale that lands either side on a tile boundary and fits
+    scales = sorted(
+        {
+            tiles * TILE_SIZE / side
+            for side in (width, height)
+            for tiles in range(1, math.ceil(side / TILE_SIZE))
+        },
+        reverse=True,
+    )
+    for scale in scales:
+        fitted = max(1, int(width * scale)), max(1, int(height * scale))
+        if vision_tiles(*fitted) <= max_tiles:
+            return fitted
+    return fit_vision(width, height, "low")
+
+
+def downscale_image(data: bytes, detail: str, max_tiles: int, quality: int):
+    """
+    Downscale and re-encode an image to a webp data url
+
+    Return the url, original tokens and tokens after downscaling, blocking
+    """
+
+    image = Image.open(BytesIO(data))
+    # phone photos are often stored sideways with an orientation tag
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    original = vision_tokens(image.width, image.height, detail)
+    size = fit_tiles(image.width, image.height, detail, max_tiles)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+
+    encoded = BytesIO()
+    image.save(encoded, "WEBP", quality=quality, method=4)
+    url = f"data:image/webp;base64,{base64.b64encode(encoded.getvalue()).decode()}"
+    return url, original, vision_tokens(image.width, image.height, detail)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from .models.cached import GptiCachedModel
+from .models.input import GptiInputModel
+from typing import IO, Optional
+
+
+class GptiGenerationCache:
+    """
+    Generated images on disk, keyed by a hash of the normalized input model
+
+    Least recently used generations are evicted past max_bytes, the index
+    lives in sqlite so startup never walks the directory
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.cost_avoided = 0.0
+
+        self.db = sqlite3.connect(os.path.join(path, "index.db"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, "
+            "files TEXT NOT NULL, "
+            "revised TEXT NOT NULL, "
+            "cost REAL NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS generations_accessed "
+            "ON generations (accessed)"
+        )
+        self.db.commit()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def size(self):
+        return self.db.execute("SELECT SUM(size) FROM generations").fetchone()[0] or 0
+
+    @property
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+    def __str__(self):
+        return (
+            f"- hits: {self.hits}/{self.hits + self.misses} ({self.hit_rate:.0%})\n"
+            f"- cost avoided: {self.cost_avoided:,.1f}\n"
+            f"- cached: {self.count:,} ({self.size / 2**20:,.1f} MiB)"
+        )
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def key_of(input_model: GptiInputModel, output: str):
+        """
+        Hash of the settings and whitespace normalized prompt
+        """
+
+        normalized = input_model.model_dump(exclude_none=True)
+        normalized["prompt"] = " ".join(input_model.prompt.split())
+        normalized["output"] = output
+        blob = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def get_path(self, name: str):
+        return os.path.join(self.path, name)
+
+    def write(self, file: IO[bytes], extension: str):
+        """
+        Copy a generated file into the cache under its content hash and rewind it
+
+        Return the cached name, blocking
+        """
+
+        digest = hashlib.sha256()
+        partial = self.get_path(f"{os.getpid()}_{id(file)}.partial")
+        try:
+            with open(partial, "wb") as cached:
+                while chunk := file.read(1 << 16):
+                    digest.update(chunk)
+                    cached.write(chunk)
+            file.seek(0)
+
+            # never rewrites a blob in place, a reuse may be uploading it
+            name = f"{digest.hexdigest()}.{extension}"
+            os.replace(partial, self.get_path(name))
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return name
+
+    def get(self, key: str) -> Optional[GptiCachedModel]:
+        row = self.db.execute(
+            "SELECT files, revised, cost FROM generations WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            self.misses += 1
+            return None
+
+        self.db.execute(
+            "UPDATE generations SET accessed = ? WHERE key = ?", (time.time(), key)
+        )
+        self.db.commit()
+        self.hits += 1
+        self.cost_avoided += row[2]
+        return GptiCachedModel(
+            key=key, files=json.loads(row[0]), revised=row[1], cost=row[2]
+        )
+
+    def put(self, key: str, files: list[str], revised: str, cost: float):
+        """
+        Index files already written under key, replacing its previous generation
+        """
+
+        previous = self.db.execute(
+            "SELECT files FROM generations WHERE key = ?", (key,)
+        ).fetchone()
+
+        size = sum([os.path.getsize(self.get_path(name)) for name in files])
+        self.db.execute(
+            "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(files), revised, cost, size, time.time()),
+        )
+        if previous:
+            self.remove(json.loads(previous[0]))
+        self.evict()
+        self.db.commit()
+
+    def remove(self, files: list[str]):
+        """
+        Delete blobs no generation refers to anymore
+        """
+
+        for name in set(files):
+            referenced = self.db.execute(
+                "SELECT 1 FROM generations WHERE instr(files, ?) LIMIT 1", (name,)
+            ).fetchone()
+            if referenced:
+                continue
+            try:
+                os.remove(self.get_path(name))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """
+        Drop least recently used generations until within max_bytes
+        """
+
+        total = self.size
+        rows = self.db.execute(
+            "SELECT key, files, size FROM generations ORDER BY accessed"
+        ).fetchall()
+        # always keep the newest
+        for key, files, size in rows[:-1]:
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM generations WHERE key = ?", (key,))
+            self.remove(json.loads(files))
+            total -= size
@@ -1,34 +1,110 @@
+import aiohttp
+import asyncio
 import base64
+import hashlib
 import common.helper as helper
+import common.logger as logger
+import common.metrics as metrics
 import discord
 import discord.app_commands as app
 import openai
 import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
 
+from .cache import GptiGenerationCache
 from .help import generate_help_info
 from .models.input import GptiInputModel
 from .models.output import GptiOutputModel
 from .views.gptiview import GptiJobView
-from PIL import Image
 from common.cog import DroppyCog
 from common.exception import DroppyBotError
+from common.media import is_format, sniff_format
 from discord.ext import commands
 from fuzzywuzzy import fuzz
 from io import BytesIO
-from typing import Optional, Union
+from typing import IO, Optional, Union
+
+
+# discord caps attachments per message
+MAX_ATTACHMENTS = 10
+# streamed images spill to disk past this
+SPOOL_BYTES = 1 << 20
+# already compressed, deflating them again only burns cpu
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".zip")
+
+
+def write_archive(path: str, entries: list[tuple[str, IO[bytes]]]):
+    """
+    Zip file objects into path, blocking
+    """
+
+    with zipfile.ZipFile(path, "w") as z:
+        for name, file in entries:
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            if name.lower().endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with z.open(info, "w") as entry:
+                shutil.copyfileobj(file, entry, 1 << 16)
 
 
 class GPTIHandler(DroppyCog):
     def __init__(self):
-        self.endpoint = openai.AsyncOpenAI(
-            api_key=os.environ["OPENAI_KEY"], base_url=os.environ["OPENAI_API"]
-        )
-        self.endpoint_alt = openai.AsyncOpenAI(
-            api_key=os.environ["OPENAI_ALT_KEY"], base_url=os.environ["OPENAI_ALT_API"]
+        self.generation_slots = asyncio.Semaphore(self.config.gpti.concurrency)
+        self.http_session: Optional[aiohttp.ClientSession] = None
+
+        # archives by attachment ids, as (path, size) on disk
+        self.export_dir = tempfile.mkdtemp(prefix="gpti-export-")
+        self.exports: helper.LRUCache[tuple[int, ...], tuple[str, int]] = (
+            helper.LRUCache(
+                self.config.gpti.export.cache_bytes,
+                weigher=lambda export: export[1],
+                on_evict=self.discard_export,
+            )
         )
+        self.export_flights: helper.SingleFlight[
+            tuple[int, ...], tuple[str, int]
+        ] = helper.SingleFlight()
+
+        cache = self.config.gpti.cache
+        self.generations: Optional[GptiGenerationCache] = None
+        if cache.enabled:
+            self.generations = GptiGenerationCache(
+                os.path.join(self.cwd, cache.path), cache.max_bytes
+            )
 
         self.help_info["GPTI"] = generate_help_info
 
+    async def cog_unload(self):
+        if self.http_session:
+            await self.http_session.close()
+        shutil.rmtree(self.export_dir, ignore_errors=True)
+        if self.generations:
+            self.generations.close()
+
+    def get_http_session(self):
+        if not self.http_session or self.http_session.closed:
+            self.http_session = aiohttp.ClientSession()
+        return self.http_session
+
+    def parse_batch_count(self, prompt: Optional[str]):
+        """
+        Split an optional leading xN off the prompt
+
+        Return the batch count and the remaining prompt
+        """
+
+        matched = re.match(r"^x(\d+)\s+(.*)$", prompt or "", re.DOTALL)
+        if not matched:
+            return 1, prompt
+        count = min(int(matched[1]), self.config.gpti.variation_max, MAX_ATTACHMENTS)
+        return max(count, 1), matched[2]
+
     def calculate_generate_cost(self, input_model: GptiInputModel):
         cost = 1.0 if input_model.model == self.config.gpti.models.advanced else 0.5
 
@@ -44,21 +120,118 @@ class GPTIHandler(DroppyCog):
         if input_model.model == self.config.gpti.models.default:
             input_model.quality = None
             input_model.style = None
-            input_model.size = self.config.gpti.dimensions.square
-
-    def convert_webp(self, image_in: BytesIO):
-        image = Image.open(image_in).convert("RGB")
-        if image.format == "WEBP":
-            image_out = BytesIO()
-            image.save(image_out, self.config.gpti.output)
-            image_out.seek(0)
-            return image_out
-        image_in.seek(0)
-        return image_in
-
-    def get_image_name(self, input_model: GptiInputModel):
+            input_model.size = str(self.config.gpti.dimensions.square)
+
+    async def convert_output(self, data: bytes):
+        """
+        Transcode a generated image to the output format, off the event loop
+        """
+
+        # skip the round trip to the pool when it already is
+        if is_format(sniff_format(data[:12]), self.config.gpti.output):
+            return BytesIO(data)
+        return BytesIO(await self.media.transcode(data, self.config.gpti.output))
+
+    async def download(self, url: str, file: IO[bytes]):
+        """
+        Stream a url into a file object, left at its end
+        """
+
+        async with self.get_http_session().get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(1 << 16):
+                file.write(chunk)
+
+    async def stream_output(self, url: str):
+        """
+        Stream a generated image into a spooled file, transcoding only if needed
+        """
+
+        output = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        try:
+            await self.download(url, output)
+
+            output.seek(0)
+            head = output.read(12)
+            output.seek(0)
+            if is_format(sniff_format(head), self.config.gpti.output):
+                # handed to discord as is, the caller closes it once uploaded
+                return output
+
+            with output:
+                return await self.convert_output(output.read())
+        except BaseException:
+            output.close()
+            raise
+
+    async def read_output(self, image: openai.types.Image):
+        """
+        Generated image as a file in the output format
+        """
+
+        if image.b64_json:
+            return await self.convert_output(base64.b64decode(image.b64_json))
+        return await self.stream_output(image.url)
+
+    def discard_export(self, _: tuple[int, ...], export: tuple[str, int]):
+        try:
+            os.remove(export[0])
+        except FileNotFoundError:
+            pass
+
+    async def build_archive(
+        self, key: tuple[int, ...], attachments: list[discord.Attachment]
+    ):
+        """
+        Fetch attachments concurrently into spooled files, then zip them off-loop
+        """
+
+        path = os.path.join(
+            self.export_dir, f"{hashlib.sha1(repr(key).encode()).hexdigest()}.zip"
+        )
+        files = [tempfile.SpooledTemporaryFile(SPOOL_BYTES) for _ in attachments]
+        downloads = [
+            asyncio.create_task(self.download(attachment.url, file))
+            for attachment, file in zip(attachments, files)
+        ]
+
+        try:
+            with metrics.timer("gpti", "export"):
+                await asyncio.gather(*downloads)
+                for file in files:
+                    file.seek(0)
+                entries = [(a.filename, f) for a, f in zip(attachments, files)]
+                await asyncio.to_thread(write_archive, path, entries)
+        finally:
+            for download in downloads:
+                download.cancel()
+            for file in files:
+                file.close()
+
+        export = path, os.path.getsize(path)
+        self.exports.put(key, export)
+        return export
+
+    async def export_artifact(self, message: discord.Message):
+        """
+        Zip a message's attachments, return the archive path
+
+        Archives are cached by attachment ids, concurrent exports share one build
+        """
+
+        key = tuple([attachment.id for attachment in message.attachments])
+        export = self.exports.get(key)
+        if not export:
+            export, _ = await self.export_flights.do(
+                key, lambda: self.build_archive(key, message.attachments)
+            )
+        return export[0]
+
+    def get_image_name(self, input_model: GptiInputModel, index: int = 0):
         base_name = helper.timestamp_now()
         base_name += f"_{input_model.size}"
+        if index:
+            base_name += f"_{index}"
 
         if input_model.quality:
             base_name += f"_{input_model.quality}"
@@ -67,18 +240,37 @@ class GPTIHandler(DroppyCog):
 
         return f"{base_name}.{self.config.gpti.output}"
 
+    async def request_images(
+        self, input_model: GptiInputModel, author: discord.User, n: int
+    ):
+        """
+        Request n images in one call, bounded by the shared generation slots
+        """
+
+        async with self.generation_slots:
+            response = await self.endpoints.invoke(
+                lambda e: e.images.generate(
+                    **input_model.model_dump(exclude_none=True),
+                    n=n,
+                    response_format=self.config.gpti.response_format,
+                ),
+                user_id=author.id,
+                kind="images",
+            )
+        return response.data
+
     async def create_gpti_generation(
         self,
         ref: discord.Message,
         input_model: GptiInputModel,
         author: discord.User,
-        *,
-        alt: bool = False,
+        count: int = 1,
     ):
         """
-        Make actual gpti request with openAI endpoint or alt endpoint
+        Make actual gpti requests with the healthiest openAI endpoint
 
-        Return image base64
+        Generations run concurrently, images are attached as they arrive,
+        batching whatever finished during the previous upload into one edit
         """
 
         if not input_model.prompt:
@@ -90,36 +282,182 @@ class GPTIHandler(DroppyCog):
 
         self.sanitize_input_model(input_model)
         cost = self.calculate_generate_cost(input_model)
+        cache_key = GptiGenerationCache.key_of(input_model, self.config.gpti.output)
+        outputs: list[IO[bytes]] = []
 
-        endpoint = self.endpoint_alt if alt else self.endpoint
+        # dall-e-2 batches natively, dall-e-3 only takes one image per call
+        if input_model.model == self.config.gpti.models.default:
+            batches = [count]
+        else:
+            batches = [1] * count
+
+        pending: list[discord.File] = []
+        uploader: Optional[asyncio.Task] = None
+        generated = 0
+        failures = []
+        revised = None
+
+        async def generate(n: int):
+            try:
+                return n, await self.request_images(input_model, author, n), None
+            except Exception as e:
+                return n, [], e
 
-        helper.latency_start(ref.id)
-        # request for image completion
+        async def upload():
+            nonlocal ref
+            while pending:
+                files = pending.copy()
+                pending.clear()
+                ref = await ref.add_files(*files)
+
+        requests: list[asyncio.Task] = []
         try:
-            response = await endpoint.images.generate(
-                **input_model.model_dump(exclude_none=True), response_format="b64_json"
-            )
-        except:
-            feedback = self.translate("gpt_content_blocked", locale)
-            raise DroppyBotError(feedback)
+            with metrics.timer("gpti", input_model.model) as timer:
+                requests = [asyncio.create_task(generate(n)) for n in batches]
+                for request in asyncio.as_completed(requests):
+                    n, images, error = await request
+                    if error:
+                        # content policy rejections are the common case
+                        if isinstance(error, openai.BadRequestError):
+                            reason = self.translate("gpt_content_blocked", locale)
+                        else:
+                            reason = type(error).__name__
+                        failures.extend([reason] * n)
+                        continue
+
+                    for image in images:
+                        try:
+                            image_io = await self.read_output(image)
+                        except Exception as e:
+                            # the image url can expire or fail to download
+                            failures.append(type(e).__name__)
+                            continue
+
+                        generated += 1
+                        revised = revised or image.revised_prompt
+                        outputs.append(image_io)
+                        image_name = self.get_image_name(
+                            input_model, generated if count > 1 else 0
+                        )
+                        pending.append(
+                            discord.File(
+                                image_io, image_name, description=input_model.prompt
+                            )
+                        )
+
+                    if uploader and uploader.done():
+                        # a failed upload lost its images, never pass over it
+                        uploader.result()
+                        uploader = None
+                    if not uploader:
+                        uploader = asyncio.create_task(upload())
+
+                if uploader:
+                    await uploader
+                # arrivals during the last upload
+                await upload()
+
+            if not generated:
+                feedback = self.translate("gpt_content_blocked", locale)
+                raise DroppyBotError(feedback)
+
+            # only what was delivered is cached, so every blob written gets indexed
+            if self.generations:
+                await self.cache_generation(
+                    cache_key, outputs, revised or input_model.prompt, cost * generated
+                )
+        finally:
+            for task in requests:
+                task.cancel()
+            if uploader and not uploader.done():
+                uploader.cancel()
+            # discord.File leaves file objects it did not open to their owner
+            for output in outputs:
+                output.close()
 
         # get perf latency
-        latency = f"⏱️ {helper.latency_end(ref.id)}ms"
+        latency = f"⏱️ {timer.elapsed}ms"
+        urls = [a.url for a in ref.attachments[-generated:]]
 
-        image = response.data[0]
-        data = base64.b64decode(image.b64_json)
-        image_io = self.convert_webp(BytesIO(data))
-        image_name = self.get_image_name(input_model)
-        image_file = discord.File(image_io, image_name, description=input_model.prompt)
+        prompt_block = helper.codeblock(input_model.prompt)
+        batch = f" x{generated}/{count}" if count > 1 else ""
+        self.log(
+            ref,
+            f"{str(input_model)}{batch} {latency}\n{prompt_block}\n" + "\n".join(urls),
+            author,
+        )
+
+        return GptiOutputModel(
+            cost=cost * generated,
+            url=urls[0],
+            latency=latency,
+            revised=revised or input_model.prompt,
+            failures=failures,
+        )
 
-        ref = await ref.add_files(image_file)
-        url = ref.attachments[-1].url
+    async def cache_generation(
+        self, key: str, outputs: list[IO[bytes]], revised: str, cost: float
+    ):
+        files = []
+        try:
+            for output in outputs:
+                # uploading left the file at its end
+                output.seek(0)
+                files.append(
+                    await asyncio.to_thread(
+                        self.generations.write, output, self.config.gpti.output
+                    )
+                )
+            self.generations.put(key, files, revised, cost)
+        except Exception as e:
+            # the images were delivered, only the cache entry is lost
+            self.generations.remove(files)
+            logger.error(f"gpti cache write failed: {e}", mention=False)
+
+    async def reuse_gpti_generation(
+        self,
+        ref: discord.Message,
+        input_model: GptiInputModel,
+        author: discord.User,
+    ):
+        """
+        Attach the cached generation for identical settings and prompt, free
+        """
+
+        locale = DroppyCog.ctx_locales.get(
+            str(author.id), discord.Locale.american_english
+        )
+
+        self.sanitize_input_model(input_model)
+        cache_key = GptiGenerationCache.key_of(input_model, self.config.gpti.output)
+        cached = self.generations.get(cache_key) if self.generations else None
+        if not cached:
+            raise DroppyBotError(self.translate("gpti_reuse_missing", locale))
+
+        with metrics.timer("gpti", "reuse") as timer:
+            batched = len(cached.files) > 1
+            files = [
+                discord.File(
+                    self.generations.get_path(name),
+                    self.get_image_name(input_model, i + 1 if batched else 0),
+                    description=input_model.prompt,
+                )
+                for i, name in enumerate(cached.files)
+            ]
+            ref = await ref.add_files(*files)
+
+        latency = f"⏱️ {timer.elapsed}ms ♻️"
+        urls = [a.url for a in ref.attachments[-len(files) :]]
 
         prompt_block = helper.codeblock(input_model.prompt)
-        self.log(ref, f"{str(input_model)} {latency}\n{prompt_block}\n{url}", author)
+        self.log(
+            ref,
+            f"{str(input_model)} {latency}\n{prompt_block}\n" + "\n".join(urls),
+            author,
+        )
 
         return GptiOutputModel(
-            cost=cost, url=url, latency=latency, revised=image.revised_prompt
+            cost=0.0, url=urls[0], latency=latency, revised=cached.revised
         )
 
     @commands.hybrid_command(description="gpti_desc")
@@ -136,11 +474,12 @@ class GPTIHandler(DroppyCog):
 
         ref = await self.get_ctx_ref(ctx)
         locale = self.get_ctx_locale(ctx)
+        count, prompt = self.parse_batch_count(prompt)
 
         embed = helper.as_embed("", ctx.author, footer_append=None)
         prompt_field = self.translate("gpti_prompt", locale)
         embed.add_field(name=prompt_field, value=helper.codeblock(prompt), inline=False)
         await ref.edit(
             embed=embed,
-            view=GptiJobView(self, prompt or "", locale),
+            view=GptiJobView(self, prompt or "", locale, count),
         )
@@ -0,0 +1,8 @@
+from common.models.shared import *
+
+
+class GptiCachedModel(BaseModel):
+    key: sanitized_str
+    files: List[sanitized_str]
+    revised: sanitized_str
+    cost: float
@@ -6,3 +6,4 @@ class GptiOutputModel(BaseModel):
     url: sanitized_str
     latency: sanitized_str
     revised: sanitized_str
+    failures: List[sanitized_str] = []
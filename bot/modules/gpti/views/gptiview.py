@@ -1,6 +1,4 @@
 import asyncio
-from io import BytesIO
-import zipfile
 import common.config as config
 import common.helper as helper
 import discord
@@ -35,10 +33,19 @@ class GptiEditPromptModal(DroppyModal):
 
 
 class GptiJobView(DroppyView):
-    def __init__(self, gpti, prompt: str, locale: discord.Locale):
-        super().__init__(gpti)
+    def __init__(
+        self,
+        gpti,
+        prompt: str,
+        locale: discord.Locale,
+        count: int = 1,
+        *,
+        token: Optional[str] = None,
+    ):
+        super().__init__(gpti, token=token)
 
         self.locale = locale
+        self.count = count
 
         defaults = self.cog.config.gpti.defaults
         self.input_model = GptiInputModel(
@@ -51,9 +58,10 @@ class GptiJobView(DroppyView):
 
         # buttons
         self.edit_prompt.label = self.cog.translate("gpti_edit_prompt", locale)
-        self.request_generation.label = self.cog.translate(
-            "gpti_request_generation", locale
-        )
+        self.request_generation.label = self.get_generation_label()
+        self.reuse_generation.label = self.cog.translate("gpti_reuse", locale)
+        if not self.cog.generations:
+            self.remove_item(self.reuse_generation)
         self.link_button = discord.ui.Button(
             label=self.cog.translate("gpti_open_proxy", locale),
             style=discord.ButtonStyle.url,
@@ -97,6 +105,46 @@ class GptiJobView(DroppyView):
                 option.default = True
             self.select_style.append_option(option)
 
+    def dump_state(self):
+        return {
+            "input_model": self.input_model.model_dump(),
+            "locale": self.locale.value,
+            "count": self.count,
+            "url": self.link_button.url,
+        }
+
+    @classmethod
+    def revive(cls, gpti, state: dict, token: str):
+        input_model = GptiInputModel(**state["input_model"])
+        view = cls(
+            gpti,
+            input_model.prompt,
+            discord.Locale(state["locale"]),
+            state["count"],
+            token=token,
+        )
+
+        view.input_model = input_model
+        selects = [
+            (view.select_model, input_model.model),
+            (view.select_dimension, input_model.size),
+            (view.select_quality, input_model.quality),
+            (view.select_style, input_model.style),
+        ]
+        for select, value in selects:
+            for option in select.options:
+                option.default = option.value == value
+        if input_model.model == gpti.config.gpti.models.default:
+            view.disable_advanced()
+
+        if state["url"]:
+            view.show_output_buttons(state["url"])
+        return view
+
+    def get_generation_label(self):
+        label = self.cog.translate("gpti_request_generation", self.locale)
+        return f"{label} x{self.count}" if self.count > 1 else label
+
     def disable_advanced(self):
         self.select_quality.disabled = True
         self.input_model.quality = None
@@ -144,6 +192,45 @@ class GptiJobView(DroppyView):
         )
         await ctx.message.edit(embed=embed, view=self)
 
+    def show_output_buttons(self, url: str):
+        self.remove_item(self.link_button)
+        self.link_button.custom_id = None
+        self.link_button.url = url
+        self.add_item(self.link_button)
+
+        self.remove_item(self.download_artifact)
+        self.add_item(self.download_artifact)
+
+    async def present_output(self, ctx: discord.Interaction, output: GptiOutputModel):
+        """
+        Link, revised prompt and failures of a finished generation
+        """
+
+        self.show_output_buttons(output.url)
+
+        embed = ctx.message.embeds[0]
+        embed.set_footer(text=output.latency)
+        revised_field = self.cog.translate("gpti_revised_prompt", self.locale)
+        if len(embed.fields) < 2:
+            embed.add_field(name=revised_field, value="")
+        embed.set_field_at(
+            1, name=revised_field, value=helper.codeblock(output.revised), inline=False
+        )
+
+        # report what did not make it in this batch, clear the previous report
+        if len(embed.fields) > 2:
+            embed.remove_field(2)
+        if output.failures:
+            failed_field = self.cog.translate("gpti_failed", self.locale)
+            failures = "\n".join(
+                [f"- #{i + 1}: {reason}" for i, reason in enumerate(output.failures)]
+            )
+            embed.add_field(name=failed_field, value=failures, inline=False)
+
+        self.request_generation.label = self.get_generation_label()
+        self.set_everything(True)
+        await ctx.message.edit(embed=embed, view=self)
+
     @discord.ui.button(
         label="gpti_download_artifact",
         style=discord.ButtonStyle.secondary,
@@ -155,17 +242,13 @@ class GptiJobView(DroppyView):
     ):
         await ctx.response.defer(ephemeral=True, thinking=True)
 
-        zbuf = BytesIO()
-        zip_base_name = ""
-        with zipfile.ZipFile(zbuf, "w", zipfile.ZIP_DEFLATED) as z:
-            for image in ctx.message.attachments:
-                sanitized_buf = BytesIO()
-                await image.save(sanitized_buf)
-                z.writestr(image.filename, sanitized_buf.getvalue())
-                zip_base_name = os.path.splitext(image.filename)[0]
-        zbuf.seek(0)
-        zip_name = f"{zip_base_name}.zip"
-        artifact = discord.File(zbuf, zip_name)
+        attachments = ctx.message.attachments
+        if not attachments:
+            raise DroppyBotError("No Artifact")
+
+        path = await self.cog.export_artifact(ctx.message)
+        zip_base_name = os.path.splitext(attachments[-1].filename)[0]
+        artifact = discord.File(path, f"{zip_base_name}.zip")
 
         await ctx.edit_original_response(attachments=[artifact])
 
@@ -207,31 +290,27 @@ class GptiJobView(DroppyView):
             ctx.message,
             self.input_model,
             self.cog.get_ctx_author(ctx.message),
-            alt=True,
+            self.count,
         )
+        await self.present_output(ctx, output)
 
-        self.remove_item(self.link_button)
-        self.link_button.custom_id = None
-        self.link_button.url = output.url
-        self.add_item(self.link_button)
+        return output.cost
 
-        self.remove_item(self.download_artifact)
-        self.add_item(self.download_artifact)
+    @discord.ui.button(
+        label="Reuse",
+        style=discord.ButtonStyle.secondary,
+        emoji="♻️",
+    )
+    @DroppyCog.failsafe_ref(no_ref=True)
+    async def reuse_generation(self, ctx: discord.Interaction, button: discord.Button):
+        self.locale = self.cog.get_ctx_locale(ctx)
 
-        embed = ctx.message.embeds[0]
-        embed.set_footer(text=output.latency)
-        revised_field = self.cog.translate("gpti_revised_prompt", self.locale)
-        if len(embed.fields) < 2:
-            embed.add_field(name=revised_field, value="")
-        embed.set_field_at(
-            1, name=revised_field, value=helper.codeblock(output.revised), inline=False
+        output: GptiOutputModel = await self.cog.reuse_gpti_generation(
+            ctx.message,
+            self.input_model,
+            self.cog.get_ctx_author(ctx.message),
         )
-
-        button.label = self.cog.translate("gpti_request_generation", self.locale)
-        self.set_everything(True)
-        await ctx.message.edit(embed=embed, view=self)
-
-        return output.cost
+        await self.present_output(ctx, output)
 
     @discord.ui.select()
     @DroppyCog.failsafe_ref(no_ref=True)
@@ -0,0 +1,13 @@
+from .metrics import DroppyMetricsManager
+from discord.ext import commands
+
+
+# extension entry
+async def setup(bot: commands.Bot):
+    await bot.add_cog(DroppyMetricsManager())
+
+
+# extension exit
+async def teardown(bot: commands.Bot):
+    await bot.remove_cog("DroppyMetricsManager")
+    pass
@@ -0,0 +1,107 @@
+import common.helper as helper
+import common.metrics as metrics
+import discord
+
+from common.cog import DroppyCog
+from common.view import DroppyView
+from discord.ext import commands
+from typing import Optional
+
+
+class DroppyMetricsManager(DroppyCog):
+    def __init__(self):
+        self.metrics = {
+            "endpoint": self.as_endpoint_embed,
+            "gpti": self.as_gpti_embed,
+            "latency": self.as_latency_embed,
+            "media": self.as_media_embed,
+            "views": self.as_views_embed,
+        }
+
+    async def as_endpoint_embed(self):
+        """
+        Generate embed informations about openAI endpoint pool health
+        """
+
+        scheduler = self.endpoints.scheduler
+        embed = helper.as_embed("")
+        embed.title = "endpoint stats"
+        embed.description = f"- queued: {len(scheduler):,}\n"
+        embed.description += f"- admitted: {scheduler.admitted:,}\n"
+        embed.description += f"- throttled: {scheduler.throttled:,}\n"
+        embed.description += f"- requeued: {self.endpoints.requeued:,}\n"
+        for rank, endpoint in enumerate(self.endpoints.ranked()):
+            embed.add_field(
+                name=f"#{rank + 1} {endpoint.name}", value=str(endpoint), inline=True
+            )
+        return embed
+
+    async def as_gpti_embed(self):
+        """
+        Generate embed informations about gpti generation and export caches
+        """
+
+        gpti = self.bot.get_cog("GPTIHandler")
+        embed = helper.as_embed("- disabled")
+        embed.title = "gpti caches"
+        if not gpti:
+            return embed
+
+        embed.description = ""
+        generations = str(gpti.generations) if gpti.generations else "- disabled"
+        embed.add_field(name="generations", value=generations, inline=True)
+        embed.add_field(name="exports", value=f"- {gpti.exports}", inline=True)
+        return embed
+
+    async def as_media_embed(self):
+        """
+        Generate embed informations about the media process pool
+        """
+
+        embed = helper.as_embed(str(self.media))
+        embed.title = "media pipeline"
+        return embed
+
+    async def as_views_embed(self):
+        """
+        Generate embed informations about live and evicted views
+        """
+
+        registry = DroppyView.registry
+        embed = helper.as_embed(str(registry) if registry else "- disabled")
+        embed.title = "views"
+        return embed
+
+    async def as_latency_embed(self):
+        """
+        Generate embed informations about p50/p95/p99 latencies over sliding windows
+        """
+
+        embed = helper.as_embed("")
+        embed.title = "latency p50 / p95 / p99"
+        # embeds cap at 25 fields
+        for labels, histogram in sorted(metrics.histograms.items())[:25]:
+            embed.add_field(name="/".join(labels), value=str(histogram), inline=True)
+        if not metrics.histograms:
+            embed.description = "- idle"
+        return embed
+
+    @commands.command()
+    @commands.check(DroppyCog.is_dev)
+    @helper.sanitize
+    @DroppyCog.failsafe_ref()
+    async def metricsget(self, ctx: commands.Context, *, details: Optional[str]):
+        ref = await self.get_ctx_ref(ctx)
+
+        if not details:
+            embeds = [await m() for m in self.metrics.values()]
+            await ref.edit(embeds=embeds)
+            return
+
+        metric = self.metrics.get(details.lower(), None)
+        if not metric:
+            available = "\n".join([f"- `{m}`" for m in self.metrics])
+            await ref.edit(embed=helper.as_embed(available))
+            return
+
+        await ref.edit(embed=await metric())
@@ -0,0 +1,134 @@
+import aiohttp
+import asyncio
+import os
+import time
+
+from common.models.trio import TrioPollModel
+from datetime import datetime
+from typing import Optional
+
+
+ORCHESTRATION_API = "https://orchestration.civitai.com"
+# job events past which a worker holds the job
+STARTED_EVENTS = ("Claimed", "Updated", "Succeeded", "Failed")
+
+
+def parse_date(date: Optional[str]):
+    """
+    Epoch seconds of an orchestration ISO date, None if absent or malformed
+    """
+
+    try:
+        return datetime.fromisoformat(date).timestamp() if date else None
+    except ValueError:
+        return None
+
+
+def estimated_start(job: dict):
+    """
+    Earliest start any service provider estimates for a queued job
+    """
+
+    providers = (job.get("serviceProviders", None) or {}).values()
+    positions = [(p or {}).get("queuePosition", None) or {} for p in providers]
+    starts = [parse_date(p.get("estimatedStartDate", None)) for p in positions]
+    starts = [start for start in starts if start]
+    return min(starts) if starts else None
+
+
+def is_started(job: dict):
+    event = job.get("lastEvent", None) or {}
+    return event.get("type", None) in STARTED_EVENTS
+
+
+def is_finished(job: dict):
+    result = job.get("result", None) or {}
+    return bool(result.get("available", None)) and not job.get("scheduled", None)
+
+
+class TrioJobPoller:
+    """
+    Civitai job status and result downloads over one keep-alive session
+
+    Poll intervals follow the providers' queue estimates when given, and
+    back off exponentially otherwise
+    """
+
+    def __init__(self, config: TrioPollModel):
+        self.config = config
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.download_slots = asyncio.Semaphore(config.downloads)
+        self.polls = 0
+        self.downloads = 0
+
+    def get_session(self):
+        if not self.session or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.config.connections),
+                timeout=aiohttp.ClientTimeout(total=self.config.request_timeout),
+            )
+        return self.session
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    def get_headers(self):
+        return {"Authorization": f"Bearer {os.environ['CIVITAI_API_TOKEN']}"}
+
+    async def get_jobs(self, token: str) -> list[dict]:
+        """
+        Raw status of every job under a token, queue estimates included
+        """
+
+        self.polls += 1
+        async with self.get_session().get(
+            f"{ORCHESTRATION_API}/v1/consumer/jobs",
+            params={"token": token},
+            headers=self.get_headers(),
+        ) as response:
+            response.raise_for_status()
+            return (await response.json()).get("jobs", None) or []
+
+    async def query_jobs(self, properties: dict) -> list[dict]:
+        """
+        Raw status of every job created with these properties, across tokens
+        """
+
+        jobs = []
+        cursor = None
+        while True:
+            self.polls += 1
+            async with self.get_session().post(
+                f"{ORCHESTRATION_API}/v1/consumer/jobs/query",
+                json={"properties": properties, "cursor": cursor},
+                headers=self.get_headers(),
+            ) as response:
+                response.raise_for_status()
+                page = await response.json()
+            jobs.extend([job for job in page.get("jobs", None) or [] if job])
+            cursor = page.get("cursor", None)
+            if not cursor:
+                return jobs
+
+    def next_interval(self, jobs: list[dict], interval: float):
+        """
+        Seconds to wait before polling these jobs again
+        """
+
+        now = time.time()
+        starts = [estimated_start(job) for job in jobs if not is_started(job)]
+        starts = [start for start in starts if start and start > now]
+        if starts:
+            wait = min(starts) - now
+        else:
+            wait = interval * self.config.backoff
+        return min(max(wait, self.config.min_interval), self.config.max_interval)
+
+    async def download(self, url: str):
+        async with self.download_slots:
+            async with self.get_session().get(url) as response:
+                response.raise_for_status()
+                data = await response.read()
+        self.downloads += 1
+        return data
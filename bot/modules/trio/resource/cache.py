@@ -1,4 +1,16 @@
-from dataclasses import dataclass
+import re
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+# generation parameters as written into image metadata, "Key: value, ..."
+GENERATION_FIELDS = {
+    "seed": (re.compile(r"Seed: (\d+)"), int),
+    "sampler": (re.compile(r"Sampler: ([^,\n]+)"), str.strip),
+    "steps": (re.compile(r"Steps: (\d+)"), int),
+    "cfg": (re.compile(r"CFG scale: ([\d.]+)"), float),
+}
 
 
 @dataclass(frozen=True)
@@ -7,3 +19,42 @@ class TrioCache:
     timestamp: str
     input_model: str
     seeds: list[int]
+
+
+@dataclass(frozen=True)
+class TrioGeneration:
+    seed: int = -1
+    sampler: Optional[str] = None
+    steps: Optional[int] = None
+    cfg: Optional[float] = None
+
+    @classmethod
+    def parse(cls, text: str):
+        """
+        Pick generation parameters out of metadata text, unknown ones stay unset
+        """
+
+        params = {}
+        for name, (pattern, cast) in GENERATION_FIELDS.items():
+            match = pattern.search(text)
+            if match:
+                params[name] = cast(match.group(1))
+        return cls(**params)
+
+
+@dataclass(frozen=True)
+class TrioArtifact:
+    author: str
+    timestamp: str
+    input_model: dict
+    cache: str
+    seeds: list[int]
+    generations: list[TrioGeneration] = field(default_factory=list)
+
+    def __post_init__(self):
+        # loaded back from json as plain dicts
+        generations = [
+            g if isinstance(g, TrioGeneration) else TrioGeneration(**g)
+            for g in self.generations
+        ]
+        object.__setattr__(self, "generations", generations)
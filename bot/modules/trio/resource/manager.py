@@ -9,6 +9,7 @@ import zipfile
 
 from .cache import TrioCache
 from .model import TrioModel, TrioModelType
+from .store import TrioArtifactStore
 from .template import TrioTemplate
 from PIL import Image
 from common.exception import DroppyBotException
@@ -50,7 +51,10 @@ class TrioResourceManager:
         self.trio_templates: list[TrioTemplate] = self.load_trio_templates()
         self.trio_caches: list[TrioCache] = self.load_trio_cache()
 
-        self.invalidate_cache()
+        cache = self.config.trio.cache
+        self.store = TrioArtifactStore(
+            os.path.join(cwd, cache.storage), cache.max_bytes, cache.retention
+        )
 
     def load_trio_models(self):
         model_path = os.path.join(cwd, self.config.trio.model_path)
@@ -96,10 +100,6 @@ class TrioResourceManager:
             )
 
     def load_trio_cache(self):
-        cache_storage = os.path.join(cwd, self.config.trio.cache.storage)
-        if not os.path.exists(cache_storage):
-            os.makedirs(cache_storage)
-
         trio_cache = []
         cache_path = os.path.join(cwd, self.config.trio.cache.path)
         if os.path.exists(cache_path):
@@ -120,60 +120,14 @@ class TrioResourceManager:
                 ensure_ascii=False,
             )
 
-    def invalidate_cache(self):
-        """
-        Remove any outdated cache from cache storage
-        """
-
-        retention = timedelta(days=self.config.trio.cache.retention)
-
-        validated = []
-        for root, _, files in os.walk(
-            os.path.join(cwd, self.config.trio.cache.storage)
-        ):
-            for f in files:
-                file_path = os.path.join(root, f)
-                valid = False
-                for artifact in self.user_artifacts:
-                    if artifact.timestamp in f:
-                        creation = datetime.fromtimestamp(os.path.getctime(file_path))
-                        if datetime.now() - creation < retention:
-                            validated.append(artifact)
-                            valid = True
-                if not valid:
-                    os.remove(file_path)
-
-        validated = sorted(validated, key=lambda a: a.timestamp)
-        self.user_artifacts = validated
-        self.save_user_artifacts()
-
-    def get_cache_path(self, timestamp: str):
-        """
-        Get full path of specific timestamp
-        """
-        return os.path.join(
-            cwd,
-            self.config.trio.cache.storage,
-            f"{timestamp}.{self.config.trio.cache.output}",
-        )
-
     def get_cache_artifact(self, cache: TrioCache):
         """
-        Get a trio cache's artifact, if present
+        Get a trio cache's artifact zipped, if present, blocking
         """
 
         if cache is None:
             return None
-
-        artifact = None
-        cache_path = self.get_cache_path(cache.timestamp)
-        try:
-            if os.path.exists(cache_path):
-                with open(cache_path, "rb") as f:
-                    artifact = BytesIO(f.read())
-        except:
-            pass
-        return artifact
+        return self.store.archive(cache.timestamp)
 
     @helper.sanitized
     def get_resource(
@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zipfile
+
+from io import BytesIO
+from typing import Optional
+
+
+# already compressed images gain nothing from deflate
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+
+
+class TrioArtifactStore:
+    """
+    Generated images on disk under their content hash, indexed by artifact
+
+    Blobs are reference counted so identical images are stored once. Least
+    recently used artifacts are evicted past max_bytes, artifacts older than
+    retention by the sweeper. The index lives in sqlite so startup never walks
+    the directory
+    """
+
+    def __init__(self, path: str, max_bytes: int, retention: int):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.retention = retention * 86400
+        self.evicted = 0
+        self.expired = 0
+
+        self.db = sqlite3.connect(os.path.join(path, "index.db"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "artifact TEXT PRIMARY KEY, "
+            "entries TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS artifacts_created ON artifacts (created)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "blob TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "refs INTEGER NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.db.commit()
+
+        self.sweep_legacy()
+
+    def sweep_legacy(self):
+        """
+        Remove the per artifact zips of the old cache layout, once
+
+        Return how many were removed
+        """
+
+        swept = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'legacy_swept'"
+        ).fetchone()
+        if swept:
+            return 0
+
+        removed = 0
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                # blobs are named by hash and image extension, never zip
+                if entry.is_file() and entry.name.endswith(".zip"):
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except OSError:
+                        pass
+
+        self.db.execute(
+            "INSERT INTO meta VALUES ('legacy_swept', ?)", (str(time.time()),)
+        )
+        self.db.commit()
+        return removed
+
+    @property
+    def size(self):
+        return self.db.execute("SELECT SUM(size) FROM blobs").fetchone()[0] or 0
+
+    @property
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+    def __str__(self):
+        return (
+            f"- cached: {self.count:,} ({self.size / 2**20:,.1f} MiB)\n"
+            f"- evicted: {self.evicted:,}, expired: {self.expired:,}"
+        )
+
+    def close(self):
+        self.db.close()
+
+    def artifacts(self):
+        return {row[0] for row in self.db.execute("SELECT artifact FROM artifacts")}
+
+    def get_path(self, blob: str):
+        return os.path.join(self.path, blob)
+
+    def write(self, data: bytes, extension: str):
+        """
+        Write an image under its content hash, return the blob name, blocking
+        """
+
+        blob = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = self.get_path(blob)
+        if not os.path.exists(path):
+            partial = f"{path}.{os.getpid()}.partial"
+            with open(partial, "wb") as f:
+                f.write(data)
+            os.replace(partial, path)
+        return blob
+
+    def put(self, artifact: str, entries: list[tuple[str, str]]):
+        """
+        Index written blobs under an artifact as (entry name, blob) pairs,
+        replacing what it had before
+        """
+
+        previous = self.db.execute(
+            "SELECT entries FROM artifacts WHERE artifact = ?", (artifact,)
+        ).fetchone()
+
+        sizes = {blob: os.path.getsize(self.get_path(blob)) for _, blob in entries}
+        # an artifact holds one reference per distinct blob
+        self.db.executemany(
+            "INSERT INTO blobs VALUES (?, ?, 1) "
+            "ON CONFLICT (blob) DO UPDATE SET refs = refs + 1",
+            sizes.items(),
+        )
+
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+            (artifact, json.dumps(entries), sum(sizes.values()), now, now),
+        )
+        if previous:
+            self.release([blob for _, blob in json.loads(previous[0])])
+        self.evict()
+        self.db.commit()
+
+    def get(self, artifact: str) -> Optional[list[tuple[str, str]]]:
+        """
+        Entry names with their blob paths, None if the artifact is gone
+        """
+
+        row = self.db.execute(
+            "SELECT entries FROM artifacts WHERE artifact = ?", (artifact,)
+        ).fetchone()
+        if not row:
+            return None
+
+        self.db.execute(
+            "UPDATE artifacts SET accessed = ? WHERE artifact = ?",
+            (time.time(), artifact),
+        )
+        self.db.commit()
+        return [(name, self.get_path(blob)) for name, blob in json.loads(row[0])]
+
+    @staticmethod
+    def bundle(entries: list[tuple[str, str]]):
+        """
+        Zip entry names with their blob paths, touches no index so it can run
+        off the loop, blocking
+
+        Raise FileNotFoundError if a blob was removed from under the index
+        """
+
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+            for name, path in entries:
+                stored = name.lower().endswith(STORED_EXTENSIONS)
+                z.write(
+                    path,
+                    name,
+                    compress_type=zipfile.ZIP_STORED if stored else None,
+                )
+        buffer.seek(0)
+        return buffer
+
+    def archive(self, artifact: str):
+        """
+        Zip an artifact's images, None if it is gone, blocking
+        """
+
+        entries = self.get(artifact)
+        if entries is None:
+            return None
+
+        try:
+            return self.bundle(entries)
+        except FileNotFoundError:
+            self.remove(artifact)
+            return None
+
+    def release(self, blobs: list[str]):
+        """
+        Drop one artifact's reference to its blobs, deleting blobs nothing
+        refers to anymore
+
+        Return the bytes freed
+        """
+
+        freed = 0
+        for blob in set(blobs):
+            row = self.db.execute(
+                "UPDATE blobs SET refs = refs - 1 WHERE blob = ? RETURNING refs, size",
+                (blob,),
+            ).fetchone()
+            if not row or row[0] > 0:
+                continue
+            self.db.execute("DELETE FROM blobs WHERE blob = ?", (blob,))
+            freed += row[1]
+            try:
+                os.remove(self.get_path(blob))
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def remove(self, artifact: str):
+        row = self.db.execute(
+            "DELETE FROM artifacts WHERE artifact = ? RETURNING entries", (artifact,)
+        ).fetchone()
+        if row:
+            self.release([blob for _, blob in json.loads(row[0])])
+        self.db.commit()
+
+    def evict(self):
+        """
+        Drop least recently used artifacts until within max_bytes
+        """
+
+        total = self.size
+        if total <= self.max_bytes:
+            return
+
+        rows = self.db.execute(
+            "SELECT artifact FROM artifacts ORDER BY accessed"
+        ).fetchall()
+        # always keep the newest
+        for (artifact,) in rows[:-1]:
+            if total <= self.max_bytes:
+                break
+            entries = self.db.execute(
+                "DELETE FROM artifacts WHERE artifact = ? RETURNING entries",
+                (artifact,),
+            ).fetchone()[0]
+            total -= self.release([blob for _, blob in json.loads(entries)])
+            self.evicted += 1
+
+    def sweep(self):
+        """
+        Drop artifacts past retention, then evict down to max_bytes
+
+        Return how many artifacts were dropped
+        """
+
+        before = self.evicted
+        expired = self.db.execute(
+            "DELETE FROM artifacts WHERE created < ? RETURNING entries",
+            (time.time() - self.retention,),
+        ).fetchall()
+        for (entries,) in expired:
+            self.release([blob for _, blob in json.loads(entries)])
+        self.expired += len(expired)
+
+        self.evict()
+        self.db.commit()
+        return len(expired) + self.evicted - before
@@ -0,0 +1,133 @@
+import asyncio
+import common.logger as logger
+import common.metrics as metrics
+import time
+import uuid
+
+from .poller import TrioJobPoller, is_finished, is_started
+from common.models.trio import TrioPollModel
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+# jobs are tagged by creation window, so a tick costs one query per live window
+TAG_SECONDS = 60
+
+
+@dataclass
+class TrioTrackedJob:
+    token: str
+    tag: str
+    future: asyncio.Future
+    submitted: float = field(default_factory=time.monotonic)
+    started: Optional[float] = None
+
+
+class TrioJobTracker:
+    """
+    One poll loop for every in-flight civitai job
+
+    Commands register job ids and await futures resolved with the finished
+    job, upstream requests per tick depend on live tag windows, not on jobs
+    """
+
+    def __init__(self, poller: TrioJobPoller, config: TrioPollModel):
+        self.poller = poller
+        self.config = config
+        self.session = uuid.uuid4().hex[:12]
+        self.jobs: dict[str, TrioTrackedJob] = {}
+        self.loop: Optional[asyncio.Task] = None
+        self.ticks = 0
+
+    def __str__(self):
+        return f"{len(self.jobs)} tracked, {self.ticks} ticks, {self.poller.polls} polls"
+
+    def tag(self):
+        """
+        Properties to create jobs with, so they can be queried together
+        """
+
+        return {"droppy": f"{self.session}-{int(time.time() // TAG_SECONDS)}"}
+
+    def track(self, token: str, tag: dict, job_ids: list[str]):
+        """
+        Register jobs, return a future per job in the same order
+        """
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for job_id in job_ids:
+            tracked = TrioTrackedJob(token, tag["droppy"], loop.create_future())
+            self.jobs[job_id] = tracked
+            futures.append(tracked.future)
+
+        if not self.loop or self.loop.done():
+            self.loop = asyncio.create_task(self.run())
+        return futures
+
+    def untrack(self, job_ids: list[str]):
+        for job_id in job_ids:
+            tracked = self.jobs.pop(job_id, None)
+            if tracked:
+                tracked.future.cancel()
+
+    async def close(self):
+        self.untrack(list(self.jobs))
+        if self.loop:
+            self.loop.cancel()
+
+    async def fetch(self):
+        """
+        Status of every tracked job by id
+        """
+
+        if self.config.batch:
+            tags = {tracked.tag for tracked in self.jobs.values()}
+            pages = [self.poller.query_jobs({"droppy": tag}) for tag in tags]
+        else:
+            tokens = {tracked.token for tracked in self.jobs.values()}
+            pages = [self.poller.get_jobs(token) for token in tokens]
+
+        jobs = {}
+        for page in await asyncio.gather(*pages):
+            jobs.update({job["jobId"]: job for job in page if job.get("jobId")})
+        return jobs
+
+    async def run(self):
+        interval = self.config.min_interval
+        while self.jobs:
+            self.ticks += 1
+            try:
+                jobs = await self.fetch()
+            except Exception as e:
+                logger.error(f"trio job polling failed: {e}", mention=False)
+                jobs = {}
+
+            now = time.monotonic()
+            progressed = False
+            for job_id, tracked in list(self.jobs.items()):
+                job = jobs.get(job_id, None)
+                if not job:
+                    continue
+
+                if tracked.started is None and is_started(job):
+                    tracked.started = now
+                    queued = now - tracked.submitted
+                    metrics.record(queued * 1000, "trio", "job", "queue")
+                if not is_finished(job):
+                    continue
+
+                generating = now - (tracked.started or tracked.submitted)
+                metrics.record(generating * 1000, "trio", "job", "generate")
+                del self.jobs[job_id]
+                if not tracked.future.done():
+                    tracked.future.set_result(job)
+                progressed = True
+
+            # siblings tend to finish close together
+            if progressed:
+                interval = self.config.min_interval
+            else:
+                pending = [jobs[job_id] for job_id in self.jobs if job_id in jobs]
+                interval = self.poller.next_interval(pending, interval)
+            await asyncio.sleep(interval)
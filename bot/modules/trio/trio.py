@@ -1,22 +1,22 @@
 import asyncio
 import civitai.models
 import common.helper as helper
+import common.logger as logger
+import common.metrics as metrics
 import discord
 import json
-import os
-import re
-import requests
-import zipfile
 
-from PIL import Image
 from datetime import datetime, timedelta, UTC
-from discord.ext import commands
+from discord.ext import commands, tasks
 from io import BytesIO
 from common.exception import DroppyBotException
+from common.media import scan_text_metadata
+from modules.trio.poller import TrioJobPoller
 from modules.trio.resource.manager import TrioResourceManager
-from modules.trio.resource.cache import TrioArtifact
+from modules.trio.resource.cache import TrioArtifact, TrioGeneration
 from modules.trio.resource.model import TrioModel, TrioModelType
 from modules.trio.resource.template import TrioTemplate
+from modules.trio.tracker import TrioJobTracker
 from modules.trio.trioview import TrioControlView, TrioJobView
 from prodict import Prodict
 from shared import CogBase, cwd
@@ -26,6 +26,15 @@ class TrioHandler(CogBase, commands.Cog):
 
     def __init__(self):
         self.resource = TrioResourceManager(self.config)
+        self.poller = TrioJobPoller(self.config.trio.poll)
+        self.tracker = TrioJobTracker(self.poller, self.config.trio.poll)
+        self.cache_sweep.start()
+
+    async def cog_unload(self):
+        self.cache_sweep.cancel()
+        await self.tracker.close()
+        await self.poller.close()
+        self.resource.store.close()
 
     def get_models(self, model_type: TrioModelType):
         return [m for m in self.trio_models if m.model == model_type]
@@ -42,34 +51,58 @@ class TrioHandler(CogBase, commands.Cog):
             details[pack[0].strip()] = ":".join(pack[1:])
         return Prodict.from_dict(details)
 
-    def fetch_cache(self, artifact: TrioArtifact):
-        cache_path = self.get_cache_path(artifact.cache)
+    async def fetch_cache(self, artifact: TrioArtifact):
+        """
+        Zip an artifact's cached images, None if they were evicted
+        """
+
+        # the index stays on the loop thread, only the zipping is offloaded
+        store = self.resource.store
+        entries = store.get(artifact.cache)
+        if entries is None:
+            return None
+
         try:
-            if os.path.exists(cache_path):
-                with open(cache_path, "rb") as f:
-                    return BytesIO(f.read())
-        except:
-            pass
-        return None
-
-    def write_cache(self, buffer: list, cache: str):
-        buf = BytesIO()
-        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-            for i, image in enumerate(buffer):
-                if image is not None:
-                    raw, seed = image
-                    sanitized_buf = BytesIO()
-                    self.del_image_info(raw).save(
-                        sanitized_buf, self.config.trio.output_type
-                    )
-                    z.writestr(
-                        self.get_image_name(i + 1, str(seed)), sanitized_buf.getvalue()
-                    )
-        buf.seek(0)
-        if buf.getbuffer().nbytes > 0:
-            cache_path = self.get_cache_path(cache)
-            with open(cache_path, "wb") as f:
-                f.write(buf.read())
+            return await asyncio.to_thread(store.bundle, entries)
+        except FileNotFoundError:
+            # blob removed from under the index
+            store.remove(artifact.cache)
+            return None
+
+    async def write_cache(self, buffer: list, cache: str):
+        images = [(i, image) for i, image in enumerate(buffer) if image is not None]
+        sanitized = await asyncio.gather(
+            *[
+                self.media.strip_metadata(raw, self.config.trio.output_type)
+                for _, (raw, _) in images
+            ]
+        )
+
+        entries = []
+        for (i, (_, generation)), data in zip(images, sanitized):
+            blob = await asyncio.to_thread(
+                self.resource.store.write, data, self.config.trio.output_type
+            )
+            entries.append((self.get_image_name(i + 1, str(generation.seed)), blob))
+        if entries:
+            self.resource.store.put(cache, entries)
+
+    @tasks.loop(seconds=CogBase.config.trio.cache.sweep_interval)
+    async def cache_sweep(self):
+        try:
+            self.resource.store.sweep()
+        except Exception as e:
+            logger.error(f"trio cache sweep failed: {e}", mention=False)
+            return
+
+        # artifacts whose images are gone have nothing left to download
+        stored = self.resource.store.artifacts()
+        self.user_artifacts = [a for a in self.user_artifacts if a.cache in stored]
+        self.save_user_artifacts()
+
+    @cache_sweep.before_loop
+    async def cache_sweep_ready(self):
+        await self.bot.wait_until_ready()
 
     def create_input_model(self, template: TrioTemplate, prompt: str):
         return {
@@ -101,19 +134,13 @@ class TrioHandler(CogBase, commands.Cog):
         extension = f".{self.config.trio.output_type}"
         return name + extension
 
-    def get_image_seed(self, buffer):
-        image = Image.open(BytesIO(buffer))
-        exif = image.info["exif"].decode("utf-16be", "ignore")
-        seed = re.search(r"Seed: (\d+)", exif)
-        if seed:
-            return int(seed.group(1))
-        return -1
+    def get_image_generation(self, buffer: bytes):
+        """
+        Generation parameters from the image's metadata segments, no decoding
+        """
 
-    def del_image_info(self, buffer):
-        image = Image.open(BytesIO(buffer))
-        sanitized = Image.new(image.mode, image.size)
-        sanitized.putdata(list(image.getdata()))
-        return sanitized
+        text = scan_text_metadata(buffer)
+        return TrioGeneration.parse("\n".join(text.values()))
 
     async def validate_model_type(self, ctx: discord.Message, model_type: str):
         try:
@@ -415,51 +442,60 @@ class TrioHandler(CogBase, commands.Cog):
             f"trio del **Template**, `{template.name}`",
         )
 
+    async def collect_image(
+        self, ctx: discord.Message, index: int, job: asyncio.Future
+    ):
+        """
+        Wait for a tracked job, download its image and post it
+
+        Return the image with its generation, None if the job produced no image
+        """
+
+        image_url = ((await job).get("result", None) or {}).get("blobUrl", None)
+        if not image_url:
+            return None
+
+        with metrics.timer("trio", "download"):
+            image = await self.poller.download(image_url)
+        generation = self.get_image_generation(image)
+
+        image_file = discord.File(
+            BytesIO(image),
+            self.get_image_name(index + 1),
+            description=str(generation.seed),
+        )
+        with metrics.timer("trio", "upload"):
+            await ctx.channel.send(file=image_file, silent=True)
+        return image, generation
+
     @helper.sanitized
     async def create_and_poll_jobs(
         self, ctx: discord.Message, input_model: str, temp: bool = False
     ):
-        expected = input_model["quantity"]
-        main_job = await civitai.image.create(input=input_model, wait=False)
-        token = main_job["token"]
-
-        elapsed = 0
-        collected = {}
-        completion_time = "failed/unknown status occurred"
-        seed = -1
-        display_tasks = []
-        while (
-            len(collected) < expected and elapsed < self.config.trio.concurrent_timeout
-        ):
-            responses = await civitai.jobs.get(token=token)
-            for i, response in enumerate(responses["jobs"]):
-                available = response["result"].get("available")
-                scheduled = response.get("scheduled")
-                if i not in collected and available and not scheduled:
-                    display_task = None
-                    image_url = response["result"].get("blobUrl")
-                    if image_url:
-                        image = requests.get(image_url).content
-
-                        seed = self.get_image_seed(image)
-                        collected[i] = (image, seed)
-
-                        image_file = discord.File(
-                            BytesIO(image),
-                            self.get_image_name(len(collected)),
-                            description=str(seed),
-                        )
-                        display_task = ctx.channel.send(file=image_file, silent=True)
-                    else:
-                        collected[i] = None
-
-                    if display_task is not None:
-                        display_tasks.append(asyncio.create_task(display_task))
-
-            await asyncio.sleep(1)
-            elapsed += 1
-
-        collected = [c for _, c in collected.items() if c is not None]
+        # tagged so the tracker polls every in-flight job together
+        tag = self.tracker.tag()
+        main_job = await civitai.image.create(
+            input={**input_model, "properties": tag}, wait=False
+        )
+        job_ids = [job["jobId"] for job in main_job["jobs"]]
+        finished = self.tracker.track(main_job["token"], tag, job_ids)
+
+        collect_tasks = [
+            asyncio.create_task(self.collect_image(ctx, i, job))
+            for i, job in enumerate(finished)
+        ]
+        try:
+            done, _ = await asyncio.wait(
+                collect_tasks, timeout=self.config.trio.concurrent_timeout
+            )
+        finally:
+            # stopped generations should not keep polling or downloading
+            self.tracker.untrack(job_ids)
+            for task in collect_tasks:
+                task.cancel()
+
+        results = [t.result() for t in done if not t.cancelled() and not t.exception()]
+        collected = [r for r in results if r is not None]
 
         if len(collected) == 0:
             raise Exception("Unable to schedule any job")
@@ -471,15 +507,15 @@ class TrioHandler(CogBase, commands.Cog):
             completion_time,
             input_model,
             completion_time,
-            [s[1] for s in collected if s is not None],
+            [g.seed for _, g in collected],
+            [g for _, g in collected],
         )
 
         self.user_artifacts.append(artifact)
         self.save_user_artifacts()
         if not temp:
-            self.write_cache(collected, artifact.cache)
+            await self.write_cache(collected, artifact.cache)
 
-        await asyncio.gather(*display_tasks)
         return completion_time
 
     @helper.sanitized
@@ -613,10 +649,10 @@ class TrioHandler(CogBase, commands.Cog):
             )
         # cache
         if len(self.user_artifacts) > 0:
-            self.invalidate_cache()
             embed.add_field(
                 name=f"Cache: {len(self.user_artifacts)} available",
-                value=f"Oldest is `{self.user_artifacts[-1].timestamp}`",
+                value=f"Oldest is `{self.user_artifacts[-1].timestamp}`\n"
+                + str(self.resource.store),
                 inline=False,
             ),
 
@@ -817,7 +853,7 @@ class TrioHandler(CogBase, commands.Cog):
         elif trio_type.lower() == "cache":
             artifact = helper.first(self.user_artifacts, lambda a: a.cache == query)
             if artifact is not None:
-                cache = self.fetch_cache(artifact)
+                cache = await self.fetch_cache(artifact)
                 if cache is not None:
                     await ref.edit(file=discord.File(cache, f"artifact_{query}.zip"))
                     return
@@ -1,12 +1,13 @@
 import asyncio
 import discord
 
+from common.view import DroppyView
 from shared import CogBase
 
 
-class TrioViewBase(discord.ui.View):
-    def __init__(self, trio):
-        super().__init__(timeout=None)
+class TrioViewBase(DroppyView):
+    def __init__(self, trio, *, token: str = None):
+        super().__init__(trio, token=token)
         self.trio = trio
 
 
@@ -24,7 +25,6 @@ class TrioJobView(TrioViewBase):
 
     @discord.ui.button(
         label="Regenerate",
-        custom_id="trio-button-job-redo",
         style=discord.ButtonStyle.primary,
         emoji="🖌️",
     )
@@ -48,7 +48,6 @@ class TrioJobView(TrioViewBase):
 
     @discord.ui.button(
         label="Remix!",
-        custom_id="trio-button-image-remix",
         style=discord.ButtonStyle.success,
         emoji="🎨",
         disabled=True,  # TODO
@@ -66,7 +65,14 @@ class TrioJobView(TrioViewBase):
 
         artifact = self.get_artifact(ctx.message)
         input_model = artifact.input_model
-        input_model["params"]["seed"] = int(sum(artifact.seeds) / len(artifact.seeds))
+        # recorded with the artifact, no image has to be opened again
+        generations = [g for g in artifact.generations if g.seed >= 0]
+        seeds = [g.seed for g in generations] or artifact.seeds
+        input_model["params"]["seed"] = int(sum(seeds) / len(seeds))
+        if generations and generations[0].steps:
+            input_model["params"]["steps"] = generations[0].steps
+        if generations and generations[0].cfg:
+            input_model["params"]["cfgScale"] = generations[0].cfg
 
         remix_task = asyncio.create_task(
             self.trio.create_and_poll_jobs(ref, input_model)
@@ -81,14 +87,13 @@ class TrioJobView(TrioViewBase):
 
     @discord.ui.button(
         label="Download",
-        custom_id="trio-button-job-artifact",
         style=discord.ButtonStyle.secondary,
         emoji="📩",
     )
     async def download_artifact(self, ctx: discord.Interaction, button: discord.Button):
         artifact = self.get_artifact(ctx.message)
         template = self.get_field(ctx.message.embeds, "Template")
-        cache = self.trio.fetch_cache(artifact)
+        cache = await self.trio.fetch_cache(artifact)
         await ctx.response.send_message(
             file=discord.File(cache, f"{template}_{artifact.timestamp}.zip"),
             ephemeral=True,
@@ -97,13 +102,20 @@ class TrioJobView(TrioViewBase):
 
 
 class TrioControlView(TrioViewBase):
-    def __init__(self, trio, task: asyncio.Task):
-        super().__init__(trio)
+    def __init__(self, trio, task: asyncio.Task, *, token: str = None):
+        super().__init__(trio, token=token)
         self.task = task
 
+    def is_pinned(self):
+        return not self.task.done()
+
+    @classmethod
+    def revive(cls, trio, state: dict, token: str):
+        # the job task is gone with the view, nothing left to stop
+        return None
+
     @discord.ui.button(
         label="Stop Generation",
-        custom_id="trio-button-control-stop",
         style=discord.ButtonStyle.danger,
     )
     async def stop_job(self, ctx: discord.Interaction, button: discord.Button):
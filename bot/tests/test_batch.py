@@ -0,0 +1,179 @@
+import asyncio
+import json
+import sqlite3
+
+from types import SimpleNamespace
+
+import pytest
+
+from common.models.gpt import BatchModel
+from modules.gpt.batch import GptBatchQueue
+
+
+class FakeBatchClient:
+    """
+    Stand-in for the files and batches endpoints of the provider client
+    """
+
+    def __init__(self):
+        self.uploads: dict[str, bytes] = {}
+        self.outputs: dict[str, str] = {}
+        self.status = "in_progress"
+        self.files = SimpleNamespace(create=self.create_file, content=self.content)
+        self.batches = SimpleNamespace(
+            create=self.create_batch, retrieve=self.retrieve_batch
+        )
+
+    async def create_file(self, file, purpose):
+        file_id = f"file-{len(self.uploads)}"
+        self.uploads[file_id] = file[1]
+        return SimpleNamespace(id=file_id)
+
+    async def content(self, file_id):
+        return SimpleNamespace(text=self.outputs[file_id])
+
+    async def create_batch(self, input_file_id, endpoint, completion_window):
+        self.input_file_id = input_file_id
+        return SimpleNamespace(id="batch-0")
+
+    async def retrieve_batch(self, batch_id):
+        done = self.status == "completed"
+        return SimpleNamespace(
+            id=batch_id,
+            status=self.status,
+            output_file_id="file-out" if done else None,
+            error_file_id=None,
+        )
+
+    def complete(self, answers: dict[int, str]):
+        """
+        Finish the batch, answering the given job ids and failing the rest
+        """
+
+        lines = []
+        for line in self.uploads[self.input_file_id].decode().splitlines():
+            job_id = int(json.loads(line)["custom_id"])
+            if job_id in answers:
+                response = {
+                    "status_code": 200,
+                    "body": {
+                        "choices": [
+                            {
+                                "message": {"content": answers[job_id]},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+                    },
+                }
+            else:
+                response = {"status_code": 500, "body": {}}
+            lines.append(json.dumps({"custom_id": str(job_id), "response": response}))
+        self.outputs["file-out"] = "\n".join(lines)
+        self.status = "completed"
+
+
+def make_queue(path: str):
+    config = BatchModel(
+        path=path,
+        poll_interval=60.0,
+        max_jobs=10,
+        completion_window="24h",
+        discount=0.5,
+        max_deliveries=3,
+    )
+    return GptBatchQueue(path, config)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_API", "http://localhost")
+    queue = make_queue(str(tmp_path / "batch.db"))
+    queue.client = FakeBatchClient()
+    yield queue
+    queue.close()
+
+
+def enqueue(queue: GptBatchQueue, prompt: str):
+    messages = [{"role": "user", "content": prompt}]
+    return queue.enqueue(1, 2, 3, "gpt-4o", messages)
+
+
+def test_submit_poll_settle(queue: GptBatchQueue):
+    answered = enqueue(queue, "hello")
+    failed = enqueue(queue, "world")
+
+    assert asyncio.run(queue.submit()) == "batch-0"
+    assert asyncio.run(queue.submit()) is None
+    assert [job.state for job in queue.user_jobs(1)] == ["submitted", "submitted"]
+
+    asyncio.run(queue.poll())
+    assert queue.finished() == []
+
+    queue.client.complete({answered: "hi"})
+    asyncio.run(queue.poll())
+    jobs = {job.job_id: job for job in queue.finished()}
+    assert jobs[answered].state == "completed"
+    assert jobs[answered].content == "hi"
+    assert jobs[answered].total_tokens == 15
+    assert jobs[failed].state == "failed"
+
+
+def test_delivery_is_retried_then_dropped(queue: GptBatchQueue):
+    job_id = enqueue(queue, "hello")
+    asyncio.run(queue.submit())
+    queue.client.complete({job_id: "hi"})
+    asyncio.run(queue.poll())
+
+    # kept with its result while deliveries remain
+    assert queue.undelivered(job_id)
+    assert queue.undelivered(job_id)
+    job = queue.finished()[0]
+    assert job.deliveries == 2
+    assert job.content == "hi"
+
+    assert not queue.undelivered(job_id)
+    assert queue.finished() == []
+    assert queue.dropped == 1
+
+
+def test_delivered_job_is_removed(queue: GptBatchQueue):
+    job_id = enqueue(queue, "hello")
+    asyncio.run(queue.submit())
+    queue.client.complete({job_id: "hi"})
+    asyncio.run(queue.poll())
+
+    queue.delivered(job_id)
+    assert queue.finished() == []
+    assert queue.user_jobs(1) == []
+
+
+def test_deliveries_column_is_migrated(tmp_path, monkeypatch):
+    path = tmp_path / "old.db"
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE jobs ("
+        "job_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "user_id INTEGER NOT NULL, "
+        "channel_id INTEGER NOT NULL, "
+        "message_id INTEGER NOT NULL, "
+        "model TEXT NOT NULL, "
+        "messages BLOB NOT NULL, "
+        "state TEXT NOT NULL, "
+        "batch_id TEXT, "
+        "content TEXT, "
+        "finish_reason TEXT, "
+        "prompt_tokens INTEGER NOT NULL DEFAULT 0, "
+        "completion_tokens INTEGER NOT NULL DEFAULT 0, "
+        "created REAL NOT NULL)"
+    )
+    db.commit()
+    db.close()
+
+    monkeypatch.setenv("OPENAI_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_API", "http://localhost")
+    queue = make_queue(str(path))
+    job_id = enqueue(queue, "hello")
+    assert queue.undelivered(job_id)
+    queue.close()
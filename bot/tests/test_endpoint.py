@@ -0,0 +1,101 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from common.endpoint import DroppyEndpoint, DroppyEndpointPool
+
+
+class FakeResponse:
+    headers = {}
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def parse(self):
+        return self.name
+
+
+class FakeClient:
+    """
+    Raw response client whose answers depend on the endpoint and the call mode
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.with_raw_response = self
+
+    async def create(self, mode: str):
+        if self.name == "secondary":
+            await asyncio.sleep(0.01)
+            return FakeResponse(self.name)
+        if mode == "slow":
+            await asyncio.sleep(0.3)
+            return FakeResponse(self.name)
+        await asyncio.sleep(0.1)
+        raise openai.APIConnectionError(request=httpx.Request("POST", "http://x"))
+
+
+def make_pool():
+    endpoints = [
+        DroppyEndpoint(name, FakeClient(name), 16) for name in ("primary", "secondary")
+    ]
+    # p95 of 50ms, so hedging kicks in early and the secondary ranks behind
+    endpoints[0].latencies_of("chat").extend([0.05] * 8)
+    endpoints[0].outcomes.extend([True] * 8)
+    endpoints[1].latencies_of("chat").extend([0.5] * 8)
+    endpoints[1].outcomes.extend([True] * 8)
+    return DroppyEndpointPool(endpoints, hedge_min_samples=4, max_requeues=0)
+
+
+def test_retry_not_skipped_by_concurrent_hedge():
+    async def run():
+        pool = make_pool()
+        primary, secondary = pool.endpoints
+
+        def dispatch(mode: str, hedge: bool):
+            return pool.dispatch(
+                primary, lambda c: c.create(mode), 0, True, hedge, "chat"
+            )
+
+        # the slow call hedges to the secondary while the failing one is in flight
+        calls = dispatch("slow", True), dispatch("fail", False)
+        return await asyncio.gather(*calls), secondary
+
+    results, secondary = asyncio.run(run())
+    assert results == ["secondary", "secondary"]
+    assert secondary.hedged == 1
+    assert secondary.retried == 1
+
+
+def test_retry_after_early_failure():
+    async def run():
+        pool = make_pool()
+        primary, secondary = pool.endpoints
+        # primary fails before its p95, the secondary was never raced
+        primary.latencies_of("chat").extend([1.0] * 8)
+        result = await pool.dispatch(
+            primary, lambda c: c.create("fail"), 0, True, True, "chat"
+        )
+        return result, secondary
+
+    result, secondary = asyncio.run(run())
+    assert result == "secondary"
+    assert secondary.hedged == 0
+    assert secondary.retried == 1
+
+
+def test_lost_race_is_not_retried():
+    async def run():
+        pool = make_pool()
+        primary, secondary = pool.endpoints
+
+        async def fail(c):
+            await asyncio.sleep(0.1)
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://x"))
+
+        await pool.dispatch(primary, fail, 0, True, True, "chat")
+
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(run())
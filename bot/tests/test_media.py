@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+from io import BytesIO
+
+import pytest
+
+from PIL import Image
+from common.media import DroppyMediaPipeline, scan_text_metadata, sniff_format
+
+
+def make_image(format: str, size=(64, 48), **params):
+    image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    encoded = BytesIO()
+    image.save(encoded, format, **params)
+    return encoded.getvalue()
+
+
+def make_exif_jpeg(comment: str):
+    image = Image.open(BytesIO(make_image("JPEG")))
+    exif = Image.Exif()
+    exif[0x010E] = comment
+    encoded = BytesIO()
+    image.save(encoded, "JPEG", exif=exif.tobytes())
+    return encoded.getvalue()
+
+
+@pytest.fixture(scope="module")
+def media():
+    media = DroppyMediaPipeline(2)
+    media.start()
+    yield media
+    media.shutdown()
+
+
+def test_run_before_start_raises():
+    media = DroppyMediaPipeline(1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(media.decode(make_image("PNG")))
+    assert media.executor is None
+
+
+def test_decode(media: DroppyMediaPipeline):
+    image = asyncio.run(media.decode(make_image("PNG"), "L"))
+    assert image.size == (64, 48)
+    assert image.mode == "L"
+
+
+def test_transcode(media: DroppyMediaPipeline):
+    png = make_image("PNG")
+    webp = asyncio.run(media.transcode(png, "WEBP"))
+    assert sniff_format(webp[:12]) == "WEBP"
+    # already in format, returned as is
+    assert asyncio.run(media.transcode(png, "PNG")) == png
+
+
+def test_thumbnail(media: DroppyMediaPipeline):
+    data = make_image("JPEG", (400, 200))
+    thumbnail = asyncio.run(media.thumbnail(data, 100, "PNG"))
+    image = Image.open(BytesIO(thumbnail))
+    assert image.format == "PNG"
+    assert image.size == (100, 50)
+
+
+def test_strip_metadata_in_place(media: DroppyMediaPipeline):
+    data = make_exif_jpeg("Seed: 42")
+    assert scan_text_metadata(data) == {"ImageDescription": "Seed: 42"}
+
+    completed = media.completed
+    stripped = asyncio.run(media.strip_metadata(data, "JPEG"))
+    # rewritten on the loop, no pool round trip
+    assert media.completed == completed
+    assert not scan_text_metadata(stripped)
+    # pixels untouched, only the exif segment is gone
+    assert len(data) - len(stripped) < 1024
+    pixels = Image.open(BytesIO(data)).tobytes()
+    assert Image.open(BytesIO(stripped)).tobytes() == pixels
+
+
+def test_strip_metadata_reencodes_other_formats(media: DroppyMediaPipeline):
+    stripped = asyncio.run(media.strip_metadata(make_exif_jpeg("Seed: 42"), "PNG"))
+    assert sniff_format(stripped[:12]) == "PNG"
+    assert not scan_text_metadata(stripped)
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sqlite3
+import time
+import zlib
+
+import pytest
+
+from modules.gpt.snapshot import GptSnapshotStore
+
+
+def image_messages(prompt: str):
+    # an inline image that does not compress, like the real data urls
+    url = "data:image/webp;base64," + os.urandom(6000).hex()
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": url}},
+            ],
+        }
+    ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = GptSnapshotStore(str(tmp_path / "snapshots.db"), 16000, 30)
+    yield store
+    store.close()
+
+
+def test_get_put_off_the_loop_thread(store: GptSnapshotStore):
+    messages = image_messages("hello")
+
+    async def roundtrip():
+        await asyncio.to_thread(store.put, [1, 2], messages)
+        return await asyncio.to_thread(store.get, 2)
+
+    assert asyncio.run(roundtrip()) == messages
+    assert store.get(3) is None
+    assert store.is_answer(1)
+
+
+def test_get_does_not_write(store: GptSnapshotStore):
+    store.put([1], image_messages("hello"))
+    changes = store.db.total_changes
+    store.get(1)
+    assert store.db.total_changes == changes
+    assert 1 in store.touched
+
+
+def test_evicted_by_bytes(store: GptSnapshotStore):
+    for reply_id in range(1, 4):
+        store.put([reply_id], image_messages(str(reply_id)))
+    assert len(store) == 2
+    assert store.size <= 16000
+
+    # the read is flushed with the next put, so 3 goes first
+    store.get(2)
+    store.put([4], image_messages("4"))
+    assert store.get(2)
+    assert store.get(3) is None
+    # evicted snapshots are still known answers
+    assert store.is_answer(1)
+
+
+def test_size_column_is_migrated(tmp_path):
+    path = tmp_path / "old.db"
+    blob = zlib.compress(b'[{"role": "user", "content": "hello"}]')
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE snapshots ("
+        "reply_id INTEGER PRIMARY KEY, "
+        "messages BLOB NOT NULL, "
+        "accessed REAL NOT NULL)"
+    )
+    db.execute("INSERT INTO snapshots VALUES (1, ?, ?)", (blob, time.time()))
+    db.commit()
+    db.close()
+
+    store = GptSnapshotStore(str(path), 16000, 30)
+    assert store.size == len(blob)
+    assert store.get(1) == [{"role": "user", "content": "hello"}]
+    store.close()
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from common.helpers.string import MarkdownChunker, chunk_with_size
+
+
+LONG_FENCE = "```python-with-a-really-long-info-string-that-fills-a-chunk\n"
+
+
+def make_markdown(rng: random.Random, lines: int):
+    parts = []
+    for _ in range(lines):
+        kind = rng.random()
+        if kind < 0.15:
+            parts.append(LONG_FENCE)
+        elif kind < 0.3:
+            parts.append("```\n")
+        elif kind < 0.35:
+            parts.append("~~~~ tilde info\n")
+        else:
+            words = rng.randint(0, 12)
+            parts.append(" ".join("w" * rng.randint(1, 30) for _ in range(words)))
+            parts.append("\n")
+    return "".join(parts)
+
+
+@pytest.mark.parametrize("chunk_size", [12, 20, 32, 64, 2000])
+def test_chunks_never_exceed_size(chunk_size: int):
+    rng = random.Random(chunk_size)
+    for _ in range(50):
+        text = make_markdown(rng, 40)
+        for chunk in chunk_with_size(text, chunk_size):
+            assert len(chunk) <= chunk_size, chunk
+
+
+@pytest.mark.parametrize("chunk_size", [12, 20, 64])
+def test_streamed_chunks_never_exceed_size(chunk_size: int):
+    rng = random.Random(-chunk_size)
+    for _ in range(50):
+        text = make_markdown(rng, 40)
+        chunker = MarkdownChunker(chunk_size)
+        chunks = []
+        i = 0
+        while i < len(text):
+            step = rng.randint(1, 40)
+            chunks += chunker.feed(text[i : i + step])
+            assert len(chunker.peek()) <= chunk_size
+            i += step
+        chunks += chunker.close()
+        for chunk in chunks:
+            assert len(chunk) <= chunk_size, chunk
+
+
+def test_long_fence_is_reopened_capped():
+    text = LONG_FENCE + "print(1)\n" * 3 + "```\nafter\n"
+    chunks = chunk_with_size(text, 20)
+
+    assert all(len(chunk) <= 20 for chunk in chunks)
+    assert chunks[0].startswith("```pyth")
+    assert all(chunk.endswith("```") for chunk in chunks[:-1])
+    assert chunks[-1] == "after\n"
+
+
+def test_fits_unchanged():
+    text = LONG_FENCE + "print(1)\n```\nafter\n"
+    assert chunk_with_size(text, 2000) == [text]
+
+
+@pytest.mark.parametrize("chunk_size", [10, 12, 2000])
+def test_crlf_split_across_deltas(chunk_size: int):
+    text = "```py\r\nprint(1)\r\n```\r\nafter\r\n"
+    expected = chunk_with_size(text, chunk_size)
+    for split in range(1, len(text)):
+        chunker = MarkdownChunker(chunk_size)
+        chunks = chunker.feed(text[:split]) + chunker.feed(text[split:])
+        chunks += chunker.close()
+        assert chunks == expected, split
+
+
+def test_lone_cr_is_a_line_break():
+    chunker = MarkdownChunker(2000)
+    chunker.feed("```\r")
+    chunker.feed("code\r")
+    assert chunker.peek() == "```\rcode\r\n```"
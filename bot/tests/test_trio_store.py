@@ -0,0 +1,80 @@
+import asyncio
+import os
+import zipfile
+
+import pytest
+
+from modules.trio.resource.store import TrioArtifactStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TrioArtifactStore(str(tmp_path), 3500, 7)
+    yield store
+    store.close()
+
+
+def test_shared_blobs_and_eviction(store: TrioArtifactStore):
+    a = store.write(b"a" * 1000, "jpeg")
+    b = store.write(b"b" * 1000, "jpeg")
+    store.put("t1", [("image_1_1.jpeg", a), ("image_2_2.jpeg", b)])
+    e = store.write(b"e" * 500, "jpeg")
+    store.put("t2", [("image_1_1.jpeg", a), ("image_2_2.jpeg", e)])
+    assert store.size == 2500
+    assert store.count == 2
+
+    # t2 becomes the least recently used, and goes first past the budget
+    store.get("t1")
+    c = store.write(b"c" * 1500, "jpeg")
+    store.put("t3", [("image_1_1.jpeg", c)])
+    assert store.artifacts() == {"t1", "t3"}
+    assert os.path.exists(store.get_path(a))
+    assert not os.path.exists(store.get_path(e))
+
+    store.remove("t1")
+    assert not os.path.exists(store.get_path(a))
+    assert store.size == 1500
+
+
+def test_sweep_drops_expired(store: TrioArtifactStore):
+    store.put("old", [("image_1_1.jpeg", store.write(b"o", "jpeg"))])
+    store.put("new", [("image_1_1.jpeg", store.write(b"n", "jpeg"))])
+    store.db.execute("UPDATE artifacts SET created = 0 WHERE artifact = 'old'")
+    store.db.commit()
+
+    assert store.sweep() == 1
+    assert store.artifacts() == {"new"}
+
+
+def test_bundle_off_the_loop_thread(store: TrioArtifactStore):
+    blob = store.write(b"a" * 1000, "jpeg")
+    store.put("t1", [("image_1_1.jpeg", blob)])
+
+    async def fetch():
+        entries = store.get("t1")
+        return await asyncio.to_thread(store.bundle, entries)
+
+    archive = zipfile.ZipFile(asyncio.run(fetch()))
+    assert archive.read("image_1_1.jpeg") == b"a" * 1000
+    assert archive.getinfo("image_1_1.jpeg").compress_type == zipfile.ZIP_STORED
+
+
+def test_archive_drops_missing_blobs(store: TrioArtifactStore):
+    blob = store.write(b"a", "jpeg")
+    store.put("t1", [("image_1_1.jpeg", blob)])
+    os.remove(store.get_path(blob))
+
+    assert store.archive("t1") is None
+    assert store.artifacts() == set()
+
+
+def test_legacy_zips_swept_once(tmp_path):
+    (tmp_path / "1700000000.zip").write_bytes(b"x")
+    store = TrioArtifactStore(str(tmp_path), 1 << 20, 7)
+    store.close()
+    assert not (tmp_path / "1700000000.zip").exists()
+
+    (tmp_path / "1700000001.zip").write_bytes(b"x")
+    store = TrioArtifactStore(str(tmp_path), 1 << 20, 7)
+    store.close()
+    assert (tmp_path / "1700000001.zip").exists()